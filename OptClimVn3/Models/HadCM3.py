@@ -112,6 +112,14 @@ class HadCM3(Model):
 
 
 
+    def files_to_copy(self) -> typing.List[pathlib.Path]:
+        """
+        HadCM3 version of files_to_copy. Adds the post-processing file, which is written to, to
+          the superclass list.
+        :return: list of paths
+        """
+        return super().files_to_copy() + [pathlib.Path(self.post_process_file)]
+
     def perturb(self, parameters: typing.Optional[dict] = None):
         """
         Perturb HadCM3 model. Default works through up to 6 parameters then gives up!
@@ -136,10 +144,20 @@ class HadCM3(Model):
         completed. This code also modifies the UM so that when a NRUN is finished it automatically runs the
         continuation case. This HadCM3 implementation generates a file call optclim_finished which is sourced by
         SCRIPT. SCRIPT needs to be modified to actually do this. (See modifySCRIPT).
+        If post_process['incremental'] is True then incremental post-processing is ran, in the background, each time
+          the file is sourced so the model is not held up. Output goes to incremental_pp.log in the model directory.
+          It can overlap the final post-processing. The post-processing script should lock its state
+          (comp_sim_obs.incremental_means does) so they take turns.
+          See Model.incremental_process.
         :param set_status_cmd. path to set_status_cmd
         """
         # postProcessCmd is the command that gets run when the model has finished. It should release_job the post-processing!
         outFile = self.model_dir / self.post_process_file  # needs to be same as used in SCRIPT which actually calls it
+        incremental_cmd = ''
+        if self.post_process.get('incremental', False):  # post-process output from this segment.
+            log_file = self.model_dir / 'incremental_pp.log'
+            incremental_cmd = (f"nohup {set_status_cmd} --incremental {str(self.config_path)} "
+                               f">> {log_file} 2>&1 & ## code inserted")
         # Eddie does not require login in to a login node to subbmit jobs
         with open(outFile, 'w') as fp:
             print(
@@ -148,6 +166,7 @@ class HadCM3(Model):
     # 1) releases the post-processing script when the whole simulation has finished.
     # 2) When the job has finished (first time) submits a continuation run.
     # I (SFBT) suspect it is rather hard wired for eddie. But will see later.
+    {incremental_cmd}
     export OUTPUT=$TEMP/output_test_finished.$$ # where the output goes
     export RSUB=$TEMP/rsub1.$$
     qshistprint $PHIST $RSUB # get the status info from the history file
@@ -193,6 +212,9 @@ class HadCM3(Model):
         for f in ['*.astart', '*.ostart']:  # possible start files
             files = ref_workDir.glob(f)
             for file in files:
+                if (workDir / file.name).exists():  # already created (copied or linked) by create_model
+                    my_logger.debug(f"{file.name} already in {workDir}")
+                    continue
                 try:
                     shutil.copy(file, workDir)
                     my_logger.debug(f"Copied {file} to {workDir}")
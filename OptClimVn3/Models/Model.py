@@ -3,28 +3,95 @@ Class for abstract Model and namelists.
 """
 from __future__ import annotations
 
+import ast
 import copy
+import datetime
+import functools
+import importlib
+import importlib.util
 import logging
 import os
 import pathlib
 import shutil
+import subprocess
+import time
 import typing
+import concurrent.futures
 
 import numpy as np
 import pandas as pd
 import xarray
 
 import json
+import genericLib
 from model_base import journal
 from ModelBaseClass import ModelBaseClass, register_param
 from namelist_var import namelist_var
-from engine import abstractEngine
+from engine import abstractEngine, rate_limiter
 my_logger = logging.getLogger(f"OPTCLIM.{__name__}")
 
 type_status = typing.Literal['CREATED', 'INSTANTIATED', 'SUBMITTED',
                              'RUNNING', 'FAILED', 'PERTURBED', 'CONTINUE',
                              'SUCCEEDED', 'PROCESSED']  # allowed strings for status
 
+
+@functools.lru_cache(maxsize=None)
+def post_process_function(script: str) -> typing.Optional[typing.Callable]:
+    """
+    Return the post_process function from a post-processing script so it can be called without starting a new
+      python. See comp_sim_obs.post_process for the signature.
+    Only scripts with a top-level post_process function are imported, so scripts that do all their work when
+      imported (e.g. pp_simple_model.py) are never ran by this.
+    Cached so each script is only imported once in a process.
+    :param script: path to the script
+    :return: post_process function or None if script does not have one.
+    """
+    path = pathlib.Path(script)
+    if path.suffix != '.py':
+        return None
+    tree = ast.parse(path.read_text())
+    if not any(isinstance(node, ast.FunctionDef) and node.name == 'post_process' for node in tree.body):
+        return None
+    spec = importlib.util.spec_from_file_location(f"optclim_pp_{path.stem}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    my_logger.info(f"Imported post_process from {path}")
+    return module.post_process
+
+
+@functools.lru_cache(maxsize=None)
+def post_process_entry_point(entry_point: str) -> typing.Callable:
+    """
+    Import a post-processing plugin. Cached so each module is only imported once in a process.
+    :param entry_point: module:function. module must be importable (on sys.path).
+      function is called as function(model_dir, post_process) and returns the simulated obs as a pd.Series or dict.
+    :return: the function.
+    """
+    module_name, sep, fn_name = entry_point.partition(':')
+    if (not sep) or (not module_name) or (not fn_name):
+        raise ValueError(f"entry_point {entry_point} should be module:function")
+    module = importlib.import_module(module_name)
+    fn = getattr(module, fn_name)
+    my_logger.info(f"Imported post-processing entry point {entry_point}")
+    return fn
+
+
+def _batch_process_model(config_path: pathlib.Path) -> str:
+    """
+    Post-process one model in the current process. Used by Model.batch_process
+    :param config_path: path to model configuration
+    :return: status of model after processing.
+    """
+    model = Model.load_model(config_path)
+    if model.status != 'SUCCEEDED':
+        my_logger.warning(f"Model {model.name} has status {model.status} so not processing")
+        return model.status
+    pp_fn = None
+    if (model.post_process_cmd_script is not None) and (not model.post_process.get('entry_point')):
+        pp_fn = post_process_function(str(model.post_process_cmd_script[-3]))  # cmd is [interp] script input output
+    model.process(pp_fn=pp_fn)
+    return model.status
+
 class Model(ModelBaseClass, journal):
     # type definitions for attributes.
     name: str
@@ -41,7 +108,9 @@ class Model(ModelBaseClass, journal):
     run_info: dict
     engine: abstractEngine
     pp_jid: typing.Optional[str]
+    shared_pp: bool
     model_jids: list[str]
+    job_times: list[dict]
     submitted_jid: typing.Optional[str]
     submit_script: pathlib.Path
     continue_script: pathlib.Path
@@ -71,7 +140,10 @@ class Model(ModelBaseClass, journal):
         set_status_script -- path to script that sets_status. Your model will need to call this.
         engine -- submission engine.
         pp_jid -- post-processing job id. This gets released when model status changes to SUCCEEDS
+        shared_pp -- If True the post-processing job is shared with other models. See Model.process_models.
         model_jids -- list of model job ids.
+        job_times -- list of dicts recording start & end times of model and post-processing jobs.
+           See record_job_time.
         
         Private attributes:
           _post_process_input -- name of input file for post-procesing
@@ -210,7 +282,9 @@ class Model(ModelBaseClass, journal):
         if run_info is not None:
             self.run_info = copy.deepcopy(run_info)  # copy the run_info into Model.
         self.model_jids = []  # list of all model job ids running came across.
+        self.job_times = []  # start/end times of jobs. Used to estimate how much time future jobs need.
         self.pp_jid = None  # post-processing job id
+        self.shared_pp = False  # post-processing job is not shared with other models.
         self.submitted_jid = None  # job id of last submitted model submitted.
         # setup submit and continue script
         self.submit_script = pathlib.Path("submit.sh")
@@ -236,8 +310,10 @@ class Model(ModelBaseClass, journal):
         If dict must include:
             script -- full path to script to run. Will be passed through self.expand to expand vars and user id.
              Will be checked for existence, and if script_interp is not None,  for execute permission.
-            If None/not present will raise an error
+            If None/not present will raise an error unless entry_point is provided.
         post_process can include
+            entry_point -- module:function of a plugin that process calls in this python process
+                rather than running script. See process. Kept in self.post_process.
             interp -- if not None the name of the interpreter.
             input_file -- name of input file for post-processing. If None will be input.json
                  post-processing info will be written to that file so post processor has access to it
@@ -253,8 +329,11 @@ class Model(ModelBaseClass, journal):
             return
         pp = copy.deepcopy(post_process)
         script = pp.pop('script', None)
-        if script is None:
-            raise ValueError("No script in post_process")
+        entry_point = pp.get('entry_point')
+        if entry_point is not None and len(entry_point.split(':')) != 2:
+            raise ValueError(f"entry_point {entry_point} should be module:function")
+        if script is None and entry_point is None:
+            raise ValueError("No script or entry_point in post_process")
 
         interp = pp.pop('interp', None)
         input_file = pp.pop('input_file', 'input.json')
@@ -262,6 +341,10 @@ class Model(ModelBaseClass, journal):
 
         self._post_process_input = input_file
         self._post_process_output = output_file
+        if script is None:  # only have an entry point.
+            self.post_process_cmd_script = None
+            self.post_process = pp
+            return
         script = self.expand(script)
         # check script is read/executable by us raising errors if not.
         ok = script.is_file()
@@ -387,10 +470,32 @@ class Model(ModelBaseClass, journal):
         """
         Create a new model by copying reference. Overwrite (and call superclass) for your own model.
         For example if you want to modify your reference model.
+        If self.run_info['instantiate_method'] is 'link' then large files are reflinked, or if that is not possible,
+          linked rather than copied. Small files (less than self.run_info['link_min_size'] bytes; default 1 Mbyte)
+          and those from self.files_to_copy() are copied. See genericLib.link_tree.
+          Otherwise (the default) the whole reference directory is copied.
         :return:nothing.
         """
         self.model_dir.mkdir(parents=True, exist_ok=True)  # create the directory if needed.
-        shutil.copytree(self.reference, self.model_dir, symlinks=True, dirs_exist_ok=True)  # copy from reference.
+        method = self.run_info.get('instantiate_method', 'copy')
+        if method == 'link':
+            counts = genericLib.link_tree(self.reference, self.model_dir, copy_files=self.files_to_copy(),
+                                          min_size=self.run_info.get('link_min_size', 2 ** 20))
+            my_logger.info(f"Created {self.model_dir} from {self.reference} with {counts}")
+        elif method == 'copy':
+            shutil.copytree(self.reference, self.model_dir, symlinks=True, dirs_exist_ok=True)  # copy from reference.
+        else:
+            raise ValueError(f"Unknown instantiate_method {method}")
+
+    def files_to_copy(self) -> typing.List[pathlib.Path]:
+        """
+        Files (relative to model_dir) that are modified in place so must be copied, not linked,
+          when the model is created. Override if your model modifies other files in place.
+          Files replaced (as done by fileinput with inplace=True and namelist_var.nl_modify) do not need copying.
+        :return: list of paths. This implementation returns the submit and continue scripts as
+          their permissions get changed by instantiate.
+        """
+        return [pathlib.Path(file) for file in [self.submit_script, self.continue_script] if file is not None]
 
     def set_status(self, new_status: type_status, check_existing: bool = True) -> None:
         """
@@ -414,8 +519,60 @@ class Model(ModelBaseClass, journal):
         my_logger.debug(f"Changing status from {self.status} to {new_status}")
         self.update_history(f"Status set to {new_status} in {self.model_dir}")
         self.status = new_status
+        self.record_job_time(new_status, self.last_history_key())  # time of the status change.
         self.dump_model()  # write to disk
 
+    def record_job_time(self, new_status: type_status, when: str) -> None:
+        """
+        Record start and end times of jobs in self.job_times. Each entry is a dict with keys
+          job ('model' or 'post_process'), start, end and status. Times are strings as used for history.
+        RUNNING starts a model job, SUCCEEDED or FAILED ends it. PROCESSED ends the post-processing job
+           which is started by self.process. Nothing is recorded for faked models.
+        :param new_status: status the model has been set to.
+        :param when: time of the status change.
+        :return: Nothing
+        """
+        if self.fake:
+            return
+        if new_status == 'RUNNING':
+            self.job_times.append(dict(job='model', start=when, end=None, status=None))
+            return
+        job = dict(SUCCEEDED='model', FAILED='model', PROCESSED='post_process').get(new_status)
+        if job is None:
+            return
+        # find the last unfinished job of this type
+        for entry in reversed(self.job_times):
+            if (entry['job'] == job) and (entry['end'] is None):
+                entry['end'] = when
+                entry['status'] = new_status
+                break
+
+    def job_runtimes(self, job: typing.Literal['model', 'post_process'] = 'model') -> typing.List[float]:
+        """
+        Run times of jobs that completed successfully.
+        Model jobs which FAILED (e.g. ran out of time and needed continuing) are not included.
+        :param job: type of job -- 'model' or 'post_process'
+        :return: list of runtimes in seconds.
+        """
+        runtimes = []
+        for entry in self.job_times:
+            if (entry['job'] != job) or (entry['end'] is None) or (entry['status'] == 'FAILED'):
+                continue
+            delta = datetime.datetime.fromisoformat(entry['end']) - datetime.datetime.fromisoformat(entry['start'])
+            runtimes.append(delta.total_seconds())
+        return runtimes
+
+    def run_duration(self) -> typing.Optional[str]:
+        """
+        Length of simulation the model does. Used to group models when working out job times.
+         This default uses the RUN_TARGET parameter. Override for your own model if needed.
+        :return: duration as a string or None if not known.
+        """
+        duration = self.parameters.get('RUN_TARGET')
+        if duration is not None:
+            duration = str(duration)
+        return duration
+
     def instantiate(self) -> None:
         """
         Run create_model and set_params, update status.
@@ -449,6 +606,8 @@ class Model(ModelBaseClass, journal):
 
     def submit_model(self,
                      fake_function: typing.Optional[typing.Callable[[dict], pd.Series]] = None,
+                     pp_jid: typing.Optional[str] = None,
+                     limiter: typing.Optional[rate_limiter] = None
                      ) -> typing.Optional[str]:
         """
         Submit a model and its post-processing.
@@ -459,6 +618,11 @@ class Model(ModelBaseClass, journal):
           Instead, this function will be used to generate fake obs.
           Designed for testing code that runs whole algorithms.
           Takes one argument -- dict of parameters. Returns pandas series.
+        :param pp_jid -- if provided, the job id of an (already submitted and held) job that post-processes
+          many models including this one. No post-processing job will be submitted. See Model.process_models.
+          For a model being continued this replaces its existing post-processing job.
+        :param limiter -- if provided, limiter.wait() is called before each command sent to the job system.
+          Used by SubmitStudy.submit_models to limit the rate of submissions.
 
         :return: The jobid of the post-process job submitted. (If a post-processing job submitted)
             Post processing runs after the model has completed.
@@ -468,9 +632,9 @@ class Model(ModelBaseClass, journal):
          model.submit_model()
         """
         status: type_status = 'SUBMITTED'
-        pp_jid = None  # unless we do something will have no pp job.
         # deal with fake_function.
         if fake_function:  # handle fake function
+            pp_jid = None  # no post-processing job
             self.pp_jid = None  # no cmd to run as we just run it!
             self.simulated_obs = fake_function(self.parameters).rename(self.name)  # compute the simulated_obs
             if not isinstance(self.simulated_obs, pd.Series):
@@ -492,10 +656,18 @@ class Model(ModelBaseClass, journal):
 
         # Actually running a model now
         # first sort out the post-processing.
-        if self.is_continuable():  # Model would like to continue. So no pp submission.
+        if self.is_continuable() and (pp_jid is None):  # Model would like to continue. So no pp submission.
             # But check have a pp_jid and fail if not
             if self.pp_jid is None:
                 raise ValueError(f"self.pp_jid is None. Should be set to a job id of a post-processing job")
+            pp_jid = None  # no post-processing job submitted.
+        elif pp_jid is not None:  # post-processing done by a job shared with other models.
+            # self.pp_jid should be None unless continuing when a new shared job replaces the old one.
+            if (self.pp_jid is not None) and (not self.is_continuable()):
+                raise ValueError(f"Have pp_jid {self.pp_jid} should be None")
+            self.pp_jid = pp_jid
+            self.shared_pp = True
+            my_logger.debug(f"Post-processing for {self.name} done by shared job {pp_jid}")
         else:  # starting so generate and submit a post processing job.
             if self.pp_jid is not None:  # self.pp_jid should be None. Fail if not!
                 raise ValueError(f"Have pp_jid {self.pp_jid} should be None")
@@ -515,6 +687,8 @@ class Model(ModelBaseClass, journal):
             # note the post-processing is submitted "held".It needs to be released once the model
             # has actually finished. That could require multiple simulations. So we don't hold it on the model
             # and instead will explicitly release it when status gets set to SUCCEEDED
+            if limiter is not None:
+                limiter.wait()
             output = self.run_cmd(pp_cmd)  # submit the post-processing job.
             my_logger.debug(f"post-processing run {pp_cmd} and got {output}")
             pp_jid = self.engine.job_id(output)  # extract the job-ID.
@@ -524,6 +698,8 @@ class Model(ModelBaseClass, journal):
         # Model has been modified so that will run model.set_status("SUCCEEDED")
         # which will release the post-processing job.
         cmd = self.submit_cmd()  # cmd that submits the model.
+        if limiter is not None:
+            limiter.wait()
         output = self.run_cmd(cmd)  # and run the command
         jid = self.engine.job_id(output)  # and work out the job id.
         self.submitted_jid = jid  # model will
@@ -620,6 +796,7 @@ class Model(ModelBaseClass, journal):
         self.set_params()  # set parameter values
         self.update_history(f'Perturbed using {parameters}')  # so at least we can find out what was done
         self.perturb_count += 1
+        self.clear_post_process_state()  # output will be rewritten so sums from it are no longer valid.
         self.set_status('PERTURBED')
         my_logger.debug(f" parameters_no_key is now {self.parameters_no_key}")
 
@@ -636,8 +813,22 @@ class Model(ModelBaseClass, journal):
         Mark simulation as restarting -- "instantiated"
         :return: nda
         """
+        self.clear_post_process_state()  # output will be rewritten so sums from it are no longer valid.
         self.set_status("INSTANTIATED")
 
+    def clear_post_process_state(self) -> typing.Optional[pathlib.Path]:
+        """
+        Remove the state file (post_process['state_file'], default post_process_state.json, in the model directory)
+          used by incremental post-processing. See Model.incremental_process.
+        :return: path to state file if it was removed, None otherwise.
+        """
+        state_file = self.model_dir / self.post_process.get('state_file', 'post_process_state.json')
+        if not state_file.exists():
+            return None
+        state_file.unlink()
+        my_logger.info(f"Removed incremental post-processing state {state_file}")
+        return state_file
+
     def succeeded(self):
         """
         Run the post-processing job by releasing self.jid
@@ -647,7 +838,17 @@ class Model(ModelBaseClass, journal):
 
         status: type_status = 'SUCCEEDED'
 
-        if self.pp_jid is not None:
+        if self.shared_pp:
+            # shared post-processing job. Only needs releasing by the first model to succeed.
+            output = None
+            if self.engine.job_status(self.pp_jid) == 'Held':
+                cmd = self.engine.release_job(self.pp_jid)
+                try:
+                    output = self.run_cmd(cmd)
+                    my_logger.info(f"Released shared post-processing job with {cmd}")
+                except subprocess.CalledProcessError:  # another model might have released it first.
+                    my_logger.warning(f"Failed to release shared post-processing job {self.pp_jid}")
+        elif self.pp_jid is not None:
             # release_job the post-processing job.
             cmd = self.engine.release_job(self.pp_jid)
             result = self.run_cmd(cmd)
@@ -661,7 +862,7 @@ class Model(ModelBaseClass, journal):
         self.set_status(status)
         return output
 
-    def process(self):
+    def process(self, pp_fn: typing.Optional[typing.Callable] = None):
         """
         Run the post-processing, store output and set status to COMPLETED.
         "Contract" for a post-processing script
@@ -670,6 +871,12 @@ class Model(ModelBaseClass, journal):
          arg#1 needs json.load to read the json file. Code should expect a dict and use the postProcess entry.
              This allows it ot read in and act on a StudyConfig file.
          arg#2 can be .json or .csv or .nc
+        If post_process has an entry_point (module:function) and pp_fn is None then that function is imported
+          (once per process, see post_process_entry_point) and called as function(model_dir, post_process).
+          It should return the simulated observations as a pd.Series (or dict) which are stored directly
+          so no interpreter is started and no files are written or read.
+        :param pp_fn: If not None a function to call rather than running the post-processing script.
+           Called as pp_fn(input_file, output_file, model_dir=self.model_dir). See batch_process.
         :return: output from post-processing.
         """
         status: type_status = 'PROCESSED'
@@ -677,21 +884,152 @@ class Model(ModelBaseClass, journal):
             self.set_status(status)  # just update the status
             return
 
+        self.job_times.append(dict(job='post_process', start=str(self.now()), end=None, status=None))
+        entry_point = self.post_process.get('entry_point')
+        if (pp_fn is None) and entry_point:  # in-process plugin.
+            fn = post_process_entry_point(entry_point)
+            result = self.set_simulated_obs(fn(self.model_dir, copy.deepcopy(self.post_process)))
+            my_logger.info(f"Processed {self.name} using {entry_point}")
+            self.set_status(status)
+            return result
+        self.write_post_process_input()
+        post_process_output = self.model_dir / self._post_process_output
+        if pp_fn is None:
+            result = self.run_cmd(self.post_process_cmd_script, cwd=self.model_dir)  #
+        else:
+            result = pp_fn(self.model_dir / self._post_process_input, post_process_output, model_dir=self.model_dir)
+
+        # get in the simulated obs which also sets them 
+        self.read_simulated_obs(post_process_output)
+        self.set_status(status)
+        return result
+
+    def write_post_process_input(self) -> pathlib.Path:
+        """
+        Dump the post-processing dict (wrapped in a dict with key postProcess) for the post-processing to pick up.
+        :return: path to file written.
+        """
         input_file = self.model_dir / self._post_process_input  # generate json file to hold post process info
         my_logger.debug(f"Dumping post_process to {input_file}")
         output = dict(postProcess=self.post_process)  # wrap post process in dict
         with open(input_file, 'w') as fp:
             json.dump(output, fp)
-        # dump the post-processing dict for the post-processing to  pick up.
+        return input_file
 
-        post_process_output = self.model_dir / self._post_process_output
-        result = self.run_cmd(self.post_process_cmd_script, cwd=self.model_dir)  #
-
-        # get in the simulated obs which also sets them 
-        self.read_simulated_obs(post_process_output)
-        self.set_status(status)
+    def incremental_process(self) -> typing.Optional[str]:
+        """
+        Run the post-processing while the model is running so that when the model has finished
+          post-processing (see process) only has to deal with the last bit of output.
+        Only done if post_process['incremental'] is True. Then the post-processing script is ran with an
+          extra --incremental argument. It should update its own state and not write the output file.
+        Status is not changed and the model configuration is not written. So this can be ran from the running model
+          (see HadCM3.createPostProcessFile)
+        :return: output from post-processing or None if not incremental post-processing.
+        """
+        if self.fake or (not self.post_process.get('incremental', False)):
+            return None
+        if self.post_process_cmd_script is None:  # only have an entry_point.
+            my_logger.warning(f"No post-processing script for {self.name} so no incremental post-processing")
+            return None
+        self.write_post_process_input()
+        result = self.run_cmd(self.post_process_cmd_script + ['--incremental'], cwd=self.model_dir)
+        my_logger.info(f"Ran incremental post-processing for {self.name}")
         return result
 
+    @classmethod
+    def process_models(cls,
+                       config_paths: typing.List[pathlib.Path],
+                       max_workers: int = 1,
+                       poll_interval: float = 60.,
+                       max_wait: typing.Optional[float] = None,
+                       wait_failed: bool = True) -> dict:
+        """
+        Post-process many models in one job. Models are processed, using a pool of threads,
+          as they become SUCCEEDED. Returns once every model has been PROCESSED (or FAILED if wait_failed is False)
+           or after max_wait seconds.
+        This lets one job (see SubmitStudy.submit_all_models) replace the held post-processing job for each model.
+        :param config_paths: paths to model configurations.
+        :param max_workers: maximum number of models to process at once.
+        :param poll_interval: time (seconds) to wait between checking model status.
+        :param max_wait: If not None the maximum time (seconds) to wait for models to become SUCCEEDED.
+        :param wait_failed: If True (default) keep waiting on FAILED models as they can be continued (or perturbed)
+          and resubmitted. Otherwise FAILED models are treated as finished.
+        :return: dict of final status indexed by config path. Models that failed to process or
+          are still waiting have status 'FAILED' or their current status.
+        """
+        pending = list(config_paths)
+        result = dict()
+        futures = dict()
+        start = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                for path in list(pending):
+                    try:
+                        model = cls.load_model(path)
+                    except (OSError, ValueError):  # being written by the model. Try again later.
+                        my_logger.debug(f"Failed to read {path}. Will retry")
+                        continue
+                    if model.status == 'SUCCEEDED':
+                        futures[executor.submit(model.process)] = (path, model)
+                        pending.remove(path)
+                    elif (model.status == 'PROCESSED') or ((model.status == 'FAILED') and not wait_failed):
+                        result[path] = model.status
+                        pending.remove(path)
+                for future in [f for f in futures if f.done()]:
+                    path, model = futures.pop(future)
+                    try:
+                        future.result()
+                        result[path] = model.status
+                        my_logger.info(f"Processed {model.name}")
+                    except Exception as error:  # carry on processing other models.
+                        my_logger.warning(f"Post-processing {model.name} failed with {error!r}")
+                        result[path] = 'FAILED'
+                if (len(pending) == 0) and (len(futures) == 0):
+                    break
+                if (max_wait is not None) and (time.monotonic() - start > max_wait) and (len(futures) == 0):
+                    my_logger.warning(f"Gave up waiting for {len(pending)} models")
+                    for path in pending:
+                        try:
+                            result[path] = cls.load_model(path).status
+                        except (OSError, ValueError):
+                            result[path] = 'FAILED'
+                    break
+                if len(futures) > 0:  # wait till something finishes or time to check status again.
+                    concurrent.futures.wait(futures, timeout=poll_interval,
+                                            return_when=concurrent.futures.FIRST_COMPLETED)
+                else:
+                    time.sleep(poll_interval)
+
+        return {path: result[path] for path in config_paths if path in result}
+
+    @classmethod
+    def batch_process(cls,
+                      config_paths: typing.List[pathlib.Path],
+                      max_workers: int = 1) -> dict:
+        """
+        Post-process many SUCCEEDED models using a pool of processes. Where the post-processing script has a
+          post_process function (see post_process_function) it is called directly so python and its libraries
+          are only started once per worker and inputs the script caches (e.g. the land mask) are only read once.
+          Otherwise the script is ran as normal.
+        Unlike process_models this does not wait for models to succeed.
+        :param config_paths: paths to model configurations.
+        :param max_workers: maximum number of processes to use.
+        :return: dict of final status indexed by config path. Models where post-processing failed have status 'FAILED'.
+        """
+        result = dict()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_batch_process_model, path): path for path in config_paths}
+            for future in concurrent.futures.as_completed(futures):
+                path = futures[future]
+                try:
+                    result[path] = future.result()
+                    my_logger.info(f"{path} has status {result[path]}")
+                except Exception as error:  # carry on processing other models.
+                    my_logger.warning(f"Post-processing {path} failed with {error!r}")
+                    result[path] = 'FAILED'
+
+        return {path: result[path] for path in config_paths}
+
     def read_simulated_obs(self, post_process_file: pathlib.Path):
         """
         Read the post processed data.
@@ -722,6 +1060,14 @@ class Model(ModelBaseClass, journal):
             raise NotImplementedError(f"Do not recognize {fileType}")
 
         my_logger.info(f"Read {fileType} data from {post_process_file}")
+        return self.set_simulated_obs(obs)
+
+    def set_simulated_obs(self, obs: typing.Union[pd.Series, dict]) -> pd.Series:
+        """
+        Store simulated observations. Tests that nothing is null.
+        :param obs: simulated observations.
+        :return: simulated observations as a pandas series named after the model.
+        """
         obs = pd.Series(obs).rename(self.name)
         self.simulated_obs = obs
 
@@ -8,12 +8,19 @@ Observations generated are in genProcess (or help for script)
  """
 
 import argparse  # parse arguments
+import fcntl
+import functools
+import hashlib
 import json  # get JSON library
 import os  # OS support
 import pathlib
 import re
+import tempfile
+import time
+import typing
 
 import numpy as np
+import pandas as pd
 import xarray
 
 import json
@@ -306,6 +313,275 @@ def means(dataArray, name, latitude_coord=None):
     return means  # means are what we want
 
 
+def region_weights(latitude: xarray.DataArray) -> xarray.DataArray:
+    """
+    Compute cos(latitude) weights for all regions used by means.
+    Regions are GLOBAL, NHX (>30N), TROPICS (30S-30N) and SHX (<30S).
+    :param latitude: latitude values
+    :return: dataArray of weights with dimensions latitude & region.
+    """
+    wt = np.cos(np.deg2rad(latitude))  # simple cos lat weighting.
+    masks = {
+        'GLOBAL': xarray.ones_like(latitude, dtype=bool),
+        'NHX': latitude > 30.0,
+        'TROPICS': (latitude >= -30) & (latitude <= 30.0),
+        'SHX': latitude < -30.0,
+    }
+    region_wt = xarray.concat([wt.where(msk, 0.0) for msk in masks.values()],
+                              dim=pd.Index(list(masks.keys()), name='region'))
+    return region_wt
+
+
+def region_sums(process: dict, latitude_coord: typing.Optional[str] = None,
+                weights: typing.Optional[xarray.DataArray] = None) -> (dict, dict):
+    """
+    Compute the weighted sums and sums of weights needed for the regional means for every dataArray in process
+      in one pass through the data.
+    Each dataArray is reduced to sums and counts as a function of latitude. These are stacked and the
+      regional sums computed from one cos-lat weight matrix (see region_weights).
+    As sums can be added, sums from different times can be accumulated (see incremental_means)
+    :param process: dict of dataArrays. Any that are None are skipped.
+    :param latitude_coord: name of the latitude co-ord. Default is None.
+            If not set then guess_lat_long_vert_names() will be used for each dataArray
+    :param weights: precomputed region weights (see grid_metadata). Used if they include all the latitudes.
+    :return: dicts of weighted sums and of sum of weights with names name_region
+    """
+    sums = dict()
+    counts = dict()
+    for name, dataArray in process.items():
+        if dataArray is None:
+            continue
+        lat_name = latitude_coord
+        if lat_name is None:
+            lat_name, lon, vert = guess_lat_lon_vert_names(dataArray)
+        da = dataArray.squeeze(drop=True)
+        if lat_name != 'latitude':  # common name so all variables can be stacked.
+            da = da.rename({lat_name: 'latitude'})
+        other_dims = [d for d in da.dims if d != 'latitude']
+        sums[name] = da.fillna(0.0).sum(other_dims)
+        counts[name] = da.notnull().sum(other_dims)
+
+    if len(sums) == 0:
+        return dict(), dict()
+    names = pd.Index(list(sums.keys()), name='variable')
+    # stack on the union of latitudes. Missing latitudes contribute nothing.
+    stack = lambda values: xarray.concat(list(values), dim=names, join='outer', coords='minimal',
+                                         compat='override', fill_value=0.0)
+    reduced = xarray.Dataset(dict(sums=stack(sums.values()), counts=stack(counts.values())))
+    reduced = reduced.drop_vars([c for c in reduced.coords if c not in reduced.dims]).compute()  # one pass.
+    if (weights is not None) and np.all(np.isin(reduced.latitude.values, weights.latitude.values)):
+        region_wt = weights.sel(latitude=reduced.latitude.values).assign_coords(latitude=reduced.latitude)
+    else:
+        region_wt = region_weights(reduced.latitude)
+    wt_sums = (reduced.sums * region_wt).sum('latitude')
+    wts = (reduced.counts * region_wt).sum('latitude')
+    result_sums = dict()
+    result_wts = dict()
+    for name in names:
+        for rgn_name in wt_sums.region.values:
+            key = name + '_' + str(rgn_name)
+            result_sums[key] = float(wt_sums.sel(variable=name, region=rgn_name))
+            result_wts[key] = float(wts.sel(variable=name, region=rgn_name))
+    return result_sums, result_wts
+
+
+def all_means(process: dict, latitude_coord: typing.Optional[str] = None,
+              weights: typing.Optional[xarray.DataArray] = None) -> dict:
+    """
+    Compute the same regional means as means for every dataArray in process in one pass through the data.
+    As the weights only depend on latitude this gives the same values as means. See region_sums.
+    :param process: dict of dataArrays. Any that are None are skipped.
+    :param latitude_coord: name of the latitude co-ord. Default is None.
+            If not set then guess_lat_long_vert_names() will be used for each dataArray
+    :param weights: precomputed region weights (see grid_metadata).
+    :return: dict of means with names name_region
+    """
+    sums, wts = region_sums(process, latitude_coord=latitude_coord, weights=weights)
+    return {key: sums[key] / wts[key] if wts[key] > 0 else np.nan for key in sums.keys()}
+
+
+class _recording_dataset:
+    """
+    Wrap a dataset and record which variables are accessed. Used by required_variables.
+    """
+
+    def __init__(self, dataset: xarray.Dataset):
+        self._dataset = dataset
+        self.accessed = set()
+
+    def __getitem__(self, name):
+        self.accessed.add(name)
+        return self._dataset[name]
+
+    def get(self, name, default=None):
+        if name in self._dataset.variables:
+            self.accessed.add(name)
+        return self._dataset.get(name, default)
+
+    def __getattr__(self, name):
+        value = getattr(self._dataset, name)
+        if name in self._dataset.variables:
+            self.accessed.add(name)
+        return value
+
+
+def required_variables(dataset: xarray.Dataset, process_fn: typing.Callable = None, *args, **kwargs) -> set:
+    """
+    Work out which data variables process_fn (default genProcess) uses by running it on a (lazily opened) dataset.
+    No data is computed as long as dataset is lazy (e.g. opened with chunks={}).
+    :param dataset: dataset to run process_fn on.
+    :param process_fn: function to run. Called as process_fn(dataset,*args,**kwargs)
+    :return: set of names of data variables needed.
+    """
+    if process_fn is None:
+        process_fn = genProcess
+    recorder = _recording_dataset(dataset)
+    process_fn(recorder, *args, **kwargs)
+    return recorder.accessed & set(dataset.data_vars)
+
+
+def files_in_window(files: list[pathlib.Path], start_time, end_time) -> list[pathlib.Path]:
+    """
+    Return files which have some times between start_time and end_time. Only metadata and time are read.
+    Files without a time co-ordinate are kept.
+    :param files: list of files
+    :param start_time: start time. If None no lower limit.
+    :param end_time: end time. If None no upper limit.
+    :return: list of files that overlap the time window.
+    """
+    keep = []
+    for file in files:
+        with xarray.open_dataset(file) as ds:  # lazy so only reads metadata and time.
+            # selecting handles strings and non-standard (cftime) calendars.
+            if ('time' not in ds.coords) or (ds.sortby('time').time.sel(time=slice(start_time, end_time)).size > 0):
+                keep.append(file)
+    return keep
+
+
+def open_data(files: list[pathlib.Path], land_mask, start_time, end_time, latitude_coord=None,
+              process_fn: typing.Callable = None) -> xarray.Dataset:
+    """
+    Open the data needed by genProcess lazily. Files outside the time window are skipped and only the variables
+     genProcess uses are opened. Data is not loaded so reduction (see all_means) streams through the files.
+    :param files: list of files
+    :param land_mask: land mask as a dataArray (passed to genProcess)
+    :param start_time: start time
+    :param end_time: end time
+    :param latitude_coord: name of latitude co-ord (passed to genProcess)
+    :param process_fn: function used to work out variables needed. Default is genProcess
+    :return: dataset
+    """
+    files = files_in_window(files, start_time, end_time)
+    if len(files) == 0:
+        raise ValueError(f"No files between {start_time} and {end_time}")
+    with xarray.open_dataset(files[0], chunks={}) as ds:
+        required = required_variables(ds, process_fn, land_mask, latitude_coord=latitude_coord)
+    preprocess = lambda ds: ds[sorted(required & set(ds.data_vars))]
+    dataset = xarray.open_mfdataset(files, preprocess=preprocess).sortby('time')
+    # sortby is really important as want co-ords to be monotonic
+    return dataset.sel(time=slice(start_time, end_time))
+
+
+def state_settings(start_time, end_time, land_mask=None, latitude_coord=None,
+                   process_fn: typing.Callable = None, weights: typing.Optional[xarray.DataArray] = None) -> dict:
+    """
+    Settings that incremental sums depend on. Stored in the state file so stale sums are not reused.
+    :param start_time: start time
+    :param end_time: end time
+    :param land_mask: land mask (data is hashed)
+    :param latitude_coord: name of latitude co-ord
+    :param process_fn: function that generates the dataArrays (name and code are hashed)
+    :param weights: precomputed region weights (data is hashed)
+    :return: dict of strings (so survives json round trip)
+    """
+
+    def digest(value) -> typing.Optional[str]:
+        if value is None:
+            return None
+        return hashlib.sha256(np.ascontiguousarray(np.asarray(value)).tobytes()).hexdigest()
+
+    if process_fn is None:
+        process_fn = genProcess
+    code = getattr(process_fn, '__code__', None)
+    fn_id = f"{getattr(process_fn, '__module__', '')}.{getattr(process_fn, '__qualname__', repr(process_fn))}"
+    if code is not None:
+        fn_id += ':' + hashlib.sha256(code.co_code + repr(code.co_consts).encode()).hexdigest()
+    return dict(start_time=str(start_time), end_time=str(end_time), land_mask=digest(land_mask),
+                latitude_coord=str(latitude_coord), process_fn=fn_id, weights=digest(weights))
+
+
+def file_signature(file: pathlib.Path) -> list:
+    """
+    :param file: file
+    :return: [size, modification time (ns)] of file. Changes when the file is rewritten.
+    """
+    stat = file.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def incremental_means(files: list[pathlib.Path], land_mask, start_time, end_time, state_file: pathlib.Path,
+                      latitude_coord=None, min_file_age: typing.Optional[float] = None,
+                      process_fn: typing.Callable = None, weights: typing.Optional[xarray.DataArray] = None) -> dict:
+    """
+    Compute regional means incrementally. Weighted sums (see region_sums) for each file are stored in state_file
+      along with the size and modification time of the file. So this can be ran while the model is running
+       and only files that are new (or have been rewritten) since the last run need to be read.
+    If the settings (see state_settings) differ from those in state_file the accumulated sums are discarded.
+    A lock (state_file.lock) is held while state_file is read and updated so runs do not overlap.
+    :param files: list of files
+    :param land_mask: land mask as a dataArray (passed to genProcess)
+    :param start_time: start time
+    :param end_time: end time
+    :param state_file: json file holding the sums for each file. Created if it does not exist.
+    :param latitude_coord: name of latitude co-ord (passed to genProcess)
+    :param min_file_age: If not None files modified less than min_file_age seconds ago are skipped
+       as they might still be being written.
+    :param process_fn: function that generates the dataArrays to be processed. Default is genProcess
+    :param weights: precomputed region weights (see grid_metadata).
+    :return: dict of means from all files processed so far.
+    """
+    if process_fn is None:
+        process_fn = genProcess
+    settings = state_settings(start_time, end_time, land_mask=land_mask, latitude_coord=latitude_coord,
+                              process_fn=process_fn, weights=weights)
+    state_file = pathlib.Path(state_file)
+    with open(state_file.with_name(state_file.name + '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)  # released when lock file closed.
+        state = None
+        if state_file.exists():
+            with open(state_file, 'r') as fp:
+                state = json.load(fp)
+            if (state.get('settings') != settings) or (not isinstance(state.get('files'), dict)):
+                print(f"Settings in {state_file} have changed. Starting again")
+                state = None
+        if state is None:
+            state = dict(settings=settings, files=dict())
+        done = state['files']  # sums for each file indexed by file name.
+        new_files = [file for file in files if done.get(file.name, {}).get('signature') != file_signature(file)]
+        if min_file_age is not None:
+            now = time.time()
+            new_files = [file for file in new_files if (now - file.stat().st_mtime) >= min_file_age]
+        for file in files_in_window(sorted(new_files), start_time, end_time):
+            dataset = open_data([file], land_mask, start_time, end_time, latitude_coord=latitude_coord,
+                                process_fn=process_fn)
+            sums, wts = region_sums(process_fn(dataset, land_mask, latitude_coord=latitude_coord),
+                                    latitude_coord=latitude_coord, weights=weights)
+            done[file.name] = dict(signature=file_signature(file), sums=sums, weights=wts)
+            # write to temp file and rename so state is always consistent.
+            fd, tmp_file = tempfile.mkstemp(dir=state_file.parent, suffix='.tmp')
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(state, fp, indent=2)
+            os.replace(tmp_file, state_file)
+
+    total_sums = dict()
+    total_weights = dict()
+    for entry in done.values():
+        for key in entry['sums'].keys():
+            total_sums[key] = total_sums.get(key, 0.0) + entry['sums'][key]
+            total_weights[key] = total_weights.get(key, 0.0) + entry['weights'][key]
+    return {key: total_sums[key] / wt if wt > 0 else np.nan for key, wt in total_weights.items()}
+
+
 def do_work():
     # parse input arguments
 
@@ -337,63 +613,156 @@ def do_work():
     parser.add_argument("-d", "--dir", help="The Name of the input directory")
     parser.add_argument("OUTPUT", nargs='?', default=None,help="The name of the output file. Will override what is in the config file")
     parser.add_argument("-v", "--verbose", help="Provide verbose output", action="count", default=0)
+    parser.add_argument("--incremental", action="store_true",
+                        help="Model is still running. Update the accumulated sums in the state file and exit")
     args = parser.parse_args()  # and parse the arguments
-    # setup processing
-    with open(args.CONFIG,'rt') as fp:
+    post_process(args.CONFIG, args.OUTPUT, data_dir=args.dir, incremental=args.incremental, verbose=args.verbose)
+
+
+def grid_signature(mask_file: pathlib.Path, mask_name: str) -> str:
+    """
+    Signature for a grid. The mask file defines the grid (latitude & longitude) so this is a hash of its contents.
+    :param mask_file: path to file containing mask
+    :param mask_name: name of mask variable
+    :return: sha256 hex digest
+    """
+    sha = hashlib.sha256(mask_name.encode())
+    with open(mask_file, 'rb') as fp:
+        for block in iter(lambda: fp.read(2 ** 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+@functools.lru_cache(maxsize=4)
+def grid_metadata(mask_file: str, mask_name: str, cache_dir: typing.Optional[str] = None) -> dict:
+    """
+    Grid information used in post-processing: land fraction (from the mask) and region weights (see region_weights)
+    If cache_dir is set then this is stored as grid_<signature>.npz (see grid_signature) in cache_dir
+      and read from there by later calls, so all models in a study share it.
+    Cached so when many models are processed in one process (see Model.batch_process) it is only done once.
+    :param mask_file: path to file containing mask
+    :param mask_name: name of mask variable
+    :param cache_dir: directory to cache in. If None no disk caching is done.
+    :return: dict with dataArrays land_fraction & region_weights
+    """
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = pathlib.Path(cache_dir) / f"grid_{grid_signature(mask_file, mask_name)}.npz"
+    if (cache_file is not None) and cache_file.exists():
+        with np.load(cache_file) as data:
+            grid = {k: data[k] for k in data.files}
+        dims = [str(d) for d in grid['dims']]
+        land_fraction = xarray.DataArray(grid['land_fraction'], dims=dims,
+                                         coords={dims[0]: grid['latitude'], dims[1]: grid['longitude']})
+    else:
+        land_fraction = xarray.load_dataset(mask_file)[mask_name].squeeze(drop=True)
+        dims = list(land_fraction.dims)
+        land_fraction = land_fraction.drop_vars([c for c in land_fraction.coords if c not in dims])
+        grid = dict(dims=np.array(dims), latitude=land_fraction[dims[0]].values,
+                    longitude=land_fraction[dims[1]].values, land_fraction=land_fraction.values)
+        grid['regions'] = region_weights(land_fraction[dims[0]]).region.values.astype(str)
+        grid['region_weights'] = region_weights(land_fraction[dims[0]]).values
+        if cache_file is not None:  # write to temp file and rename so other processes never see partial file.
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp.npz')
+            np.savez(tmp_file, **grid)
+            os.replace(tmp_file, cache_file)
+    weights = xarray.DataArray(grid['region_weights'], dims=['region', 'latitude'],
+                               coords=dict(region=grid['regions'], latitude=grid['latitude']))
+    return dict(land_fraction=land_fraction, region_weights=weights)
+
+
+def load_land_mask(mask_file: str, mask_name: str, cache_dir: typing.Optional[str] = None) -> xarray.DataArray:
+    """
+    Load land mask. Uses grid_metadata so when many models are processed it is only read once.
+    :param mask_file: path to file containing mask
+    :param mask_name: name of mask variable
+    :param cache_dir: directory to cache grid information in. See grid_metadata
+    :return: land mask as a dataArray
+    """
+    grid = grid_metadata(mask_file, mask_name, cache_dir)
+    return grid['land_fraction']  # land/sea mask
+
+
+def post_process(config_file: pathlib.Path, output_file: typing.Optional[pathlib.Path] = None,
+                 data_dir: typing.Optional[pathlib.Path] = None, model_dir: typing.Optional[pathlib.Path] = None,
+                 incremental: bool = False, verbose: int = 0) -> typing.Optional[dict]:
+    """
+    Post process a model. This is what the script does but it can also be called directly
+     (see Model.batch_process) so that many models can be processed without starting a new python for each.
+    :param config_file: json file with postProcess entry.
+    :param output_file: file to write the simulated obs to. If None postProcess['outputPath'] is used.
+    :param data_dir: directory where the netcdf data is. If None postProcess['netcdf_path'] (default nc/apm)
+        relative to model_dir is used.
+    :param model_dir: directory of the model. Relative paths are relative to this. Default is current directory.
+    :param incremental: Model is still running. Update the accumulated sums in the state file and return None.
+    :param verbose: verbosity level.
+    :return: dict of simulated obs (or None if incremental)
+    """
+    if model_dir is None:
+        model_dir = pathlib.Path.cwd()
+    model_dir = pathlib.Path(model_dir)
+    with open(config_file, 'rt') as fp:
         config = json.load(fp)
 
     options = config.get('postProcess', {})
     path = options.get('netcdf_path', 'nc/apm')
 
     # work out the files if needed
-    if args.dir is None:
-        rootdir = pathlib.Path.cwd()/path
+    if data_dir is None:
+        rootdir = model_dir/path
     else:
-        rootdir = pathlib.Path(args.dir)
+        rootdir = pathlib.Path(data_dir)
     files = list(rootdir.glob('*.nc'))
-      
-    mask_file = options['mask_file']
-    mask_file = pathlib.Path(os.path.expandvars(mask_file)).expanduser()
-    mask_name = options['mask_name']
+
     start_time = options['start_time']
     end_time = options['end_time']
-    if args.OUTPUT is None:
+    if output_file is None:
         output_file = options['outputPath']  # better be defined so throw error if not
-    else:
-        output_file = args.OUTPUT
-
-    output_file = os.path.expanduser(os.path.expandvars(output_file) )    # deal with any env vars and expand user
-
-    verbose = args.verbose
+    output_file = model_dir / os.path.expanduser(os.path.expandvars(output_file))
 
     if verbose:  # print out some helpful information..
         print("dir", rootdir)
-        print("mask_file", mask_file)
-        print("land_mask", mask_name)
+        print("mask_file", options['mask_file'])
+        print("land_mask", options['mask_name'])
         print("start_time", start_time)
         print("end_file", end_time)
         print("output", output_file)
         if verbose > 1:
             print("options are ", options)
 
-    land_mask = xarray.load_dataset(mask_file)[mask_name].squeeze()  # land/sea mask
+    mask_file = str(pathlib.Path(os.path.expandvars(options['mask_file'])).expanduser())
+    cache_dir = options.get('grid_cache')  # directory where grid information is shared between models.
+    if cache_dir is not None:
+        cache_dir = str(pathlib.Path(os.path.expandvars(cache_dir)).expanduser())
+    grid = grid_metadata(mask_file, options['mask_name'], cache_dir)
+    land_mask = load_land_mask(mask_file, options['mask_name'], cache_dir)
     latitude_coord = options.get('latitude_coord', None)
-    # code below does not work when data is on my M drive on my laptop...
-    dataset = xarray.open_mfdataset(files).sortby('time')  # sortby is really important as want co-ords to be monotonic
-    dataset = dataset.sel(time=slice(start_time, end_time))
+    if incremental or options.get('incremental', False):
+        # accumulate sums from files not already done. When the model is still running skip recent files.
+        state_file = model_dir / options.get('state_file', 'post_process_state.json')
+        min_file_age = options.get('min_file_age', 60) if incremental else None
+        results = incremental_means(files, land_mask, start_time, end_time, state_file,
+                                    latitude_coord=latitude_coord, min_file_age=min_file_age,
+                                    weights=grid['region_weights'])
+        if incremental:  # all done till the model finishes.
+            if verbose:
+                print(f"Updated {state_file}")
+            return None
+    else:
+        # only open variables and files needed. Data is read as the means are computed.
+        dataset = open_data(files, land_mask, start_time, end_time, latitude_coord=latitude_coord)
 
-    process = genProcess(dataset, land_mask, latitude_coord=latitude_coord)
+        process = genProcess(dataset, land_mask, latitude_coord=latitude_coord)
 
-    # now to process all the data making output.
-    results = dict()
-    for name, dataArray in process.items():
-        if dataArray is None:  # no dataarray for this name
-            print(f"{name} is None. Not processing")
-            continue
-        mean = means(dataArray, name, latitude_coord=latitude_coord)  # compute the means
-        results.update(mean)  # and stuff them into the results dict.
+        # now to process all the data making output.
+        for name, dataArray in process.items():
+            if dataArray is None:  # no dataarray for this name
+                print(f"{name} is None. Not processing")
+        # compute all the means in one pass.
+        results = all_means(process, latitude_coord=latitude_coord, weights=grid['region_weights'])
         if verbose > 1:
-            print(f"Processed {name} and got {mean}")
+            print(f"Processed {' '.join([k for k, v in process.items() if v is not None])}")
 
     # now fix the MSLP values. Need to remove the global mean from values and the drop the SHX value.
     results.pop('MSLP_SHX')
@@ -408,6 +777,7 @@ def do_work():
     # now to write the data
     with open(output_file, 'w') as fp:
         json.dump(results, fp, indent=2)
+    return results
 
 
 # TODO add  some test cases...
@@ -431,6 +801,150 @@ class testComp_obs_xarray(unittest.TestCase):
         Standard setup for all test cases
         :return: nada
         """
+        # a year of monthly N48 (73 x 96) data.
+        rng = np.random.default_rng(123456)
+        lat = np.linspace(-90, 90, 73)
+        lon = np.arange(0, 360, 3.75)
+        time = pd.date_range('2000-01-16', periods=12, freq='MS')
+        coords = dict(time=time, latitude=lat, longitude=lon)
+        self.process = {f'var{indx:02d}': xarray.DataArray(rng.normal(size=(12, 73, 96)), coords=coords)
+                        for indx in range(40)}
+
+    def test_all_means(self):
+        """
+        Test all_means gives the same results as means including for missing data and a subset of latitudes.
+        Also compares time taken for a year of N48 data.
+        """
+        import time
+        process = dict(self.process)
+        process['missing'] = process['var00'].where(process['var00'].longitude > 100)
+        process['subset'] = process['var01'].sel(latitude=slice(-60, 90))
+        process['none'] = None
+        process['level'] = process['var02'].expand_dims(air_pressure=[500.])  # squeezed out
+        # a region set to 1 > 30N; 2 for 30S-30N; 3 for <30S
+        lat = process['var03'].latitude
+        process['regions'] = xarray.where(lat > 30, 1.0, xarray.where(lat >= -30, 2.0, 3.0)) * \
+                             xarray.ones_like(process['var03'])
+        start = time.perf_counter()
+        expect = dict()
+        for name, dataArray in process.items():
+            if dataArray is not None:
+                expect.update(means(dataArray, name))
+        time_means = time.perf_counter() - start
+        start = time.perf_counter()
+        got = all_means(process)
+        time_all_means = time.perf_counter() - start
+        self.assertEqual(list(expect.keys()), list(got.keys()))
+        for k, v in expect.items():
+            self.assertAlmostEqual(got[k], v, places=10, msg=f"Mismatch for {k}")
+        for rgn, value in dict(NHX=1.0, TROPICS=2.0, SHX=3.0).items():
+            self.assertAlmostEqual(got['regions_' + rgn], value, places=10)
+        # and with dask.
+        got = all_means({k: v.chunk(dict(time=3)) for k, v in process.items() if v is not None})
+        for k, v in expect.items():
+            self.assertAlmostEqual(got[k], v, places=10, msg=f"Mismatch for {k}")
+        print(f"means took {time_means:.3f}s; all_means took {time_all_means:.3f}s")
+
+    def test_open_data_helpers(self):
+        """
+        Test files_in_window and required_variables.
+        """
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmpDir:
+            files = []
+            for year in [2000, 2001, 2002]:
+                ds = xarray.Dataset(dict(a=self.process['var00'], b=self.process['var01']))
+                ds = ds.assign_coords(time=pd.date_range(f'{year}-01-01', periods=12, freq='MS') + pd.Timedelta(days=15))
+                file = pathlib.Path(tmpDir) / f'data{year}.nc'
+                ds.to_netcdf(file)
+                files.append(file)
+            self.assertEqual(files_in_window(files, '2001-01-01', '2001-12-30'), files[1:2])
+            self.assertEqual(files_in_window(files, '2001-06-01', None), files[1:])
+            self.assertEqual(files_in_window(files, None, None), files)
+            with xarray.open_dataset(files[0], chunks={}) as ds:
+                required = required_variables(ds, lambda d: d['a'] * 2 + d.latitude)
+            self.assertEqual(required, {'a'})
+
+    def test_incremental_means(self):
+        """
+        Test incremental_means gives the same result as all_means on all the files, starts again when settings
+        change and re-accumulates rewritten files.
+        """
+        import tempfile
+        process_fn = lambda ds, land_mask, latitude_coord=None: dict(a=ds['a'], b=ds.get('b'))
+        with tempfile.TemporaryDirectory() as tmpDir:
+            files = []
+            for year in [2000, 2001, 2002]:
+                ds = xarray.Dataset(dict(a=self.process[f'var{year - 2000:02d}'], b=self.process['var10']))
+                ds = ds.assign_coords(time=pd.date_range(f'{year}-01-01', periods=12, freq='MS') + pd.Timedelta(days=15))
+                file = pathlib.Path(tmpDir) / f'data{year}.nc'
+                ds.to_netcdf(file)
+                files.append(file)
+            state_file = pathlib.Path(tmpDir) / 'state.json'
+            start, end = '2000-03-01', '2002-12-30'
+            # files too recent so nothing done.
+            got = incremental_means(files, None, start, end, state_file, min_file_age=3600, process_fn=process_fn)
+            self.assertEqual(got, dict())
+            incremental_means(files[0:2], None, start, end, state_file, process_fn=process_fn)
+            got = incremental_means(files, None, start, end, state_file, process_fn=process_fn)
+            with open(state_file) as fp:
+                state = json.load(fp)
+            self.assertEqual(list(state['files'].keys()), [f.name for f in files])
+            self.assertEqual(state['files'][files[0].name]['signature'], file_signature(files[0]))
+            dataset = open_data(files, None, start, end, process_fn=process_fn)
+            expect = all_means(process_fn(dataset, None))
+            self.assertEqual(list(expect.keys()), list(got.keys()))
+            for k, v in expect.items():
+                self.assertAlmostEqual(got[k], v, places=10, msg=f"Mismatch for {k}")
+            # changing settings discards the accumulated sums.
+            got_short = incremental_means(files, None, '2001-01-01', end, state_file, process_fn=process_fn)
+            with open(state_file) as fp:
+                state = json.load(fp)
+            self.assertEqual(list(state['files'].keys()), [f.name for f in files[1:]])
+            self.assertEqual(state['settings']['start_time'], '2001-01-01')
+            expect_short = all_means(process_fn(open_data(files, None, '2001-01-01', end, process_fn=process_fn), None))
+            for k, v in expect_short.items():
+                self.assertAlmostEqual(got_short[k], v, places=10, msg=f"Mismatch for {k}")
+            other_fn = lambda ds, land_mask, latitude_coord=None: dict(a=ds['a'] * 2)
+            got = incremental_means(files, None, start, end, state_file, process_fn=other_fn)
+            self.assertEqual(set(got.keys()), {k for k in expect.keys() if k.startswith('a')})
+            # rewriting a file (e.g. model restarted) means it gets accumulated again.
+            incremental_means(files, None, start, end, state_file, process_fn=process_fn)
+            ds = xarray.load_dataset(files[1])
+            ds['a'] = ds['a'] * 3
+            ds.to_netcdf(state_file.with_name('rewrite.nc'))
+            os.replace(state_file.with_name('rewrite.nc'), files[1])
+            stat = files[1].stat()
+            os.utime(files[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))  # in case of coarse timestamps.
+            got = incremental_means(files, None, start, end, state_file, process_fn=process_fn)
+            expect = all_means(process_fn(open_data(files, None, start, end, process_fn=process_fn), None))
+            self.assertNotAlmostEqual(got['a_GLOBAL'], all_means(process_fn(dataset, None))['a_GLOBAL'])
+            for k, v in expect.items():
+                self.assertAlmostEqual(got[k], v, places=10, msg=f"Mismatch for {k}")
+
+
+    def test_grid_metadata(self):
+        """
+        Test grid_metadata caches the land fraction and region weights and that they give the same means.
+        """
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmpDir:
+            mask = (self.process['var00'].isel(time=0, drop=True) > 0).astype(float).rename('land')
+            mask_file = pathlib.Path(tmpDir) / 'mask.nc'
+            mask.to_dataset().to_netcdf(mask_file)
+            cache_dir = pathlib.Path(tmpDir) / 'cache'
+            grid = grid_metadata(str(mask_file), 'land', str(cache_dir))
+            cache_file = cache_dir / f"grid_{grid_signature(mask_file, 'land')}.npz"
+            self.assertTrue(cache_file.exists())
+            grid_metadata.cache_clear()  # so read from the cache file.
+            cached = grid_metadata(str(mask_file), 'land', str(cache_dir))
+            xarray.testing.assert_allclose(cached['land_fraction'], grid['land_fraction'])
+            xarray.testing.assert_allclose(cached['region_weights'],
+                                           region_weights(mask.latitude).transpose('region', 'latitude'))
+            expect = all_means(self.process)
+            got = all_means(self.process, weights=cached['region_weights'])
+            for k, v in expect.items():
+                self.assertAlmostEqual(got[k], v, places=10, msg=f"Mismatch for {k}")
 
 
 if __name__ == "__main__":
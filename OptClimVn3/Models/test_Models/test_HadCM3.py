@@ -478,6 +478,15 @@ class testHadCM3(unittest.TestCase):
 
         self.assertEqual(cntqrls, 1, 'Expected only 1 qrls cmd')
         self.assertEqual(cntSUBCONT, 1, 'expected only 1 SUBMITCMD')
+        # with incremental post-processing the file also runs that.
+        self.model.post_process['incremental'] = True
+        file = self.model.createPostProcessFile(release_cmd)
+        with open(file, 'r') as f:
+            lines = [line for line in f if '--incremental' in line]
+        self.assertEqual(len(lines), 1)
+        self.assertIn(f"{release_cmd} --incremental {self.model.config_path}", lines[0])
+        # and runs in the background so the model is not held up.
+        self.assertRegex(lines[0], r"^\s*nohup .* 2>&1 & ## code inserted")
 
 
 
@@ -22,7 +22,7 @@ import engine
 import genericLib
 import generic_json
 from Models import Model
-from Model import register_param
+from Model import register_param, post_process_function
 from namelist_var import namelist_var
 
 
@@ -36,6 +36,11 @@ def gen_time():
         yield time
 
 
+def fake_plugin(model_dir, post_process):
+    # post-processing entry point used to test in-process post-processing.
+    return pd.Series(post_process['fake_obs'])
+
+
 # To get log info set --log-cli-level WARNING in "additional arguments " in pycharm config
 # remove any registered classes **except** Model.
 for k in Model.known_models():
@@ -245,7 +250,7 @@ class ModelTestCase(unittest.TestCase):
                             _post_process_output='sim_obs.json',
                             post_process_cmd_script=cmd, fake=False, simulated_obs=None,
                             perturb_count=0, parameters_no_key= {},config_path=self.testDir / "test_model.mcfg",
-                            status='CREATED', _history=model._history,engine=None,pp_jid=None,run_info={},model_jids=[],
+                            status='CREATED', _history=model._history,engine=None,pp_jid=None,shared_pp=False,run_info={},model_jids=[],job_times=[],
                             submission_count=0,continue_script=pathlib.Path('continue.sh'),
                             submit_script=pathlib.Path('submit.sh'),submitted_jid=None,
                             set_status_script= self.model.expand("$OPTCLIMTOP/OptClimVn3/scripts/set_model_status.py"))
@@ -328,6 +333,36 @@ class ModelTestCase(unittest.TestCase):
         # verify that reference and model_dir are identical
         self.assertTrue(filecmp.dircmp(self.model.reference, self.model.model_dir))
 
+    def test_create_model_link(self):
+        """
+        Test that create model works when linking files.
+        Files bigger than link_min_size should be linked (not copied) and
+         instantiating the model should not change the reference.
+        :return:
+        """
+        ref_dir = self.testDir / 'reference'  # copy of reference so linking cannot damage the original.
+        shutil.copytree(self.refDir, ref_dir)
+        model = myModel(name='link_model', reference=ref_dir, model_dir=self.testDir / 'link_model',
+                        parameters=dict(RHCRIT=2, VF1=2.5, CT=2), engine=self.engine,
+                        run_info=dict(instantiate_method='link', link_min_size=0))
+        with unittest.mock.patch('genericLib.reflink', autospec=True, return_value=False):
+            model.create_model()  # no reflinks so expect CNTLATM to be a link.
+        self.assertTrue(os.path.samefile(ref_dir / 'CNTLATM', model.model_dir / 'CNTLATM'))
+        shutil.rmtree(model.model_dir)
+        model.instantiate()
+        for file in ref_dir.iterdir():
+            model_file = model.model_dir / file.name
+            if pathlib.Path(file.name) in model.files_to_copy():
+                self.assertFalse(os.path.samefile(file, model_file))  # copied
+            self.assertTrue(filecmp.cmp(file, self.refDir / file.name, shallow=False))  # reference unchanged.
+        # the namelist file has been changed so should differ.
+        self.assertFalse(filecmp.cmp(ref_dir / 'CNTLATM', model.model_dir / 'CNTLATM', shallow=False))
+        # unknown method should fail
+        model = myModel(name='link_model2', reference=ref_dir, model_dir=self.testDir / 'link_model2',
+                        run_info=dict(instantiate_method='fred'))
+        with self.assertRaises(ValueError):
+            model.create_model()
+
     def test_set_status(self):
         """
         Test set_status works
@@ -350,7 +385,7 @@ class ModelTestCase(unittest.TestCase):
             # verify all but status and history are the same form model prior to status change,
             omodeld = vars(omodel)
             modeld = vars(self.model)
-            keys_to_check = set(omodeld.keys()) - {'_history', 'status'}
+            keys_to_check = set(omodeld.keys()) - {'_history', 'status', 'job_times'}  # job_times records status changes
             for key in keys_to_check:
                 self.assertEqual(modeld[key], omodeld[key])
             for key in ['_history', 'status']:  # should be different
@@ -562,6 +597,31 @@ class ModelTestCase(unittest.TestCase):
         # also expect model.model_jids to contain extra ID
         self.assertEqual(model.model_jids,['123456'])
 
+    @unittest.mock.patch.object(myModel, 'now', side_effect=gen_time())
+    def test_job_times(self, mck_now):
+        """
+        Test that job start and end times are recorded and runtimes computed from them.
+        """
+        os.environ['JOB_ID'] = '123456'
+        model = self.model
+        model.status = 'SUBMITTED'
+        model.running()
+        model.set_failed()  # failed job -- no runtime.
+        self.assertEqual(len(model.job_times), 1)
+        self.assertEqual(model.job_times[0]['status'], 'FAILED')
+        self.assertEqual(model.job_runtimes(), [])
+        model.status = 'SUBMITTED'
+        model.running()
+        with unittest.mock.patch('subprocess.check_output', autospec=True, return_value='Ran PP'):
+            model.succeeded()
+        self.assertEqual(model.job_runtimes(), [1.0])  # times tick by one second.
+        self.assertEqual(model.job_runtimes(job='post_process'), [])
+        dmodel = Model.load_model(model.config_path)
+        self.assertEqual(dmodel.job_times, model.job_times)
+        self.assertIsNone(model.run_duration())
+        model.parameters['RUN_TARGET'] = 'P6Y4M'
+        self.assertEqual(model.run_duration(), 'P6Y4M')
+
     def test_guess_failed(self):
         """
         Check guess_failed works!
@@ -619,6 +679,24 @@ class ModelTestCase(unittest.TestCase):
         self.assertEqual(model.perturb_count, 1)  # perturbed it once.
         self.assertEqual(model.status, 'PERTURBED')
 
+    def test_clear_post_process_state(self):
+        """
+        Test incremental post-processing state is removed when a model is perturbed or restarted.
+        """
+        model = self.model
+        model.instantiate()
+        state_file = model.model_dir / 'post_process_state.json'
+        self.assertIsNone(model.clear_post_process_state())  # nothing to remove.
+        for method, status in [(model.perturb, 'FAILED'), (model.restart_simulation, 'CREATED')]:
+            state_file.write_text('{}')
+            model.status = status
+            method()
+            self.assertFalse(state_file.exists())
+        # state file name comes from post_process.
+        model.post_process['state_file'] = 'my_state.json'
+        (model.model_dir / 'my_state.json').write_text('{}')
+        self.assertEqual(model.clear_post_process_state(), model.model_dir / 'my_state.json')
+
     @unittest.mock.patch.object(myModel, 'now', side_effect=gen_time())
     def test_set_failed(self,mck_now):
         """
@@ -664,6 +742,99 @@ class ModelTestCase(unittest.TestCase):
             self.assertIsNone(r)
 
 
+    def test_process_models(self):
+        """
+        Test that many models can be processed at once.
+        """
+        paths = []
+        for indx, status in enumerate(['SUCCEEDED', 'SUCCEEDED', 'PROCESSED', 'FAILED']):
+            model = Model(f'test{indx:03d}', self.refDir, post_process=self.post_process,
+                          model_dir=self.testDir / f'test{indx:03d}')
+            model.fake = True  # so processing just sets the status
+            model.status = status
+            model.dump_model()
+            paths.append(model.config_path)
+        # FAILED models are waited on (they might be continued) so need max_wait.
+        result = Model.process_models(paths, max_workers=2, poll_interval=0.01, max_wait=0.05)
+        self.assertEqual(list(result.values()), ['PROCESSED', 'PROCESSED', 'PROCESSED', 'FAILED'])
+        self.assertEqual(list(result.keys()), paths)
+        for path in paths[0:2]:
+            self.assertEqual(Model.load_model(path).status, 'PROCESSED')
+        # unless told not to wait for them.
+        result = Model.process_models(paths[2:], poll_interval=0.01, wait_failed=False)
+        self.assertEqual(list(result.values()), ['PROCESSED', 'FAILED'])
+        # FAILED model that gets continued and succeeds while waiting gets processed.
+        def continued(interval):
+            model = Model.load_model(paths[3])
+            if model.status == 'FAILED':
+                model.status = 'SUCCEEDED'
+                model.dump_model()
+        with unittest.mock.patch('time.sleep', autospec=True, side_effect=continued):
+            result = Model.process_models(paths[3:], poll_interval=0.01)
+        self.assertEqual(result, {paths[3]: 'PROCESSED'})
+        # model still running -- give up after max_wait.
+        model = Model.load_model(paths[0])
+        model.status = 'RUNNING'
+        model.dump_model()
+        result = Model.process_models(paths[0:1], poll_interval=0.01, max_wait=0.05)
+        self.assertEqual(result, {paths[0]: 'RUNNING'})
+
+    def test_batch_process(self):
+        """
+        Test that many models can be processed in a pool of processes calling post_process directly.
+        """
+        script = self.testDir / 'pp_fn.py'
+        script.write_text("""
+import json
+import os
+def post_process(input_file, output_file, model_dir=None):
+    with open(input_file) as fp:
+        obs = dict(json.load(fp)['postProcess']['fake_obs'], pid=os.getpid())
+    with open(output_file, 'w') as fp:
+        json.dump(obs, fp)
+    return obs
+""")
+        post_process = dict(script=script, interp='python', output_file='sim_obs.json', fake_obs=dict(obs1=1.0))
+        paths = []
+        for indx, status in enumerate(['SUCCEEDED', 'SUCCEEDED', 'SUCCEEDED', 'FAILED']):
+            model = Model(f'test{indx:03d}', self.refDir, post_process=post_process,
+                          model_dir=self.testDir / f'test{indx:03d}')
+            model.status = status
+            model.dump_model()
+            paths.append(model.config_path)
+        with unittest.mock.patch('subprocess.check_output', autospec=True) as mock_chk:
+            result = Model.batch_process(paths, max_workers=2)
+        mock_chk.assert_not_called()  # script not ran.
+        self.assertEqual(list(result.values()), ['PROCESSED', 'PROCESSED', 'PROCESSED', 'FAILED'])
+        pids = set()
+        for path in paths[0:3]:
+            model = Model.load_model(path)
+            self.assertEqual(model.status, 'PROCESSED')
+            self.assertEqual(model.simulated_obs['obs1'], 1.0)
+            pids.add(model.simulated_obs['pid'])
+        self.assertLessEqual(len(pids), 2)  # only two processes used.
+        # scripts without a post_process function get ran as normal.
+        self.assertIsNone(post_process_function(str(self.model.expand(
+            '$OPTCLIMTOP/OptClimVn3/Models/scripts/pp_script_test.py'))))
+        self.assertIsNotNone(post_process_function(str(script)))
+
+    @unittest.mock.patch.object(myModel, 'now', side_effect=gen_time())
+    def test_succeeded_shared(self, mock_now):
+        """
+        Test that a shared post-processing job is only released when it is held.
+        """
+        model = self.model
+        model.pp_jid = '123456'
+        model.shared_pp = True
+        for job_status, expect_calls in [('Held', 1), ('Running', 0)]:
+            model.status = 'RUNNING'
+            with unittest.mock.patch.object(engine.sge_engine, 'job_status', return_value=job_status):
+                with unittest.mock.patch('subprocess.check_output', autospec=True,
+                                         return_value='Released') as mock_chk:
+                    model.succeeded()
+            self.assertEqual(mock_chk.call_count, expect_calls)
+            self.assertEqual(model.status, 'SUCCEEDED')
+
     def test_process(self):
         """
         Test process works.
@@ -692,6 +863,51 @@ class ModelTestCase(unittest.TestCase):
         pdtest.assert_series_equal(pd.Series(fake_obs).rename(model.name), model.simulated_obs)
         self.assertEqual(model.status, 'PROCESSED')
 
+    def test_incremental_process(self):
+        """
+        Test incremental_process only runs when post_process['incremental'] is True and
+         runs the post-processing script with --incremental without changing status.
+        """
+        model = Model('test001', self.refDir, post_process=self.post_process, model_dir=self.testDir)
+        model.status = 'RUNNING'
+        with unittest.mock.patch('subprocess.check_output', autospec=True, return_value="") as mock_chk:
+            self.assertIsNone(model.incremental_process())  # not incremental so nothing done.
+            mock_chk.assert_not_called()
+            model.post_process['incremental'] = True
+            model.incremental_process()
+        cmd = mock_chk.call_args.args[0]
+        self.assertEqual(cmd, [str(c) for c in model.post_process_cmd_script] + ['--incremental'])
+        self.assertTrue((model.model_dir / model._post_process_input).exists())
+        self.assertEqual(model.status, 'RUNNING')
+
+    def test_process_entry_point(self):
+        """
+        Test process calls a post-processing entry point in-process rather than running a script.
+        """
+        fake_obs = self.fake_fn().to_dict()
+        post_process = dict(entry_point=f"{__name__}:fake_plugin", fake_obs=fake_obs)
+        model = Model('test001', self.refDir, post_process=post_process, model_dir=self.testDir)
+        self.assertIsNone(model.post_process_cmd_script)
+        model.status = 'SUCCEEDED'
+        with unittest.mock.patch('subprocess.check_output', autospec=True) as mock_chk:
+            model.process()
+        mock_chk.assert_not_called()
+        pdtest.assert_series_equal(model.simulated_obs, pd.Series(fake_obs).rename(model.name))
+        self.assertEqual(model.status, 'PROCESSED')
+        self.assertFalse((model.model_dir / model._post_process_output).exists())  # no files needed.
+        # a script as well as an entry point -- entry point is used.
+        post_process['script'] = self.post_process['script']
+        model = Model('test002', self.refDir, post_process=post_process, model_dir=self.testDir)
+        self.assertIsNotNone(model.post_process_cmd_script)
+        model.status = 'SUCCEEDED'
+        with unittest.mock.patch('subprocess.check_output', autospec=True) as mock_chk:
+            model.process()
+        mock_chk.assert_not_called()
+        pdtest.assert_series_equal(model.simulated_obs, pd.Series(fake_obs).rename(model.name))
+        # bad entry point
+        with self.assertRaises(ValueError):
+            Model('test003', self.refDir, post_process=dict(entry_point='no_function'), model_dir=self.testDir)
+
     # patching end_to_end so time always ticks in controlled way. gen_time does 1 seconds increments.
     @unittest.mock.patch.object(myModel,'now',side_effect=gen_time())
     def test_end_to_end(self,mock_cfg):
@@ -11,15 +11,20 @@ See individual functions for documentation.
 Test cases for this module can be found in test_Optimise.py
 """
 
+from __future__ import annotations
+
 ## issues for Mike.
 #  arrays returned should be in the same "order" as inputs. Both  appear to be transposed.
 
 import numpy as np
 import logging
 import xarray
+import scipy.linalg
 from scipy.stats import chi2
 import typing
 
+my_logger = logging.getLogger(f"OPTCLIM.{__name__}")
+
 
 def get_default(dct, key, default):
     """
@@ -145,28 +150,74 @@ def rangeAwarePerturbations(baseVals, parLimits, steps, nrandom=None,
     return y, randIndx
 
 
+def first_regularized(cond_fn, passes, guess, ncand):
+    """
+    Find the first candidate regularisation that passes, assuming candidates fail then pass
+      (as condition numbers decrease as regularisation increases).
+    Bisects with guess as the first candidate tried so that, when guess is good, only a
+      few condition numbers need to be computed.
+    :param cond_fn: function returning the condition number for a candidate index
+    :param passes: function returning True if a condition number is acceptable
+    :param guess: index of the first candidate estimated to pass
+    :param ncand: number of candidates
+    :return: index of first passing candidate (None if none pass) and dict of condition numbers computed.
+    """
+    cons = dict()
+    lower, upper = 0, ncand  # first passing candidate is in [lower, upper]. upper == ncand means none pass.
+    indx = int(np.clip(guess, 0, ncand - 1))
+    while lower < upper:
+        cons[indx] = cond_fn(indx)
+        if passes(cons[indx]):
+            upper = indx
+        else:
+            lower = indx + 1
+        indx = (lower + upper) // 2
+    if upper == ncand:
+        return None, cons
+    return upper, cons
+
+
 def regularize_hessian(hessian, reg_crit_cond, reg_pow_range, trace=False):
-    """ Regularize hessian matrix """
+    """
+    Regularize hessian matrix by adding the smallest ridge (10**k * identity with k in range(*reg_pow_range))
+      that gives a condition number less than reg_crit_cond.
+    Rather than trying each ridge in turn the symmetric part of the hessian is eigendecomposed once. As adding
+      c*identity shifts all eigenvalues by c, the ridge needed is estimated from those eigenvalues. That estimate
+      is then checked (and if needed corrected by bisection) using np.linalg.cond so results are the same as
+      trying each ridge in turn.
+    :param hessian: hessian matrix to regularize
+    :param reg_crit_cond: critical condition number
+    :param reg_pow_range: range of powers of 10 to try.
+    :param trace: If True print out condition numbers computed.
+    :return: regularized hessian (None if regularisation failed), its condition number and the ridge used.
+       The ridge is 0 if no regularisation was needed and None if regularisation failed.
+    """
     fn_label = 'regHes'
-    perJ = hessian.copy()  # make sure we copy values.
     con = np.linalg.cond(hessian)
+    if con < reg_crit_cond:  # no need to regularize
+        return hessian.copy(), con, 0
+
+    powers = list(range(*reg_pow_range))
+    ridges = [10 ** k for k in powers]
     eye = np.identity(hessian.shape[0])
-    for k in range(*reg_pow_range):  # *(list) breaks up list when argument
-        if con < reg_crit_cond:
-            break  # exit the loop if our condition number small enough
+    evals = np.linalg.eigvalsh((hessian + hessian.T) / 2.)
+    shifted = np.abs(evals[np.newaxis, :] + np.array(ridges, dtype=float)[:, np.newaxis])
+    with np.errstate(divide='ignore'):
+        est_cons = np.max(shifted, axis=1) / np.min(shifted, axis=1)  # estimated condition number for each ridge
+    guess = int(np.argmax(est_cons < reg_crit_cond)) if np.any(est_cons < reg_crit_cond) else len(ridges) - 1
+    indx, cons = first_regularized(lambda i: np.linalg.cond(hessian + eye * ridges[i]),
+                                   lambda c: c < reg_crit_cond, guess, len(ridges))
+    if trace:
+        for i, c in sorted(cons.items()):
+            print(fn_label + ": con %e k %d" % (c, powers[i]))
+    if indx is None:  # failed to regularize matrix
+        if len(ridges) > 0:
+            con = cons[len(ridges) - 1]
+        print("regularisation insufficient, stopping: con %e k %d" % (con, powers[-1] if len(powers) > 0 else 0))
+        return None, con, None
 
-        perJ = hessian + eye * 10 ** k  # add scaled Identity matrix to diagonal.
-        con = np.linalg.cond(perJ)  # compute condition number
-        if trace:
-            print(fn_label + ": con %e k %d" % (con, k))
-    # end loop over powers of 10.
-    if (con >= reg_crit_cond):  # failed to regularize matrix
-        print("regularisation insufficient, stopping: con %e k %d" % (con, k))
-        return None, con
-    else:  # managed to regularize hessian
-        # TODO also return the value of k actually used. Noting that we might not
-        # need to do any regularisation.
-        return perJ, con
+    perJ = hessian + eye * ridges[indx]  # add scaled Identity matrix to diagonal.
+    return perJ, cons[indx], ridges[indx]
 
 
 def regularize_cov(covariance, cond_number=None, initial_scale=1e-4, trace=False):
@@ -180,9 +231,11 @@ def regularize_cov(covariance, cond_number=None, initial_scale=1e-4, trace=False
 
     Returns: Regularised covariance matrix
 
-    Algorithm: The scaling is doubled each iteration until the condition
-    number is less than target value. Target value is cond_number*cond(diagonal covariance)
-
+    Algorithm: The smallest scaling from initial_scale*2, initial_scale*4, ... that makes the condition
+    number less than or equal to the target value is used. Target value is cond_number*cond(diagonal covariance).
+    If a scaling larger than 10 is needed a ValueError is raised.
+    Rather than trying each scaling in turn the correlation matrix is eigendecomposed once and used to estimate
+    the scaling needed. That estimate is then checked (and if needed corrected by bisection) using np.linalg.cond.
 
     """
     if cond_number is None:
@@ -192,21 +245,36 @@ def regularize_cov(covariance, cond_number=None, initial_scale=1e-4, trace=False
     con = np.linalg.cond(covariance)
     tgt_cond = cond_number * np.linalg.cond(
         np.diag(diag_cov))  # how much more than pure diagonal is target condition number
+    if con <= tgt_cond:
+        return covariance  # no need to regularize.
 
-    scale_diag = initial_scale  ## initial scaling#
-    reg_cov = covariance  # make sure got a regularised covariance to return.
-    ## AS python does ptr copy this doesn't cost much..
-    while (con > tgt_cond):  ## iterate until condition number <= tgt condition number
+    scales = []
+    scale_diag = initial_scale
+    while scale_diag * 2.0 <= 10:  # scales that can be used.
         scale_diag = scale_diag * 2.0
-        reg_cov = covariance + np.diag(scale_diag * diag_cov)
-        con = np.linalg.cond(reg_cov)
-        if (scale_diag > 10):
-            print("failed to regularize matrix. scale_diag,con,tgt_cond = ", scale_diag, con, tgt_cond)
-            raise ValueError()
-    ##  end of regularisation loop.
+        scales.append(scale_diag)
+    guess = 0
+    if np.all(diag_cov > 0) and len(scales) > 0:
+        # covariance + s*diag = sqrt(diag)*(correlation + s*identity)*sqrt(diag). Use that to estimate scale needed.
+        sqrt_diag = np.sqrt(diag_cov)
+        evals = np.linalg.eigvalsh(covariance / np.outer(sqrt_diag, sqrt_diag))
+        shifted = np.abs(evals[np.newaxis, :] + np.array(scales)[:, np.newaxis])
+        with np.errstate(divide='ignore'):
+            est_cons = np.max(shifted, axis=1) / np.min(shifted, axis=1)
+        est_ok = est_cons <= cond_number
+        guess = int(np.argmax(est_ok)) if np.any(est_ok) else len(scales) - 1
+
+    indx, cons = first_regularized(lambda i: np.linalg.cond(covariance + np.diag(scales[i] * diag_cov)),
+                                   lambda c: c <= tgt_cond, guess, len(scales))
+    if indx is None:
+        print("failed to regularize matrix. scale_diag,con,tgt_cond = ", scale_diag * 2.0,
+              cons.get(len(scales) - 1, con), tgt_cond)
+        raise ValueError()
+    scale_diag = scales[indx]
+    reg_cov = covariance + np.diag(scale_diag * diag_cov)
     if trace:
         print("Used Tikinhov regularisation with scale = ", scale_diag)
-        print("Condition #  = ", con, " Cond No is ", cond_number)
+        print("Condition #  = ", cons[indx], " Cond No is ", cond_number)
 
     return reg_cov
 
@@ -214,6 +282,98 @@ def regularize_cov(covariance, cond_number=None, initial_scale=1e-4, trace=False
 ### end of regularize_cov
 
 
+class cost_evaluator:
+    """
+    Evaluate costs -- the root mean square of covariance weighted differences between simulated and
+      observed values. The covariance is Cholesky factorised once and the factor reused for all simulations
+      and for the inverse covariance. If the covariance is not positive definite it is regularised (by scaling
+      up its diagonal) until it is.
+    Use cost_evaluator.from_cov(cov) to share evaluators between calls using the same covariance values.
+    """
+    cache_size = 8  # maximum number of evaluators cached by from_cov
+    _cache = dict()  # evaluators indexed by covariance shape and hash of its values.
+
+    def __init__(self, cov: np.ndarray):
+        """
+        :param cov: covariance matrix. Copied so later changes to it do not change the evaluator.
+        """
+        self.cov = np.array(cov, dtype=float)
+        self.chol = self.cholesky(self.cov)  # lower triangular so cov = chol.chol^T
+        self._inv_cov = None
+
+    @staticmethod
+    def cholesky(cov: np.ndarray) -> np.ndarray:
+        """
+        Cholesky factorise cov. If that fails cov + scale*diag(cov) is tried for scale = 1e-12, 1e-11 ... 1e-2
+        :param cov: covariance matrix
+        :return: lower triangular matrix
+        """
+        try:
+            return np.linalg.cholesky(cov)
+        except np.linalg.LinAlgError:
+            pass
+        diag_cov = np.abs(np.diag(cov))
+        for scale in 10.0 ** np.arange(-12, -1):
+            try:
+                chol = np.linalg.cholesky(cov + np.diag(scale * diag_cov))
+            except np.linalg.LinAlgError:
+                continue
+            my_logger.warning(f"Covariance not positive definite. Regularised with diagonal scaling {scale:.0e}")
+            return chol
+        raise ValueError("Failed to regularise covariance so it is positive definite")
+
+    @classmethod
+    def from_cov(cls, cov: np.ndarray) -> cost_evaluator:
+        """
+        Return an evaluator for cov. Evaluators are cached so calls with the same covariance values
+          (even if a different array) do not factorise the covariance again.
+        :param cov: covariance matrix
+        :return: cost_evaluator
+        """
+        cov = np.ascontiguousarray(cov, dtype=float)
+        key = (cov.shape, hash(cov.tobytes()))
+        evaluator = cls._cache.get(key)
+        if (evaluator is None) or (not np.array_equal(evaluator.cov, cov)):
+            evaluator = cls(cov)
+            cls._cache[key] = evaluator
+            while len(cls._cache) > cls.cache_size:  # remove oldest evaluators
+                cls._cache.pop(next(iter(cls._cache)))
+        return evaluator
+
+    @property
+    def nobs(self) -> int:
+        return self.cov.shape[0]
+
+    @property
+    def inv_cov(self) -> np.ndarray:
+        """
+        Inverse covariance computed (once) from the Cholesky factor. Read only as it is shared.
+        """
+        if self._inv_cov is None:
+            self._inv_cov = scipy.linalg.cho_solve((self.chol, True), np.identity(self.nobs))
+            self._inv_cov.setflags(write=False)
+        return self._inv_cov
+
+    def whiten(self, values: np.ndarray) -> np.ndarray:
+        """
+        Transform values to space where the covariance is the identity matrix.
+        :param values: 2D array. Each row is a different set of values.
+        :return: chol^-1 values for each row. Computed using one triangular solve.
+        """
+        return scipy.linalg.solve_triangular(self.chol, values.T, lower=True).T
+
+    def cost(self, simulated: np.ndarray, observations: np.ndarray) -> np.ndarray:
+        """
+        Compute cost for all simulations.
+        :param simulated: simulated observations. 1D for one simulation or 2D with each row a different simulation.
+        :param observations: 1D array of observations
+        :return: 1D array of costs. One for each simulation.
+        """
+        delta = np.reshape(simulated, (-1, self.nobs)) - observations
+        white = self.whiten(delta)
+        return np.sqrt(np.sum(white ** 2, axis=1) / float(self.nobs))  # root mean square.
+
+
 def calcErr(simulated, observations, cov=None):
     """
     calculate error for simulated observed values given targets and covariance.
@@ -226,6 +386,7 @@ def calcErr(simulated, observations, cov=None):
 
     opt-param: cov: Covariance matrix. Default value is the identity matrix.
 
+    Uses cost_evaluator so the covariance is only factorised once for repeated calls.
     """
 
     nobs = len(observations)
@@ -233,28 +394,26 @@ def calcErr(simulated, observations, cov=None):
     if cov is None:
         cov = np.identity(nobs)  # make covariance a unit matrix if not defined
 
-    ## compute number of simulations.
-    if simulated.ndim == 1:  # might break if we only have one obs...
-        nsimulations = 1
-        lsimulated = np.reshape(simulated, (1, simulated.shape[0]))  # maek it 2d
-    else:
-        nsimulations = simulated.shape[0]  # number of simulations
-        lsimulated = simulated  # ptr so free!
-
-    err = np.zeros(nsimulations)  # set up error vector
-    inv_cov = np.linalg.inv(cov)  # compute inverse covariance
+    return cost_evaluator.from_cov(cov).cost(simulated, observations)
 
-    for i in range(nsimulations):
-        delta = lsimulated[i,] - observations
-        err[i] = (delta.dot(inv_cov)).dot(delta)
 
-    err = np.sqrt(err / float(nobs))  # root mean square.
-    return err
+def param_scaling(base: np.ndarray) -> np.ndarray:
+    """
+    Compute scaling on parameters used by doGaussNewton to keep the Jacobian "well behaved".
+    Parameters less than 1 (and not tiny) are scaled up by a power of 10.
+    :param base: base parameter values
+    :return: scaling for each parameter. Jacobian wrt scaled parameters is jacobian wrt parameters/param_scale.
+    """
+    pwr = np.floor(np.log10(np.fabs(base + 1e-17)))  # compute power of 10 for params
+    param_scale = np.ones(len(base))  # default scaling is one for all parameters
+    indx = (pwr < 0) & (np.fabs(base) > 1e-10)  # find those parameters that need to be scaled up because they are less than 1 and are not tiny!
+    param_scale[indx] = 10 ** (-pwr[indx])  # compute scaling.
+    return param_scale
 
 
 def doGaussNewton(param_value, param_range, UM_value, obs, cov=None,
                   scalings=None, olist=None,
-                  constraint=None, constraint_target=None, studyJSON={}, trace=False):
+                  constraint=None, constraint_target=None, studyJSON={}, jacobian=None, trace=False):
     """
     the function doGaussNewton does the  calculation for the n+1 initial runs in an iteration,
     and can be invoked from (usually) makeNewRuns, using data from studies, or from
@@ -285,6 +444,10 @@ def doGaussNewton(param_value, param_range, UM_value, obs, cov=None,
         covar_cond    -- if specified used by regularize_cov (qv) to regularize covariance
         reg_crit_cond -- critical condition number for regularisation of Hessian. Default is 10e10.
         reg_pow_range -- range of powers used to generate list of powers in regularisation. Default is (-7,-2)
+    :opt-param jacobian: Jacobian (rows are parameters, columns are observations) wrt unscaled parameters and
+       scaled observations -- e.g. info['jacobian']*info['param_scale'][:,np.newaxis] from a previous iteration.
+       If provided, rows for parameters perturbed in param_value are replaced by their finite-difference values
+       and all parameters are used in the search. So param_value (and UM_value) can be just the base case.
     
     :opt-param trace: turn on/off trace of what happening. Default is False. Set True to get some tracing.
 
@@ -296,6 +459,9 @@ def doGaussNewton(param_value, param_range, UM_value, obs, cov=None,
        jacobian: An array of the Jacobian matrix
        InvCov: An array of the Inverse Covariance matrix (after possible regularisation)
        condnum: The Condition Number of the regularized hessian matrix.
+       ridge: The value added to the diagonal of the hessian to regularize it. 0 if no regularisation needed.
+       param_scale: Scaling applied to parameters. Jacobian is wrt scaled parameters.
+       refreshed: Indices of parameters whose jacobian was computed from param_value & UM_value.
        software: A string with info on the software
        scalings: Scalings applied to data.
        olist: names of variables 
@@ -346,11 +512,7 @@ def doGaussNewton(param_value, param_range, UM_value, obs, cov=None,
     ## TODO -- scale from 1 to 10 based on param_min and param_max
     ## param_scale=(param-param_min)/(param_max-param_min)*9+1
     ## NB this will change the results so do after all tests passed.
-    pwr = np.floor(np.log10(np.fabs(param_value[0, :] + 1e-17)))  # compute power of 10 for params
-    param_scale = np.ones((nParam))  # default scaling is one for all parameters
-    indx = (pwr < 0) & (np.fabs(param_value[0,
-                                :]) > 1e-10)  # find those parameters that need to be scaled up because they are less than 1 and are not tiny!
-    param_scale[indx] = 10 ** (-pwr[indx])  # compute scaling.
+    param_scale = param_scaling(param_value[0, :])
     if trace: print("Param_scale is ", param_scale)
 
     # Deal with constraint
@@ -383,7 +545,8 @@ def doGaussNewton(param_value, param_range, UM_value, obs, cov=None,
     if covar_cond is not None:  # specified a condition number for the covariance matrix?
         use_cov = regularize_cov(use_cov, covar_cond, trace=trace)
 
-    InvCov = np.linalg.inv(use_cov)  # Inverse of covariance matrix. Might be better as pseudo-inv
+    evaluator = cost_evaluator.from_cov(use_cov)
+    InvCov = evaluator.inv_cov  # Inverse of covariance matrix.
     if trace > 2: print(fn_label + ": Scaled and regularized cov = ", cov)
 
     # verify parameters in sensible range
@@ -405,14 +568,21 @@ def doGaussNewton(param_value, param_range, UM_value, obs, cov=None,
         paramIndex[i] = np.where(non_zero)[0]  # work out which parameter was actually changed
         dParam = deltaParam[non_zero] * param_scale[non_zero]  # change in param after scaling.
         Jacobian[i, :] = (use_UM_value[i + 1, :] - UM) / dParam[0]
+    refreshed = paramIndex  # parameters whose jacobian was computed.
+    if jacobian is not None:  # use supplied jacobian for parameters not perturbed.
+        full_jacobian = jacobian / param_scale[:, np.newaxis]  # convert to scaled parameters.
+        full_jacobian[paramIndex, :] = Jacobian
+        Jacobian = full_jacobian
+        paramIndex = np.arange(nParam)
 
     F = UM - use_obs  # Difference of previous best case from obs
     hessian = (Jacobian.dot(InvCov)).dot(Jacobian.T) / float(nObs)  # = $\del^2f(x) or hessian
     info = {"jacobian": Jacobian, "hessian": hessian, "condnum": None}  # store for the moment
-    hessian, con = regularize_hessian(hessian, reg_crit_cond, reg_pow_range, trace=trace)  # regularize hessian
+    hessian, con, ridge = regularize_hessian(hessian, reg_crit_cond, reg_pow_range, trace=trace)  # regularize hessian
     if hessian is None:
         # regularization failed
         info['condnum'] = con  # update info on the condition number
+        info['ridge'] = ridge
         return "Fatal", None, None, None, info
 
     # solving linear problem $\nabla^2f(x) s = \nabla f(x) $
@@ -428,7 +598,7 @@ def doGaussNewton(param_value, param_range, UM_value, obs, cov=None,
         print(fn_label + "; con=", con)
 
     # err & constrained err
-    err_constraint = calcErr(use_UM_value, use_obs, cov=use_cov)  # compute error (which might include constraint)
+    err_constraint = evaluator.cost(use_UM_value, use_obs)  # compute error (which might include constraint)
     # now deal with constraint (in hacky way)
     if sigma:  # Need to compute unconstrained error.
         err = calcErr(use_UM_value[:, 0:-1], use_obs[0:-1], cov=use_cov[0:-1, 0:-1])  # without constraint
@@ -452,13 +622,13 @@ def doGaussNewton(param_value, param_range, UM_value, obs, cov=None,
         raise ValueError("Have linesearch params outside param_range")
 
     # wrap diagnostics up.
-    info = dict(jacobian=Jacobian, hessian=hessian, condnum=con, searchVect=searchVect,
+    info = dict(jacobian=Jacobian, hessian=hessian, condnum=con, ridge=ridge, searchVect=searchVect,
                 InvCov=InvCov,
                 #software_vn=version, revision=revision, SvnURL=svnURL,
-                scalings=use_scalings, params=params, paramIndex=paramIndex)
+                scalings=use_scalings, params=params, paramIndex=paramIndex, param_scale=param_scale,
+                refreshed=refreshed)
     # TODO include in the info dict the parameter names and their values. That might need to
     # happen in the framework. This will make subsequent data processing much easier.
-    # TODO include some information about the regularisation
     return optStatus, linesearch, err, err_constraint, info
 
 
@@ -653,11 +823,12 @@ def doLineSearch(param_value, param_range, UM_value, obs, step, cov=None, cov_iv
         use_cov_iv = regularize_cov(use_cov_iv, covar_cond, trace=trace)
         use_cov = regularize_cov(use_cov, covar_cond, trace=trace)
 
-    InvCov_iv = np.linalg.inv(use_cov_iv)  # invert it.
-    InvCov = np.linalg.inv(use_cov)  # invert covariance matrix
+    InvCov_iv = cost_evaluator.from_cov(use_cov_iv).inv_cov  # invert it.
+    evaluator = cost_evaluator.from_cov(use_cov)
+    InvCov = evaluator.inv_cov  # invert covariance matrix
 
     ## Compute constrained_error (and error) Code is lift from doGaussNewton
-    err_constraint = calcErr(use_UM_value, use_obs, cov=use_cov)
+    err_constraint = evaluator.cost(use_UM_value, use_obs)
     # compute error (which might include constraint)
     # now deal with constraint (in hacky way)
     if sigma:  # Need to compute unconstrained error.
@@ -748,6 +919,30 @@ def run_fn(function, params, npt, constraint_target=None):
     return obsValues
 
 
+def broyden_update(jacobian: np.ndarray, param_scale: np.ndarray, delta_param: np.ndarray,
+                   delta_obs: np.ndarray, scalings: typing.Optional[np.ndarray] = None) -> (np.ndarray, float):
+    """
+    Rank-one (Broyden) update of a Jacobian so it reproduces an observed change.
+    :param jacobian: Jacobian (rows parameters, columns observations) wrt scaled parameters as produced by doGaussNewton.
+    :param param_scale: scaling applied to parameters (from doGaussNewton).
+    :param delta_param: change in (unscaled) parameters.
+    :param delta_obs: corresponding change in (unscaled) observations.
+    :param scalings: scalings applied to observations. Default is 1.
+    :return: updated Jacobian wrt unscaled parameters (as doGaussNewton wants)
+       and relative error of the prediction of delta_obs made by jacobian. Large values mean a poor Jacobian.
+    """
+    if scalings is not None:
+        delta_obs = delta_obs * scalings
+    delta_scaled = delta_param * param_scale
+    resid = delta_obs - delta_scaled.dot(jacobian)  # error in linear prediction.
+    size = np.sqrt(delta_scaled.dot(delta_scaled))
+    if (size == 0) or (np.linalg.norm(delta_obs) == 0):
+        return jacobian * param_scale[:, np.newaxis], np.inf
+    quality = np.linalg.norm(resid) / np.linalg.norm(delta_obs)
+    update = jacobian + np.outer(delta_scaled, resid) / (size ** 2)
+    return update * param_scale[:, np.newaxis], quality
+
+
 def gaussNewton(function: typing.Callable,
                 startParam: np.ndarray,
                 paramRange: np.ndarray,
@@ -757,6 +952,7 @@ def gaussNewton(function: typing.Callable,
                 cov: typing.Optional[np.ndarray] = None,
                 cov_iv: typing.Optional[np.ndarray] = None,
                 scalings: typing.Optional[np.ndarray] = None, constraint_target: typing.Optional[float] = None,
+                jacobian: typing.Optional[np.ndarray] = None,
                 trace: bool = False):
     """
     Apply guassNewton/Linesearch algorithm to specified function.
@@ -765,11 +961,34 @@ def gaussNewton(function: typing.Callable,
     :param paramRange: a Nx2 numpy array of the minimum parameter values [*,0] and maximum parameter values [*,1]
     :param paramStep: The perturbation to be made to each parameter -- note that algorithm development could work this out automatically.
     :param target: The target for the optimisation. A len M numpy array.
-    :param optimise: A dict of information used by optimisation.
+    :param optimise: A dict of information used by optimisation. As well as information used by doGaussNewton and
+       doLineSearch the following are used:
+         maxIterations -- maximum number of iterations. Default is None (no limit).
+         nrandom -- If not None, after the first iteration (which perturbs all parameters) only perturb nrandom
+            randomly chosen parameters. The Jacobian for the other parameters is carried forward from
+            the previous iteration. Default is None.
+         maxFails -- with nrandom, the number of times in a row a failed iteration is retried (with
+            a different random choice of parameters) from the previous best parameters. Default is 0.
+         broyden -- If True, after an iteration that continues, update the Jacobian with a rank-one (Broyden)
+            correction from the best line-search case rather than computing it from nParam perturbed runs.
+            Default is False.
+         broyden_refresh -- compute the full Jacobian at least every broyden_refresh iterations. Default is 3.
+         broyden_tol -- compute the full Jacobian when the relative error of the linear prediction
+            for the best line-search case exceeds this. Default is 0.5
+         pipeline -- If True, predict the line-search parameters from the previous iteration's Jacobian and run them
+            in the same batch as the Jacobian perturbations. Predicted points close to the actual line-search points
+            are used, others are run in a second batch. Default is False.
+         pipeline_tol -- a predicted point is used if its distance from the actual line-search point is less than
+            pipeline_tol times the distance of the actual point from the base point. Distances are in units of
+            paramStep. Default is 0.1
     :param cov: (default None)  Covariance matrix for scaling cost function. Default values sets by doGaussNewton and doLineSearch
+       Its (scaled) factorisation is cached by cost_evaluator and so shared across iterations.
     :param cov_iv: (default None) Covariance  matrix used in doLinesearch to determine if values changed enough.
     :param scalings : (default is 1) Scalings to apply to simulated observations and targets. A len M numpy array
     :param constraint_target : (Optional -- default is None) If provided the target value for the constraint
+    :param jacobian: (Optional -- default is None) If provided a Jacobian (rows parameters, columns observations)
+       wrt unscaled parameters and scaled observations to use on the first iteration, e.g. from a previous study.
+       Only parameters with nan in their row are perturbed on the first iteration.
     :param trace: provide more trace information
     :return: Returns minimal error param values,  status of termination & information on GN/LS cpts of algorithm
     """
@@ -780,6 +999,13 @@ def gaussNewton(function: typing.Callable,
         print("Max Iterations is ", maxIterations)
     nrandom = optimise.get('nrandom', None)
     deterministicPerturb = optimise.get('deterministicPertub', True)
+    broyden = optimise.get('broyden', False)
+    broyden_refresh = optimise.get('broyden_refresh', 3)
+    broyden_tol = optimise.get('broyden_tol', 0.5)
+    pipeline = optimise.get('pipeline', False)
+    pipeline_tol = optimise.get('pipeline_tol', 0.1)
+    if broyden and (nrandom is not None):
+        raise ValueError("broyden and nrandom can not both be set")
     statusInfo = 'Continue'
     npt = len(target)  # how many points we expect.
     if constraint_target is not None: npt += 1  # increment number of points to deal with constraint
@@ -789,22 +1015,51 @@ def gaussNewton(function: typing.Callable,
     prevBestParam = startParam[:]  # copy startParam so have a prevBestParam if needed.
 
     # stage 1 -- Work out parameters for first iteration
+    # Always perturb all parameters so that with nrandom the Jacobian is fully known
+    # and only nrandom rows of it need refreshing on later iterations.
     paramsGN, randIndx = rangeAwarePerturbations(startParam, paramRange, paramStep,
-                                                 nrandom=nrandom, deterministic=deterministicPerturb, trace=trace)
+                                                 deterministic=deterministicPerturb, trace=trace)
     statusList = []  # a list of the status
+    if jacobian is not None:  # only perturb parameters we do not have a jacobian for.
+        missing = np.any(np.isnan(jacobian), axis=1)
+        paramsGN = paramsGN[np.hstack((True, missing)), :]
+        jacobian = np.where(missing[:, np.newaxis], 0.0, jacobian)  # missing rows computed by doGaussNewton
+    # jacobian (wrt unscaled parameters) is carried forward to next iteration.
+    useBroyden = False  # True if jacobian has been Broyden updated.
+    nSinceFull = 0  # number of iterations since full Jacobian computed.
+    predJacobian = None  # Jacobian (wrt unscaled parameters) used to predict line-search parameters.
     while statusInfo == 'Continue':
+        paramsPred = None  # predicted line-search parameters.
         # obsValuesGN, constraintGN = run_fn(function, paramsGN, npt,
         #                                   constraint_target=constraint_target)  # run the functions.
-        obsValuesGN = run_fn(function, paramsGN, npt,
-                             constraint_target=constraint_target)  # run the functions.
+        if useBroyden:  # only need the base case which was ran in the last line search.
+            paramsGN = paramsGN[0:1, :]
+            obsValuesGN = obsValuesBest[np.newaxis, :]
+        else:
+            if pipeline and (predJacobian is not None):
+                # predict line-search from previous Jacobian and the new base case (ran in the last line search).
+                paramsPred = doGaussNewton(paramsGN[0:1, :], paramRange, obsValuesBest[np.newaxis, :], target,
+                                           cov=cov, scalings=scalings, studyJSON=optimise,
+                                           jacobian=predJacobian, trace=trace)[1]
+            if paramsPred is None:
+                obsValuesGN = run_fn(function, paramsGN, npt,
+                                     constraint_target=constraint_target)  # run the functions.
+            else:  # run the Jacobian and predicted line-search cases in one batch.
+                obsValuesGN = run_fn(function, np.vstack((paramsGN, paramsPred)), npt,
+                                     constraint_target=constraint_target)
+                obsValuesPred = obsValuesGN[paramsGN.shape[0]:, :]
+                obsValuesGN = obsValuesGN[0:paramsGN.shape[0], :]
+            nSinceFull = 0
+        nSinceFull += 1
         optStatus, paramsLS, err, err_constraint, infoGN = \
             doGaussNewton(paramsGN, paramRange, obsValuesGN, target, cov=cov, scalings=scalings,
                           # constraint=constraintGN, constraint_target=constraint_target,
-                          studyJSON=optimise, trace=trace)  # run GN
+                          studyJSON=optimise, jacobian=jacobian, trace=trace)  # run GN
         # add some more information to the info dict.
         infoGN['err_constraint'] = err_constraint
         infoGN['obsValues'] = obsValuesGN
         infoGN['paramValues'] = paramsGN
+        infoGN['broyden'] = useBroyden
         if trace:  # print(out some information)
             print("GN: paramValues: \n", paramsLS)  # , " err_constraint", err_constraint[0])
 
@@ -812,7 +1067,23 @@ def gaussNewton(function: typing.Callable,
         if paramsLS is None: # failed in some way.
             break # exit the loop.
 
-        obsValuesLS = run_fn(function, paramsLS, npt, constraint_target=constraint_target)
+        if paramsPred is None:
+            obsValuesLS = run_fn(function, paramsLS, npt, constraint_target=constraint_target)
+            infoGN['predicted'] = np.zeros(paramsLS.shape[0], dtype=bool)
+        else:  # use the predicted cases that are close enough and run the others.
+            # distances measured in units of paramStep
+            error = np.linalg.norm((paramsLS - paramsPred) / paramStep, axis=1)
+            size = np.linalg.norm((paramsLS - paramsGN[0, :]) / paramStep, axis=1)
+            predicted = error <= pipeline_tol * size
+            if trace:
+                print(f"Pipeline: {predicted.sum()} of {len(predicted)} line-search cases predicted")
+            paramsLS[predicted, :] = paramsPred[predicted, :]
+            obsValuesLS = np.zeros((paramsLS.shape[0], obsValuesPred.shape[1]))
+            obsValuesLS[predicted, :] = obsValuesPred[predicted, :]
+            if not np.all(predicted):
+                obsValuesLS[~predicted, :] = run_fn(function, paramsLS[~predicted, :], npt,
+                                                    constraint_target=constraint_target)
+            infoGN['predicted'] = predicted
         # need to merge paramsGS and paramsLS, obsValesGN & obsValuesGN & constraintGN and constraintLS
         params = np.vstack((paramsGN, paramsLS))
         obsValues = np.vstack((obsValuesGN, obsValuesLS))
@@ -827,6 +1098,23 @@ def gaussNewton(function: typing.Callable,
         infoLS['paramValues'] = paramsLS
         infoLS['obsValues'] = obsValuesLS
         statusList.append({'gaussNewton': infoGN, 'lineSearch': infoLS})
+        jacobian = None
+        useBroyden = False
+        obsValuesBest = obsValuesLS[index, :]
+        predJacobian = infoGN['jacobian'] * infoGN['param_scale'][:, np.newaxis]
+        if nrandom is not None:  # carry forward the jacobian. Next iteration refreshes nrandom rows of it.
+            jacobian = infoGN['jacobian'] * infoGN['param_scale'][:, np.newaxis]
+        if broyden and (statusInfo == 'Continue') and (nSinceFull < broyden_refresh):
+            # paramsGN is now the next set of parameters. params & obsValues still have this iteration's values.
+            jacobian, quality = broyden_update(infoGN['jacobian'], infoGN['param_scale'],
+                                               bestParam - params[0, :],
+                                               obsValuesBest - obsValues[0, :], scalings=scalings)
+            infoLS['broyden_quality'] = quality
+            if trace:
+                print(f"Broyden update quality {quality:.3g}")
+            useBroyden = quality <= broyden_tol
+            if not useBroyden:  # linear prediction poor so compute full jacobian.
+                jacobian = None
         iterCount += 1  # increase iteration count
         if (maxIterations is not None) and (iterCount >= maxIterations):
             if trace:
@@ -840,7 +1128,7 @@ def gaussNewton(function: typing.Callable,
             print("LS: statusInfo %s Iter: %d Err_constraint" % (statusInfo, iterCount), err_constraint)
 
         if statusInfo == 'Continue' or statusInfo == 'Converged':
-            nFail == 0  # reset failure count as we are ok
+            nFail = 0  # reset failure count as we are ok
             prevBestParam = bestParam[:]  # update prevBestParam in case we restart
         else:  # we've failed...
             nFail += 1  # increment failure count
@@ -851,9 +1139,10 @@ def gaussNewton(function: typing.Callable,
                 # we will always get the same parameters perturbed...
                 # Will hack this by passing a number to deterministic
                 # then using that to increment the RNG.
-                params, randIndx = rangeAwarePerturbations(prevBestParam, paramRange, paramStep, nrandom=nrandom,
-                                                           deterministic=totalFail + 1, trace=trace)
-                statusInfo = 'continue'  # keep going.
+                paramsGN, randIndx = rangeAwarePerturbations(prevBestParam, paramRange, paramStep, nrandom=nrandom,
+                                                             deterministic=totalFail + 1, trace=trace)
+                predJacobian = None  # base case has changed so can not predict.
+                statusInfo = 'Continue'  # keep going.
 
         if trace:
             print("prevBestParam on iter %i is " % iterCount, prevBestParam)
@@ -862,10 +1151,6 @@ def gaussNewton(function: typing.Callable,
 
     # rearrange the info array
     # start with the err_constraint from lineSearch
-    if nrandom is not None:
-        raise NotImplementedError(
-            "Need to make info code work with random algorithm...If you don't care switch this off")
-
     jacobian = []
     hessian = []
     alpha = []
@@ -891,12 +1176,364 @@ def gaussNewton(function: typing.Callable,
     err_constraint = np.asarray(err_constraint)
     bestParams = np.asarray(bestParams)
     alpha = np.asarray(alpha)
+    broyden = np.array([iterInfo['gaussNewton']['broyden'] for iterInfo in statusList])
+    refreshed = np.zeros((len(statusList), len(startParam)), dtype=bool)
+    for indx, iterInfo in enumerate(statusList):
+        refreshed[indx, iterInfo['gaussNewton']['refreshed']] = True
+    predicted = np.array([np.sum(iterInfo['gaussNewton']['predicted']) for iterInfo in statusList])
     statusList = {'jacobian': jacobian, 'hessian': hessian, 'alpha': alpha, 'err_constraint': err_constraint,
-                  'iter': iter, 'bestParams': bestParams}
+                  'iter': iter, 'bestParams': bestParams, 'broyden': broyden, 'refreshed': refreshed,
+                  'predicted': predicted}
 
     return prevBestParam, statusInfo, statusList  # would also like to return a bunch of info to help trace the performance of the algorithm.
 
 
+def bounded_transform(z: np.ndarray, paramRange: np.ndarray) -> np.ndarray:
+    """
+    Map unbounded values to parameters within paramRange. The map is periodic with period 2 and for
+     0 <= z <= 1 takes z=0 to the minimum and z=1 to the maximum. So every z gives a parameter within range.
+    :param z: values to transform. Last dimension is parameters.
+    :param paramRange: a Nx2 numpy array of the minimum parameter values [*,0] and maximum parameter values [*,1]
+    :return: parameter values.
+    """
+    return paramRange[:, 0] + (paramRange[:, 1] - paramRange[:, 0]) * (1 - np.cos(np.pi * z)) / 2
+
+
+def bounded_inverse(param: np.ndarray, paramRange: np.ndarray) -> np.ndarray:
+    """
+    Inverse of bounded_transform. Returns values between 0 and 1.
+    :param param: parameter values. Values outside paramRange are treated as the nearest bound.
+    :param paramRange: a Nx2 numpy array of the minimum parameter values [*,0] and maximum parameter values [*,1]
+    :return: values which bounded_transform maps to param.
+    """
+    frac = (param - paramRange[:, 0]) / (paramRange[:, 1] - paramRange[:, 0])
+    return np.arccos(1 - 2 * np.clip(frac, 0, 1)) / np.pi
+
+
+def cmaes(function: typing.Callable,
+          startParam: np.ndarray,
+          paramRange: np.ndarray,
+          optimise: typing.Mapping,
+          trace: bool = False):
+    """
+    Apply the CMA-ES (Covariance Matrix Adaptation Evolution Strategy) algorithm to the specified function.
+    Follows Hansen, The CMA Evolution Strategy: A Tutorial (arXiv:1604.00772).
+    Search is done in a space that bounded_transform maps to paramRange so all parameters are within range.
+    Each generation is one call to function so can be ran in parallel.
+    :param function: function to be minimised. Should take a 2D numpy array (each row a parameter set)
+       and return one cost for each row.
+    :param startParam: a length N numpy array of the starting parameters (mean of the first generation)
+    :param paramRange: a Nx2 numpy array of the minimum parameter values [*,0] and maximum parameter values [*,1]
+    :param optimise: A dict of information used. The following are used:
+         popsize -- number of parameter sets in each generation. Default is 4+3*ln(N)
+         sigma0 -- initial step size in transformed space (where the parameter range is 1). Default is 0.2
+         maxIterations -- maximum number of generations. Default is 100.
+         maxfun -- maximum number of function evaluations. Default is None (no limit).
+         tolfun -- converged when range of best costs over last 10 generations (and of current generation)
+            is less than tolfun. Default is 1e-8
+         tolx -- converged when step size (in transformed space) is less than tolx. Default is 1e-8
+         seed -- seed for random number generator. Default is 123456. Same seed gives the same sequence of
+            parameters for the same costs.
+    :param trace: provide more trace information
+    :return: Returns minimal cost param values, status of termination & information on each generation.
+    """
+    nparam = len(startParam)
+    popsize = optimise.get('popsize', 4 + int(3 * np.log(nparam)))
+    if popsize < 2:
+        raise ValueError(f"popsize {popsize} < 2")
+    sigma = optimise.get('sigma0', 0.2)
+    maxIterations = optimise.get('maxIterations', 100)
+    maxfun = optimise.get('maxfun', None)
+    tolfun = optimise.get('tolfun', 1e-8)
+    tolx = optimise.get('tolx', 1e-8)
+    rng = np.random.default_rng(optimise.get('seed', 123456))
+
+    # strategy parameters
+    mu = popsize // 2
+    weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+    weights /= weights.sum()
+    mueff = 1 / np.sum(weights ** 2)
+    cc = (4 + mueff / nparam) / (nparam + 4 + 2 * mueff / nparam)
+    cs = (mueff + 2) / (nparam + mueff + 5)
+    c1 = 2 / ((nparam + 1.3) ** 2 + mueff)
+    cmu = min(1 - c1, 2 * (mueff - 2 + 1 / mueff) / ((nparam + 2) ** 2 + mueff))
+    damps = 1 + 2 * max(0, np.sqrt((mueff - 1) / (nparam + 1)) - 1) + cs
+    chiN = np.sqrt(nparam) * (1 - 1 / (4 * nparam) + 1 / (21 * nparam ** 2))
+
+    mean = bounded_inverse(np.asarray(startParam, dtype=float), paramRange)
+    pc = np.zeros(nparam)
+    ps = np.zeros(nparam)
+    B = np.identity(nparam)
+    D = np.ones(nparam)
+    C = np.identity(nparam)
+    bestParam = np.asarray(startParam, dtype=float).copy()
+    bestCost = np.inf
+    nfun = 0
+    statusInfo = 'Continue'
+    history = dict(mean=[], sigma=[], bestParams=[], best_cost=[], cost=[])
+    while statusInfo == 'Continue':
+        ary = rng.standard_normal((popsize, nparam)) @ (B * D).T  # samples with covariance C
+        arz = mean + sigma * ary
+        params = bounded_transform(arz, paramRange)
+        cost = np.atleast_1d(np.asarray(function(params), dtype=float))
+        if cost.shape != (popsize,):
+            raise ValueError(f"Expected {popsize} costs got shape {cost.shape}")
+        if np.any(np.isnan(cost)):
+            raise ValueError("cmaes: function returned nan")
+        nfun += popsize
+        order = np.argsort(cost, kind='stable')
+        if cost[order[0]] < bestCost:
+            bestCost = cost[order[0]]
+            bestParam = params[order[0], :]
+        history['mean'].append(bounded_transform(mean, paramRange))
+        history['sigma'].append(sigma)
+        history['bestParams'].append(params[order[0], :])
+        history['best_cost'].append(cost[order[0]])
+        history['cost'].append(cost)
+        # update mean, evolution paths, covariance and step size.
+        y_w = weights @ ary[order[0:mu], :]
+        mean = mean + sigma * y_w
+        invsqrtC = (B / D) @ B.T
+        ps = (1 - cs) * ps + np.sqrt(cs * (2 - cs) * mueff) * (invsqrtC @ y_w)
+        niter = len(history['sigma'])
+        hsig = (np.linalg.norm(ps) / np.sqrt(1 - (1 - cs) ** (2 * niter)) / chiN) < (1.4 + 2 / (nparam + 1))
+        pc = (1 - cc) * pc + hsig * np.sqrt(cc * (2 - cc) * mueff) * y_w
+        artmp = ary[order[0:mu], :]
+        C = (1 - c1 - cmu) * C + c1 * (np.outer(pc, pc) + (1 - hsig) * cc * (2 - cc) * C) + \
+            cmu * (artmp.T * weights) @ artmp
+        sigma *= np.exp((cs / damps) * (np.linalg.norm(ps) / chiN - 1))
+        C = np.triu(C) + np.triu(C, 1).T  # enforce symmetry
+        D, B = np.linalg.eigh(C)
+        D = np.sqrt(np.maximum(D, 0))
+        # decide if we carry on.
+        recent = np.hstack((history['best_cost'][-10:], cost))
+        if (niter > 1) and (np.ptp(recent) < tolfun):
+            statusInfo = 'Converged'
+        elif sigma * D.max() < tolx:
+            statusInfo = 'Converged'
+        elif niter >= maxIterations:
+            statusInfo = 'Failed'
+        elif (maxfun is not None) and (nfun + popsize > maxfun):
+            statusInfo = 'Failed'
+        if trace:
+            print(f"CMAES: generation {niter} best cost {cost[order[0]]:.4g} sigma {sigma:.3g} status {statusInfo}")
+
+    info = {k: np.asarray(v) for k, v in history.items()}
+    info['iter'] = np.arange(len(history['sigma']))
+    info['nfun'] = nfun
+    info['best_cost_overall'] = bestCost
+    return bestParam, statusInfo, info
+
+
+def gp_kernel(X1: np.ndarray, X2: np.ndarray, lengthscales: np.ndarray, variance: float) -> np.ndarray:
+    """
+    Matern 5/2 covariance with a separate lengthscale for each parameter.
+    :param X1: n1 x N array of points
+    :param X2: n2 x N array of points
+    :param lengthscales: length N array of lengthscales
+    :param variance: variance of the process
+    :return: n1 x n2 covariance matrix
+    """
+    diff = (X1[:, np.newaxis, :] - X2[np.newaxis, :, :]) / lengthscales
+    r = np.sqrt(5 * np.sum(diff ** 2, axis=-1))
+    return variance * (1 + r + r ** 2 / 3) * np.exp(-r)
+
+
+def gp_fit(X: np.ndarray, y: np.ndarray, hyper: typing.Optional[np.ndarray] = None) -> dict:
+    """
+    Fit a Gaussian Process (GP) with Matern 5/2 covariance to values. Hyper-parameters (log of lengthscales,
+     variance and noise variance) are chosen to maximise the marginal likelihood unless provided.
+    :param X: n x N array of points. Expected to be scaled so the parameter range is 0 to 1.
+    :param y: length n array of values at X
+    :param hyper: if provided, hyper-parameters to use (as returned in the "hyper" element).
+    :return: dict describing the GP for use by gp_predict.
+    """
+    import scipy.optimize
+    npt, nparam = X.shape
+    y_mean = np.mean(y)
+    y_std = np.std(y)
+    if y_std == 0:
+        y_std = 1.0
+    ynorm = (y - y_mean) / y_std
+
+    def factor(h):
+        K = gp_kernel(X, X, np.exp(h[0:nparam]), np.exp(h[nparam]))
+        K[np.diag_indices_from(K)] += np.exp(h[nparam + 1]) + 1e-10
+        return scipy.linalg.cho_factor(K, lower=True)
+
+    def neg_log_like(h):
+        try:
+            chol = factor(h)
+        except np.linalg.LinAlgError:
+            return 1e10
+        alpha = scipy.linalg.cho_solve(chol, ynorm)
+        return 0.5 * ynorm.dot(alpha) + np.sum(np.log(np.diag(chol[0])))
+
+    if hyper is None:
+        start = np.hstack((np.log(np.repeat(0.3, nparam)), 0.0, np.log(1e-4)))
+        bounds = [(np.log(1e-2), np.log(10.))] * nparam + [(np.log(1e-2), np.log(1e2)), (np.log(1e-8), 0.0)]
+        hyper = scipy.optimize.minimize(neg_log_like, start, method='L-BFGS-B', bounds=bounds).x
+    chol = factor(hyper)
+    return dict(X=X, y_mean=y_mean, y_std=y_std, hyper=hyper, chol=chol,
+                alpha=scipy.linalg.cho_solve(chol, ynorm))
+
+
+def gp_predict(gp: dict, Xnew: np.ndarray, full_cov: bool = False) -> (np.ndarray, np.ndarray):
+    """
+    Predict GP mean and variance.
+    :param gp: GP as returned by gp_fit
+    :param Xnew: m x N array of points to predict at
+    :param full_cov: if True return the full m x m covariance rather than the variances.
+    :return: mean and variance (or covariance) at Xnew
+    """
+    nparam = Xnew.shape[1]
+    lengthscales, variance = np.exp(gp['hyper'][0:nparam]), np.exp(gp['hyper'][nparam])
+    Ks = gp_kernel(Xnew, gp['X'], lengthscales, variance)
+    mean = gp['y_mean'] + gp['y_std'] * Ks.dot(gp['alpha'])
+    v = scipy.linalg.solve_triangular(gp['chol'][0], Ks.T, lower=True)
+    if full_cov:
+        var = gp_kernel(Xnew, Xnew, lengthscales, variance) - v.T.dot(v)
+    else:
+        var = np.maximum(variance - np.sum(v ** 2, axis=0), 1e-12)
+    return mean, var * gp['y_std'] ** 2
+
+
+def expected_improvement(mean: np.ndarray, var: np.ndarray, best: float) -> np.ndarray:
+    """
+    Expected improvement (for minimisation) over best.
+    :param mean: predicted mean
+    :param var: predicted variance
+    :param best: best value found so far.
+    :return: expected improvement
+    """
+    from scipy.stats import norm
+    sd = np.sqrt(var)
+    z = (best - mean) / sd
+    return (best - mean) * norm.cdf(z) + sd * norm.pdf(z)
+
+
+def bayesOpt(function: typing.Callable,
+             startParam: np.ndarray,
+             paramRange: np.ndarray,
+             optimise: typing.Mapping,
+             trace: bool = False):
+    """
+    Apply batch Bayesian optimisation to the specified function. A Gaussian Process (GP) is fitted to all
+     costs evaluated so far and q new points chosen to maximise the expected improvement. Points are chosen one at a
+     time either by the Kriging believer scheme (previously chosen points are added to the GP with their predicted
+     cost) or by maximising the Monte Carlo estimate of the q-point expected improvement (q-EI). All q points are
+     then evaluated in one call to function.
+    :param function: function to be minimised. Should take a 2D numpy array (each row a parameter set)
+       and return one cost for each row.
+    :param startParam: a length N numpy array of the starting parameters. Included in the initial design.
+    :param paramRange: a Nx2 numpy array of the minimum parameter values [*,0] and maximum parameter values [*,1]
+    :param optimise: A dict of information used. The following are used:
+         ninitial -- size of initial (Latin hypercube) design including startParam. Default is 2N+1.
+         q -- number of points chosen each iteration. Default is 4.
+         acquisition -- 'kb' (Kriging believer) or 'qei' (q-expected improvement). Default is 'kb'.
+         maxIterations -- maximum number of iterations (not including the initial design). Default is 10.
+         ncandidates -- number of random candidate points tried when maximising the acquisition function.
+            Half are uniform across the parameter range and half close to the best points. Default is 1000.
+         nsamples -- number of Monte Carlo samples used for q-EI. Default is 256.
+         tolEI -- converged when the expected improvement is less than tolEI. Default is 0
+         seed -- seed for random number generator. Default is 123456. Same seed gives the same sequence of
+            parameters for the same costs.
+    :param trace: provide more trace information
+    :return: Returns minimal cost param values, status of termination & information on each iteration.
+    """
+    nparam = len(startParam)
+    ninitial = optimise.get('ninitial', 2 * nparam + 1)
+    q = optimise.get('q', 4)
+    acquisition = optimise.get('acquisition', 'kb').lower()
+    if acquisition not in ['kb', 'qei']:
+        raise ValueError(f"Unknown acquisition {acquisition}")
+    maxIterations = optimise.get('maxIterations', 10)
+    ncandidates = optimise.get('ncandidates', 1000)
+    nsamples = optimise.get('nsamples', 256)
+    tolEI = optimise.get('tolEI', 0.0)
+    rng = np.random.default_rng(optimise.get('seed', 123456))
+    lower = paramRange[:, 0]
+    prange = paramRange[:, 1] - paramRange[:, 0]
+
+    def run(u):
+        cost = np.atleast_1d(np.asarray(function(lower + u * prange), dtype=float))
+        if cost.shape != (u.shape[0],):
+            raise ValueError(f"Expected {u.shape[0]} costs got shape {cost.shape}")
+        if np.any(np.isnan(cost)):
+            raise ValueError("bayesOpt: function returned nan")
+        return cost
+
+    # initial design -- start + Latin hypercube.
+    design = (rng.permuted(np.tile(np.arange(ninitial - 1), (nparam, 1)), axis=1).T +
+              rng.uniform(size=(ninitial - 1, nparam))) / (ninitial - 1)
+    U = np.vstack((np.clip((startParam - lower) / prange, 0, 1), design))
+    cost = run(U)
+    history = dict(bestParams=[], best_cost=[], max_ei=[], iterParams=[])
+    statusInfo = 'Continue'
+    niter = 0
+    while statusInfo == 'Continue':
+        gp = gp_fit(U, cost)
+        best = cost.min()
+        ibest = np.argsort(cost, kind='stable')[0:max(1, q)]
+        cand = np.vstack((rng.uniform(size=(ncandidates // 2, nparam)),
+                          np.clip(U[rng.choice(ibest, ncandidates - ncandidates // 2), :] +
+                                  rng.normal(0, 0.05, (ncandidates - ncandidates // 2, nparam)), 0, 1)))
+        mean, var = gp_predict(gp, cand)
+        ei = expected_improvement(mean, var, best)
+        chosen = [np.argmax(ei)]
+        max_ei = ei[chosen[0]]
+        normals = rng.standard_normal((nsamples, q))
+        gp_kb = gp
+        while len(chosen) < q:
+            if acquisition == 'kb':  # add the chosen point with its predicted mean and recompute EI.
+                Ub = np.vstack((U, cand[chosen, :]))
+                yb = np.hstack((cost, mean[chosen]))
+                gp_kb = gp_fit(Ub, yb, hyper=gp['hyper'])
+                m, v = gp_predict(gp_kb, cand)
+                acq = expected_improvement(m, v, best)
+            else:  # q-EI from joint posterior samples for chosen points plus each candidate.
+                k = len(chosen) + 1
+                m, c = gp_predict(gp, np.vstack((cand[chosen, :], cand)), full_cov=True)
+                # joint mean and covariance of the chosen points and each candidate.
+                means = np.hstack((np.broadcast_to(m[0:k - 1], (len(cand), k - 1)), m[k - 1:, np.newaxis]))
+                covs = np.empty((len(cand), k, k))
+                covs[:, 0:k - 1, 0:k - 1] = c[0:k - 1, 0:k - 1]
+                covs[:, 0:k - 1, k - 1] = c[0:k - 1, k - 1:].T
+                covs[:, k - 1, 0:k - 1] = c[0:k - 1, k - 1:].T
+                covs[:, k - 1, k - 1] = np.diag(c)[k - 1:]
+                w, V = np.linalg.eigh(covs)  # robust to (nearly) singular covariances
+                sqrt_cov = V * np.sqrt(np.maximum(w, 0))[:, np.newaxis, :]
+                samp = means[:, np.newaxis, :] + np.einsum('sj,cij->csi', normals[:, 0:k], sqrt_cov)
+                acq = np.mean(np.maximum(best - samp.min(axis=2), 0), axis=1)
+            acq[chosen] = -np.inf  # do not choose the same point twice
+            chosen.append(int(np.argmax(acq)))
+        newU = cand[chosen, :]
+        niter += 1
+        if max_ei <= tolEI:
+            statusInfo = 'Converged'
+            break
+        newCost = run(newU)
+        U = np.vstack((U, newU))
+        cost = np.hstack((cost, newCost))
+        ibest = np.argmin(cost)
+        history['bestParams'].append(lower + U[ibest, :] * prange)
+        history['best_cost'].append(cost[ibest])
+        history['max_ei'].append(max_ei)
+        history['iterParams'].append(lower + newU * prange)
+        if trace:
+            print(f"bayesOpt: iteration {niter} best cost {cost[ibest]:.4g} max EI {max_ei:.3g}")
+        if niter >= maxIterations:
+            statusInfo = 'Failed'
+
+    ibest = np.argmin(cost)
+    info = {k: np.asarray(v) for k, v in history.items()}
+    info['iter'] = np.arange(len(history['best_cost']))
+    info['params'] = lower + U * prange
+    info['cost'] = cost
+    info['hyper'] = gp['hyper']
+    return lower + U[ibest, :] * prange, statusInfo, info
+
+
 # new Jacobian support stuff.
 def rangeAwarePerturbations2(baseVals, parLimits, steps, nrandom=None,
                              deterministic=True, trace=False):
@@ -1007,6 +1644,86 @@ def runJacobian(function, startParam, deltaParam, paramRange, *args,
     return result  # return it.
 
 
+def adaptiveJacobian(function, startParam, deltaParam, paramRange, covIntVar, *args,
+                     obsNames=None, snr=2.0, maxEnsemble=8, verbose=False, **kwargs):
+    """
+    Compute Jacobian running extra ensemble members only for parameters where the Jacobian is noisy.
+    Starts with one ensemble member for the base case and each perturbed parameter. Then repeatedly:
+      1) Estimates the variance of each Jacobian element. The variance of the simulated observations is the
+         sample variance across ensemble members when there are two or more. Otherwise the diagonal of covIntVar.
+      2) Computes the signal to noise ratio for each parameter as sqrt(mean(jacobian**2/variance)).
+      3) Works out how many members each parameter needs to reach snr (noise falls as sqrt of members)
+         and requests the extra members (and for the base case, the most any parameter needs).
+    until no parameter needs more members. All extra members needed at each step are requested in a single
+    call to function.
+
+    :param function: function to be ran. Called as function(params, *args, ensembleMember=members, **kwargs) where
+       params is a 2D numpy array of parameters (each row a simulation) and members an integer numpy array with the
+       ensemble member for each row. Should return a 2D array of simulated observations. See runSubmit.stdFunction.
+    :param startParam:  start parameter as a pandas Series
+    :param deltaParam:  perturbations as a pandas Series
+    :param paramRange: paramRange as a pandas dataFrame
+    :param covIntVar: internal variability covariance for the simulated observations (2D array or dataframe)
+    :param obsNames: (default None). Names of observations. If not passed then will be Obs0, Obs1,...
+    :param snr: (default 2) signal to noise ratio wanted for each parameter.
+    :param maxEnsemble: (default 8) maximum number of ensemble members for any simulation.
+    :param verbose: (default False) If True print out information on ensemble members requested.
+    Other arguments are passed to function.
+    :return: xarray Dataset containing:
+       Jacobian -- the Jacobian (ensemble-mean perturbed - ensemble-mean base)/perturbation.
+       Jacobian_var -- estimated variance of the Jacobian.
+       nEnsemble -- number of ensemble members ran for each parameter.
+       snr -- signal to noise ratio for each parameter.
+    """
+    dp, indx = rangeAwarePerturbations2(startParam.values, paramRange.loc[['minParam', 'maxParam']].values.T,
+                                        deltaParam.values)  # compute the perturbations.
+    nparam = len(dp)
+    params = startParam.values + np.vstack((np.zeros(nparam), np.diag(dp)))  # base then each perturbed parameter
+    int_var = np.diag(np.asarray(covIntVar, dtype=float))
+    values = [[] for p in params]  # simulated values for each ensemble member of base & perturbed parameters
+    nwant = np.ones(nparam + 1, dtype=int)  # members wanted for base & perturbed parameters.
+    while True:
+        rows = [r for r in range(nparam + 1) for m in range(len(values[r]), nwant[r])]
+        if len(rows) == 0:
+            break
+        members = np.array([m for r in range(nparam + 1) for m in range(len(values[r]), nwant[r])], dtype=int)
+        if verbose:
+            print(f"adaptiveJacobian: running {len(rows)} simulations. Members wanted: {nwant}")
+        sim = np.asarray(function(params[rows, :], *args, ensembleMember=members, **kwargs), dtype=float)
+        sim = sim.reshape(len(rows), -1)
+        if np.any(np.isnan(sim)):
+            logging.info('adaptiveJacobian: Found NaN and raising ValueError')
+            raise ValueError
+        for r, v in zip(rows, sim):
+            values[r].append(v)
+        # compute means, variances and signal to noise.
+        nens = np.array([len(v) for v in values])
+        means = np.array([np.mean(v, axis=0) for v in values])
+        var = np.array([np.var(v, axis=0, ddof=1) if len(v) > 1 else int_var for v in values])
+        jacobian = (means[1:, :] - means[0, :]) / dp[:, np.newaxis]
+        jac_var = (var[1:, :] / nens[1:, np.newaxis] + var[0, :] / nens[0]) / (dp[:, np.newaxis] ** 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.nan_to_num(jacobian ** 2 / jac_var, nan=np.inf)
+        param_snr = np.sqrt(np.mean(ratio, axis=1))
+        # noise variance scales as 1/members so members needed scale as (snr/param_snr)**2
+        with np.errstate(divide='ignore'):
+            need = np.ceil(nens[1:] * (snr / param_snr) ** 2)
+        need = np.clip(np.nan_to_num(need, posinf=maxEnsemble), 1, maxEnsemble).astype(int)
+        need = np.maximum(need, nens[1:])
+        nwant = np.hstack((max(nens[0], need.max()), need))
+
+    if obsNames is not None:
+        use_obsNames = obsNames
+    else:
+        use_obsNames = ['Obs' + str(i) for i in np.arange(0, jacobian.shape[1])]
+    coords = (('parameter', startParam.index), ('Observation', use_obsNames))  # co-ord info for xarray
+    result = xarray.Dataset({'Jacobian': xarray.DataArray(jacobian, coords),
+                             'Jacobian_var': xarray.DataArray(jac_var, coords),
+                             'nEnsemble': xarray.DataArray(nens[1:], coords[0:1]),
+                             'snr': xarray.DataArray(param_snr, coords[0:1])})
+    return result
+
+
 def GNjacobian(function, startParam, deltaParam, *extraArgs, paramIndex=None,
                verbose=False, **kwargs):
     """
@@ -265,6 +265,46 @@ class Study:
         cost = pd.Series(cost, index=obs.index).rename('cost ' + self.name)
         return cost
 
+    def job_runtimes(self, job: typing.Literal['model', 'post_process'] = 'model') -> pd.DataFrame:
+        """
+        Extract observed run times of jobs that completed successfully.
+        :param job: type of job -- 'model' or 'post_process'
+        :return: pandas dataframe with columns model_type, duration (see Model.run_duration)
+           and runtime (seconds). Index is the model name which may be repeated.
+        """
+        rows = []
+        names = []
+        for model in self.model_index.values():
+            for runtime in model.job_runtimes(job=job):
+                rows.append(dict(model_type=model.class_name(), duration=model.run_duration(), runtime=runtime))
+                names.append(model.name)
+        return pd.DataFrame(rows, index=names, columns=['model_type', 'duration', 'runtime'])
+
+    def runtime_estimate(self, model: Model,
+                         job: typing.Literal['model', 'post_process'] = 'model',
+                         percentile: float = 90.,
+                         min_samples: int = 3) -> typing.Optional[float]:
+        """
+        Estimate how long a job will take from jobs already ran for models
+          of the same type and duration.
+        :param model: model for which the estimate is wanted.
+        :param job: type of job -- 'model' or 'post_process'
+        :param percentile: percentile (0-100) of observed runtimes to use.
+        :param min_samples: minimum number of observed runtimes needed.
+        :return: estimated runtime in seconds or None if fewer than min_samples runtimes available.
+        """
+        runtimes = self.job_runtimes(job=job)
+        L = (runtimes.model_type == model.class_name())
+        duration = model.run_duration()
+        if duration is None:
+            L &= runtimes.duration.isnull()
+        else:
+            L &= (runtimes.duration == duration)
+        runtimes = runtimes.runtime[L]
+        if len(runtimes) < min_samples:
+            return None
+        return float(np.percentile(runtimes, percentile))
+
     def runConfig(self, filename: typing.Optional[pathlib.Path] = None,
                   scale: bool = True, add_cost: bool = True) -> OptClimConfigVn3:
         """
@@ -1386,6 +1386,28 @@ class OptClimConfig(dictFile):
             self.optimise()['dfols'] = copy.deepcopy(dfolsConfig)  # copy input.
         return self.optimise().get('dfols', {})
 
+    def BayesOpt_config(self, bayesConfig=None):
+        """
+
+        Extract (and optionally set) the Bayesian optimisation specific information. See Optimise.bayesOpt
+        :param bayesConfig -- a dict of Bayesian optimisation config data which replaces existing values
+        :return: the configuration which (like most python is a ptr to the data).
+        """
+        if bayesConfig is not None:
+            self.optimise()['bayesopt'] = copy.deepcopy(bayesConfig)  # copy input.
+        return self.optimise().get('bayesopt', {})
+
+    def CMAES_config(self, cmaesConfig=None):
+        """
+
+        Extract (and optionally set) the CMA-ES specific information. See Optimise.cmaes
+        :param cmaesConfig -- a dict of CMA-ES config data which replaces existing values
+        :return: the configuration which (like most python is a ptr to the data).
+        """
+        if cmaesConfig is not None:
+            self.optimise()['cmaes'] = copy.deepcopy(cmaesConfig)  # copy input.
+        return self.optimise().get('cmaes', {})
+
     def DFOLS_userParams(self, userParams=None, updateParams=None):
         """
 
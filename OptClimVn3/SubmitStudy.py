@@ -8,6 +8,7 @@ Porting hints:
 """
 from __future__ import annotations
 
+import concurrent.futures
 import copy
 import logging
 import pathlib
@@ -36,6 +37,17 @@ __version__ = '0.9'
 
 my_logger=logging.getLogger(f"OPTCLIM.{__name__}")
 
+
+def _instantiate_model(model: Model) -> Model:
+    """
+    Instantiate a model. Module level so it can be ran by a process pool.
+    :param model: model to instantiate
+    :return: the instantiated model.
+    """
+    model.instantiate()
+    return model
+
+
 class SubmitStudy( Study, model_base,journal):
     # typing information for class attributes
     refDir: pathlib.Path
@@ -67,6 +79,7 @@ class SubmitStudy( Study, model_base,journal):
 
 
     fn_type = Callable[[Mapping], pd.Series]  # type hint for fakeFn
+    live_job_status = ['Running', 'Held', 'Queuing', 'Suspended']  # engine.job_status for jobs yet to finish.
 
     def __init__(self,
                  config: Optional[OptClimConfigVn3],
@@ -292,18 +305,53 @@ class SubmitStudy( Study, model_base,journal):
 
         return obj
 
-    def instantiate(self):
+    def instantiate(self) -> int:
         """
         Instantiate all created models. And update_iter so we can see what was done.
-        :return: True if all were instantiated. False otherwise
+        Controlled by the following key in run_info:
+           instantiate_parallel -- maximum number of models to instantiate at once. Default is 1 (serial
+              instantiation in this process). If > 1 a pool of processes is used as model instantiation
+              (fileinput with inplace=True) redirects sys.stdout which is not safe with threads.
+              Instantiated models are copied back into the model_index.
+        Errors are collected for each model so one failure does not stop the others being instantiated.
+        Only models that were instantiated are added to the iteration info, in model_index order.
+        :return: iteration count for the instantiated models.
+        Raises ValueError (once all models have been tried) if any model failed to instantiate.
         """
 
         models = [model for model in self.model_index.values() if model.status == 'CREATED']
-        for model in models:
-            model.instantiate()  # model state will be written out.
-        iter_count = self.update_iter(models)  # update iteration info
-        self.update_history(f'Instantiated {len(models)} models on iteration {iter_count}')
-        my_logger.info(f"Instantiated {len(models)} models")
+        n_workers = self.run_info.get('instantiate_parallel', 1)
+        if (n_workers is None) or (n_workers < 1):
+            raise ValueError(f"instantiate_parallel {n_workers} should be >= 1")
+        errors = dict()
+        if (n_workers == 1) or (len(models) <= 1):
+            for model in models:
+                try:
+                    model.instantiate()  # model state will be written out.
+                except Exception as error:
+                    errors[model.name] = error
+        else:
+            n_workers = min(n_workers, len(models))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [executor.submit(_instantiate_model, model) for model in models]
+                concurrent.futures.wait(futures)
+            for model, future in zip(models, futures):
+                try:
+                    model.fill_attrs(vars(future.result()))  # update model in place so other references see it.
+                except Exception as error:
+                    errors[model.name] = error
+            my_logger.debug(f"Instantiated {len(models)} models using {n_workers} processes")
+
+        instantiated = [model for model in models if model.name not in errors]
+        iter_count = self.update_iter(instantiated)  # update iteration info
+        self.update_history(f'Instantiated {len(instantiated)} models on iteration {iter_count}')
+        my_logger.info(f"Instantiated {len(instantiated)} models")
+        if len(errors) > 0:
+            for name, error in errors.items():
+                my_logger.error(f"Failed to instantiate {name}: {error!r}")
+            self.update_history(f"Failed to instantiate {len(errors)} models: {' '.join(errors.keys())}")
+            raise ValueError(f"Failed to instantiate {len(errors)} models: {' '.join(errors.keys())}") \
+                from list(errors.values())[0]
         return iter_count
 
     def models_to_instantiate(self) -> List[Model]:
@@ -494,6 +542,106 @@ class SubmitStudy( Study, model_base,journal):
             my_logger.warning(f"Ran out of names name_values = {self.name_values}")
         return name  # return name
 
+    def submit_models(self, models: List[Model], fake_fn: Optional[Callable] = None,
+                      pp_jid: typing.Optional[str] = None) -> List[typing.Optional[str]]:
+        """
+        Submit models (and their post-processing) using a pool of threads.
+        Controlled by the following keys in run_info:
+           submit_parallel -- maximum number of submissions to run at once. Default is 1 (serial submission).
+           submit_rate -- maximum number of commands sent to the job system per second. Default is None (no limit).
+             Each model submission sends up to two commands (the held post-processing job and the model).
+        Job names depend only on the model so are unaffected by the order submissions complete in.
+        Unless faking, job times are set using set_runtime before anything is submitted.
+        :param models: list of models to submit.
+        :param fake_fn: Function to fake model runs. Passed to model.submit_model
+        :param pp_jid: job id of a post-processing job shared by all models. Passed to model.submit_model
+        :return: list of post-processing job ids in the same order as models. Will not return until all
+          submissions have completed. If any submission fails the first error (in model order) is raised once
+          all the other submissions have completed.
+        """
+        if fake_fn is None:
+            for model in models:
+                self.set_runtime(model)
+        n_workers = self.run_info.get('submit_parallel', 1)
+        if (n_workers is None) or (n_workers < 1):
+            raise ValueError(f"submit_parallel {n_workers} should be >= 1")
+        limiter = engine.rate_limiter(self.run_info.get('submit_rate'))
+
+        def submit(model: Model) -> typing.Optional[str]:
+            return model.submit_model(fake_function=fake_fn, pp_jid=pp_jid, limiter=limiter)
+
+        n_workers = min(n_workers, max(len(models), 1))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(submit, model) for model in models]
+            concurrent.futures.wait(futures)  # wait for everything so all job ids get recorded.
+        my_logger.debug(f"Submitted {len(models)} models using {n_workers} threads")
+        return [future.result() for future in futures]  # raises first exception, if any.
+
+    def set_runtime(self, model: Model) -> typing.Optional[dict]:
+        """
+        Set the time requested for model and post-processing jobs from runtimes already seen in this study.
+        Controlled by the following keys in run_info:
+          runtime_percentile -- percentile (0-100) of observed runtimes to use. If None (the default) nothing is done
+             and the static runTime values in run_info and post_process are used.
+          runtime_min_samples -- minimum number of observed runtimes needed. Default is 3.
+          runtime_margin -- factor to multiply the estimate by. Default is 1.1
+        Models are matched on type and duration. See Study.runtime_estimate.
+        model.run_info['runTime'] and model.post_process['runTime'] are changed.
+        :param model: model to set runtimes for.
+        :return: dict of job type and time set, or None if runtime_percentile not set.
+        """
+        percentile = self.run_info.get('runtime_percentile')
+        if percentile is None:
+            return None
+        min_samples = self.run_info.get('runtime_min_samples', 3)
+        margin = self.run_info.get('runtime_margin', 1.1)
+        result = dict()
+        for job, info in [('model', model.run_info), ('post_process', model.post_process)]:
+            estimate = self.runtime_estimate(model, job=job, percentile=percentile, min_samples=min_samples)
+            if estimate is None:
+                my_logger.debug(f"Not enough {job} runtimes to estimate runTime for {model.name}")
+                continue
+            run_time = int(np.ceil(estimate * margin))
+            info['runTime'] = run_time
+            result[job] = run_time
+            model.update_history(f"Set {job} runTime to {run_time} seconds")
+            my_logger.info(f"Set {job} runTime to {run_time} seconds for {model.name}")
+        return result
+
+    def submit_post_process(self, models: List[Model]) -> str:
+        """
+        Submit, held, one job that post-processes all models. It runs scripts/process_models.py which processes
+          models as they become SUCCEEDED. The first model to succeed releases it.
+        Controlled by the following keys in run_info:
+            post_process_parallel -- maximum number of models to process at once. Default is 1.
+            post_process_poll -- time (seconds) between checks of model status. Default is 60.
+        Time requested is the post-processing runTime for each set of post_process_parallel models plus the
+          model runTime to allow for models that finish late. The job waits (--max_wait) at most the model runTime
+          for models to succeed so it finishes within the time requested.
+        :param models: models to be post-processed.
+        :return: job id of the post-processing job.
+        """
+        n_workers = self.run_info.get('post_process_parallel', 1)
+        poll = self.run_info.get('post_process_poll', 60)
+        script = self.expand("$OPTCLIMTOP/OptClimVn3/scripts/process_models.py")
+        post_process = self.config.getv('postProcess', {})
+        n_batches = int(np.ceil(len(models) / n_workers))
+        max_wait = self.run_info.get('runTime', 2000)
+        run_time = post_process.get('runTime', 1800) * n_batches + max_wait
+        cmd = [str(script), '-p', str(n_workers), '--poll', str(poll), '--max_wait', str(max_wait)] + \
+              [str(m.config_path) for m in models]
+        run_code = post_process.get('runCode', self.run_info.get('runCode'))
+        output_dir = self.rootDir / 'jobOutput'
+        output_dir.mkdir(parents=True, exist_ok=True)
+        iter_count = np.max(list(self.iter_keys.values()))  # iteration we are at.
+        submit_cmd = self.engine.submit_cmd(cmd, f"PP_{self.config.name()}_{iter_count}", outdir=output_dir,
+                                            hold=True, time=int(run_time), run_code=run_code, rundir=self.rootDir)
+        output = self.run_cmd(submit_cmd)
+        jid = self.engine.job_id(output)
+        my_logger.info(f"Submitted post-processing for {len(models)} models with job ID {jid}")
+        self.update_history(f"Submitted post-processing job with ID {jid} for {len(models)} models")
+        return jid
+
     def submit_all_models(self, fake_fn: Optional[Callable] = None):
         """
         Submit models, the post-processing and the next iteration in the algorithm to job control system.
@@ -502,10 +650,15 @@ class SubmitStudy( Study, model_base,journal):
         :return: number of models submitted
 
         Does the following:
-            1) Submits the models & post processing jobs
+            1) Submits the models & post processing jobs. See submit_models for how to run these in parallel.
+               If run_info['aggregate_post_process'] is True then one job post-processes all models.
+               See submit_post_process.
             2) If any post-processing jobs were submitted then submits  self.next_iter_cmd
                so once the  post-processing jobs has completed the next bit of the algorithm gets ran.
             3) When all the post-processing jobs are done the resubmission will be ran.
+            Models that need continuing are resubmitted. With run_info['aggregate_post_process'] True,
+             models whose shared post-processing job has finished get a new shared post-processing job and
+             the next iteration is submitted held on it.
 
         This algorithm is not particularly robust to failure -- if anything fails the various jobs will be sitting around
         Releasing them will be quite tricky! You can always kill everything, remove any continuing models and start again.
@@ -518,8 +671,6 @@ class SubmitStudy( Study, model_base,journal):
             return 0
 
         models_to_continue = self.models_to_continue()  # models that need continuing.
-        config = self.config
-        configName = config.name()
 
         maxRuns = self.config.maxRuns()
 
@@ -534,16 +685,31 @@ class SubmitStudy( Study, model_base,journal):
                 models_to_continue = models_to_continue[0:maxRuns]
                 my_logger.debug(f"Truncating models_to_continue to {maxRuns}")
 
+            pp_jid = None
+            if self.run_info.get('aggregate_post_process', False):
+                # the shared post-processing job might have finished (gave up waiting). If so need a new one
+                # for models it no longer waits on and the next iteration held on it.
+                finished = [model for model in models_to_continue
+                            if self.engine.job_status(model.pp_jid) not in self.live_job_status]
+                if len(finished) > 0:
+                    pp_jid = self.submit_post_process(finished)
+                    self.submit_models(finished, pp_jid=pp_jid)
+                waiting = [model for model in models_to_continue if model not in finished]  # pp job still there
+                if len(waiting) > 0:
+                    self.submit_models(waiting)
+            else:
+                self.submit_models(models_to_continue)
             for model in models_to_continue:
-                pp_jid = model.submit_model()
                 my_logger.debug(f"Continuing {model.name}  ")
 
             my_logger.info(f"Continued {len(models_to_continue)} models")
             self.update_history(f"Continued {len(models_to_continue)} models")
+            if pp_jid is not None:  # new post-processing job so need the next stage.
+                self.submit_next_iter([pp_jid])
+            # Otherwise nothing else to do -- next stage is still sitting  in the Q waiting to be released.
+            # Will be submitted once all the post-processing jobs have been run.
             self.dump_config()  # and write out the Study
             return len(models_to_continue)
-            # nothing else to do -- next stage is still sitting  in the Q waiting to be released.
-            # Will be submitted once all the post-processing jobs have been run.
 
         # No runs to continue, so let's submit new runs
         # Deal with maxRuns.
@@ -551,10 +717,15 @@ class SubmitStudy( Study, model_base,journal):
             my_logger.debug(f"Reducing to {maxRuns} models.")
             model_list = model_list[0:maxRuns]
 
-        # submit models! Faking if necessary.
-        pp_jids = []  # list of job ids from post-processing
-        for model in model_list:  # submit model and post-processing
-            pp_jids.append(model.submit_model(fake_function=fake_fn))
+        # submit models! Faking if necessary. All submissions complete before the next iteration is submitted
+        # so pp_jids holds every post-processing job id (in model order).
+        if self.run_info.get('aggregate_post_process', False) and (fake_fn is None):
+            # one job post-processes all the models.
+            pp_jid = self.submit_post_process(model_list)
+            self.submit_models(model_list, pp_jid=pp_jid)
+            pp_jids = [pp_jid]
+        else:
+            pp_jids = self.submit_models(model_list, fake_fn=fake_fn)  # list of job ids from post-processing
 
         if fake_fn:
             my_logger.info(f"Faked {len(model_list)} jobs")
@@ -569,26 +740,39 @@ class SubmitStudy( Study, model_base,journal):
         # now (re)submit this entire script so that the next iteration in the algorithm can be ran
         # All the pp_jids should be not None. We remove the None whens if Faking it.
 
-        if (self.next_iter_cmd is not None) and (len(pp_jids) > 0):
+        if len(pp_jids) > 0:
             # submit the next job in the iteration if have one and submitted post-processing.
-            run_info = config.run_info()
-            runCode = config.runCode()  # NB with current implementation this is the same as run_info.get('runCode')
-            iter_count = np.max(list(self.iter_keys.values()))  # iteration we are at.
-            next_job_name = f"{configName}_{iter_count}"
-            run_next_submit = self.engine.submit_cmd(self.next_iter_cmd, next_job_name, outdir=output_dir,
-                                                     run_code=runCode,
-                                                     hold=pp_jids)
-            output = self.run_cmd(run_next_submit)
-            my_logger.info(f"Next iteration cmd is {run_next_submit} with output:{output}")
-            jid = self.engine.job_id(output)  # extract the actual job id.
-            my_logger.info(f"Job ID for next iteration is {jid}")
-            self.next_iter_jids.append(
-                jid)  # append jid to list of jobs. That way if have problems in previous jobs can get info back.
-            self.update_history(f"Submitted next job with ID {jid}")
+            self.submit_next_iter(pp_jids)
 
         self.dump_config()  # and write ourselves out
         return len(model_list)  # all done now
 
+    def submit_next_iter(self, hold: List[str]) -> Optional[str]:
+        """
+        Submit self.next_iter_cmd held on post-processing jobs so the next bit of the algorithm gets ran
+          once they have finished.
+        :param hold: job ids of the post-processing jobs.
+        :return: job id of the next iteration job or None if there is no next_iter_cmd.
+        """
+        if self.next_iter_cmd is None:
+            return None
+        runCode = self.config.runCode()  # NB with current implementation this is the same as run_info.get('runCode')
+        iter_count = np.max(list(self.iter_keys.values()))  # iteration we are at.
+        next_job_name = f"{self.config.name()}_{iter_count}"
+        output_dir = self.rootDir / 'jobOutput'
+        output_dir.mkdir(parents=True, exist_ok=True)
+        run_next_submit = self.engine.submit_cmd(self.next_iter_cmd, next_job_name, outdir=output_dir,
+                                                 run_code=runCode,
+                                                 hold=hold)
+        output = self.run_cmd(run_next_submit)
+        my_logger.info(f"Next iteration cmd is {run_next_submit} with output:{output}")
+        jid = self.engine.job_id(output)  # extract the actual job id.
+        my_logger.info(f"Job ID for next iteration is {jid}")
+        self.next_iter_jids.append(
+            jid)  # append jid to list of jobs. That way if have problems in previous jobs can get info back.
+        self.update_history(f"Submitted next job with ID {jid}")
+        return jid
+
     def guess_failed(self):
         """
         Set status of running models to failed using model.guess_failed()
@@ -4,6 +4,7 @@ import logging
 import typing
 
 from SubmitStudy import SubmitStudy
+from sim_cache import sim_cache
 import numpy as np
 import pandas as pd
 import optclim_exceptions
@@ -227,6 +228,8 @@ class runSubmit(SubmitStudy):
         """
         super().__init__(*args, **kwargs)
         self.provisional = None
+        self.cache_hits = dict()  # keys of simulations got from the simulation cache.
+        self.cache_stored = dict()  # keys of simulations this study has stored in the simulation cache.
         prov_info = self.config.provisional_info()
         max_provisional_cases = prov_info.get("max_provisional_cases", None)
         rng_seed = prov_info.get("rng_seed", 1234567)
@@ -246,10 +249,34 @@ class runSubmit(SubmitStudy):
             self.provisional_params = []
             self.provisional_obs = []
 
+    def simulation_cache(self) -> typing.Optional[sim_cache]:
+        """
+        Return the cross-study simulation cache set by run_info['simulation_cache'] (a directory) or None if not set.
+        Not stored as an attribute as attributes get written out when the study is dumped.
+        """
+        root = self.run_info.get('simulation_cache')
+        if root is None:
+            return None
+        return sim_cache(self.expand(str(root)))
+
+    def cache_key(self, cache: sim_cache, params: dict) -> str:
+        """
+        Generate key in the simulation cache for params.
+        :param cache: simulation cache
+        :param params: dictionary of parameters. reference and model_name are handled as in create_model.
+        :return: key
+        """
+        paramDir = dict(params)
+        reference = paramDir.pop('reference', self.refDir)
+        model_name = paramDir.pop('model_name', self.model_name)
+        return cache.key(model_name, reference, self.config.getv('postProcess'), paramDir)
+
     def sim_obs(self, params: dict, scale: bool = False) -> pd.Series:
         """
         Get simulated observations for observations we want. Will create a new model if needed.
         Handles preliminary cases.
+        If run_info['simulation_cache'] is set then processed models are stored in that cache (once, and never
+          for faked models) and simulations not in this study are looked up there before a model is created.
         :param params: dictionary of parameters.
         :param scale: Scale observtions by the scalings in the config data.
         :return:
@@ -259,6 +286,14 @@ class runSubmit(SubmitStudy):
         model = self.get_model(parameters=params)
         create_model = False  # True if we want to create a new model.
         key = self.key(params)
+        cache = self.simulation_cache()
+        cached_obs = None
+        if (cache is not None) and (model is None):  # see if some other study has already ran this simulation.
+            cache_key = self.cache_key(cache, params)
+            cached_obs = cache.get(cache_key)
+            if (cached_obs is not None) and (len(set(obs_names) - set(cached_obs.index)) > 0):
+                my_logger.info(f"Cached simulation {cache_key} missing some obs. Ignoring")
+                cached_obs = None
 
         if ( model is not None  ) and model.is_processed():  # Model exists and is processed
             my_logger.debug(f"Model {model} exists")
@@ -272,6 +307,15 @@ class runSubmit(SubmitStudy):
                 raise ValueError(
                     f"simulated_obs missing some obs {simulated_obs[simulated_obs.isnull]}"
                 )
+            cache_stored = getattr(self, 'cache_stored', None)
+            if cache_stored is None:  # studies from before cache_stored existed.
+                cache_stored = self.cache_stored = dict()
+            if (cache is not None) and (not model.fake) and (key not in cache_stored):
+                # store all the obs so other studies can use them. Fake obs never go in the shared cache.
+                cache_key = self.cache_key(cache, params)
+                cache.put(cache_key, model.simulated_obs,
+                          info=dict(model=model.name, config_path=model.config_path))
+                cache_stored[key] = cache_key
 
         elif (model is not None) and model.is_created():  # model exists and is created
             my_logger.warning(f"Asking for created model: {model}")
@@ -284,6 +328,16 @@ class runSubmit(SubmitStudy):
         elif model is not None:  # model exists but is neither processed or created
             raise ValueError(f"Model {model} in unexpected state")
 
+        elif cached_obs is not None:  # in the simulation cache so no need to create a model.
+            simulated_obs = cached_obs.reindex(index=obs_names)
+            cache_hits = getattr(self, 'cache_hits', None)
+            if cache_hits is None:  # studies from before the cache existed won't have cache_hits
+                cache_hits = self.cache_hits = dict()
+            if key not in cache_hits:  # record the first use.
+                cache_hits[key] = cache_key
+                self.update_history(f"Using cached simulation {cache_key} for {key}")
+            my_logger.debug(f"Using cached simulation {cache_key} for key: {key}")
+
         elif self.provisional is not None:  # provisional case
             create_model = self.provisional.create_models and (key in self.provisional.provisional_models)
             simulated_obs = self.provisional.prov_obs( key )  # try and register the key getting back random obs.
@@ -324,6 +378,7 @@ class runSubmit(SubmitStudy):
         scale: bool = False,
         residual: bool = False,
         sumSquare: bool = False,
+        ensembleMember: typing.Optional[np.ndarray] = None,
     ) -> np.ndarray | pd.DataFrame | pd.Series:
         """
         Standard Function used for running model . Returns values from cache if already got it.
@@ -357,6 +412,10 @@ class runSubmit(SubmitStudy):
 
         :param sumSquare (defaultFalse) -- if True return the sum of squares of the observations after any processing.
 
+        :param ensembleMember (default None) -- if provided an integer (or array with one value per simulation) giving
+             the single ensemble member to run for each simulation. No ensemble averaging is then done.
+             Used by Optimise.adaptiveJacobian to run different numbers of ensemble members for different parameters.
+
 
         Using stdFunction -- this  is a method as it needs to know various bits of information contained in ModelSubmit..
         To actually use it with optimisation function you need to call runSubmit.genOptFunction(**kwargs).
@@ -412,6 +471,8 @@ class runSubmit(SubmitStudy):
         nEns = (
             self.config.ensembleSize()
         )  # how many ensemble members do we want to run.
+        if ensembleMember is not None:
+            ensembleMember = np.broadcast_to(ensembleMember, (nsim,))
         # empty = pd.Series(np.repeat(np.nan, nObs), index=obsNames)
         for indx in range(0, nsim):  # iterate over the simulations.
             pDict = dict(
@@ -419,8 +480,12 @@ class runSubmit(SubmitStudy):
             )  # create dict with names and values.
             pDict.update(self.config.fixedParams())
             ensObs = []
-            for ensembleMember in range(0, nEns):
-                pDict.update(ensembleMember=ensembleMember)
+            if ensembleMember is None:
+                members = range(0, nEns)
+            else:
+                members = [int(ensembleMember[indx])]
+            for member in members:
+                pDict.update(ensembleMember=member)
                 obs = self.sim_obs(pDict, scale=scale)
                 if residual:  # difference from target obs
                     tgt = self.config.targets(scale=scale)
@@ -596,6 +661,62 @@ class runSubmit(SubmitStudy):
 
         return deltaParam
 
+    def warm_start(
+        self, scale: bool = True
+    ) -> typing.Tuple[pd.Series, typing.Optional[pd.DataFrame]]:
+        """
+        Starting parameters and (transformed) Jacobian from a previous study's final configuration.
+        The path to the final configuration is optimise['warm_start']. If not set then beginParam is returned.
+        Parameters from the optimum of the previous study are used for parameters it shares with this study.
+        The previous transformed Jacobian is converted back to (scaled) observations and then transformed with this
+          study's transform. This works if this study's observations are a subset of the previous study's.
+          Otherwise no Jacobian is returned. Parameters not in the previous study have nan Jacobians.
+        :param scale -- If True use scaled transform matrices (as used by the algorithms)
+        :return: start parameters (pd.Series) and Jacobian (pd.DataFrame; rows parameters,
+          columns transformed observations; wrt unscaled parameters) or None
+        """
+        import Optimise
+        import StudyConfig
+
+        configData = self.config
+        paramNames = configData.paramNames()
+        start = configData.beginParam(paramNames=paramNames)
+        path = configData.optimise().get("warm_start")
+        if path is None:
+            return start, None
+        prior = StudyConfig.readConfig(self.expand(path))
+        prior_params = prior.paramNames()
+        optimum = prior.optimumParams(paramNames=prior_params)
+        if optimum is None:
+            raise ValueError(f"No optimumParams in warm_start config {path}")
+        shared = [p for p in paramNames if p in prior_params]
+        start.loc[shared] = optimum.loc[shared].values
+        my_logger.info(f"Warm start from {path} for {' '.join(shared)}")
+
+        jac = prior.transJacobian()
+        if jac is None:
+            return start, None
+        jac.columns = [str(c) for c in jac.columns]
+        if set(jac.columns) == set(prior_params):  # DFOLS stores obs x params so transpose
+            jac = jac.T
+        jac = jac.loc[prior_params, :]
+        gn_params = prior.GNparams()
+        if gn_params is not None:  # Gauss-Newton jacobian is wrt scaled parameters.
+            jac = jac.mul(Optimise.param_scaling(gn_params.values[-1, :]), axis=0)
+        prior_tmat = prior.transMatrix(scale=scale)
+        obsNames = configData.obsNames()
+        missing_obs = set(obsNames) - set(prior_tmat.columns)
+        if len(missing_obs) > 0:
+            my_logger.warning(f"Observations {' '.join(missing_obs)} not in warm_start config. Not using jacobian")
+            return start, None
+        jac = jac.loc[:, [str(c) for c in prior_tmat.index]]  # order as prior transform.
+        # convert back to (scaled) observations and transform with this study's transform.
+        raw_jac = jac.values @ np.linalg.pinv(prior_tmat.values.T)
+        raw_jac = pd.DataFrame(raw_jac, index=jac.index, columns=prior_tmat.columns).loc[:, obsNames]
+        tMat = configData.transMatrix(scale=scale)
+        trans_jac = (raw_jac @ tMat.T).reindex(paramNames)  # parameters not in prior study are nan.
+        return start, trans_jac
+
     def runJacobian(self, scale: bool = False):
         """
         Run Jacobian cases.
@@ -607,6 +728,10 @@ class runSubmit(SubmitStudy):
         The Jacobian computed is the transformed Jacobian. (Apply Transpose matrix).
 
 
+        If optimise['adaptive_jacobian'] is True (or a dict) then Optimise.adaptiveJacobian is used. This runs extra
+          ensemble members only for parameters where the Jacobian is noisy compared to the internal variability
+          (CovIntVar). A dict is passed to adaptiveJacobian so can set snr and maxEnsemble.
+
         :arg self -- a Submit object.
         :param scale -- If True apply scalings.
         :returns a configuration. The following methods should work on it:
@@ -614,6 +739,9 @@ class runSubmit(SubmitStudy):
 
                 finalConfig.transJacobian() -- the  transformed Jacobian matrix at the optimum pt
                 finalConfig.hessian() -- the  hessian computed from J^T J at the optimum pt.
+                If adaptive_jacobian then also:
+                finalConfig.get_dataFrameInfo('Jacobian_var') -- estimated variance of the transformed Jacobian
+                finalConfig.get_dataFrameInfo('nEnsemble') -- ensemble members used for each parameter.
 
             runs runConfig to provide generic info. (See documentation for that)
 
@@ -621,6 +749,9 @@ class runSubmit(SubmitStudy):
 
         configData = self.config
         Tmat = configData.transMatrix(scale=scale)
+        adaptive = configData.optimise().get("adaptive_jacobian", False)
+        if adaptive:
+            return self.run_adaptive_jacobian(Tmat, scale=scale, options=adaptive)
         modelFn = self.genOptFunction(
             raiseError=True, df=True, residual=True, transform=Tmat, scale=scale
         )
@@ -678,6 +809,46 @@ class runSubmit(SubmitStudy):
         finalConfig.hessian(hes)
         return finalConfig
 
+    def run_adaptive_jacobian(self, Tmat: pd.DataFrame, scale: bool = False,
+                              options: typing.Union[bool, dict] = True):
+        """
+        Run Jacobian using Optimise.adaptiveJacobian. See runJacobian.
+        :param Tmat: transform matrix
+        :param scale: If True apply scalings.
+        :param options: True or dict of extra arguments (snr, maxEnsemble) for adaptiveJacobian.
+        :return: final configuration.
+        """
+        import Optimise
+
+        configData = self.config
+        kwargs = options.copy() if isinstance(options, dict) else dict()
+        base = configData.optimumParams()  # try with optimum parameters
+        if base is None:  # if none go with the begin parameters.
+            base = configData.beginParam()
+        paramNames = configData.paramNames()
+        base = base.loc[paramNames]
+        paramRanges = configData.paramRanges(paramNames=paramNames)
+        steps = configData.steps(paramNames=paramNames)
+        # internal variability in the same (transformed) space as the Jacobian
+        covIntVar = configData.Covariances(obsNames=Tmat.columns, scale=scale)["CovIntVar"]
+        covIntVar = Tmat @ covIntVar @ Tmat.T
+        modelFn = self.genOptFunction(raiseError=True, residual=True, transform=Tmat, scale=scale)
+
+        def jacobian():
+            return Optimise.adaptiveJacobian(modelFn, base, steps, paramRanges, covIntVar,
+                                             obsNames=Tmat.index, **kwargs)
+
+        result = self.run_function(jacobian)
+        jac = result.Jacobian.to_pandas()
+        finalConfig = self.runConfig()  # get the configuration
+        finalConfig.transJacobian(transJacobian=jac)  # store the jacobian.
+        finalConfig.hessian(jac.T @ jac)
+        finalConfig.set_dataFrameInfo(Jacobian_var=result.Jacobian_var.to_pandas(),
+                                      nEnsemble=result.nEnsemble.to_pandas(),
+                                      snr=result.snr.to_pandas())
+        my_logger.info(f"Adaptive Jacobian used {int(result.nEnsemble.sum())} perturbed simulations")
+        return finalConfig
+
     def runDFOLS(self, scale=True):
         """
         run DFOLS algorithm. It runs until new models need to be ran or DFOLS complets.
@@ -712,7 +883,8 @@ class runSubmit(SubmitStudy):
         configData = self.config
         varParamNames = configData.paramNames()
         dfols_config = configData.DFOLS_config()
-        start = configData.beginParam()
+        # DFOLS can not be given an initial interpolation set so just start from any warm_start optimum.
+        start, _ = self.warm_start(scale=scale)
         # Sensible defaults  for DFOLS -- which can be overwritten by config file
         userParams = {
             "logging.save_diagnostic_info": True,
@@ -808,6 +980,9 @@ class runSubmit(SubmitStudy):
             also can get generic info and cost info:
             as runs runCost & runConfig to provide  info. (See documentation of those methods for what they provide)
 
+            If optimise['warm_start'] is set then start from the optimum of that (final) configuration and use its
+              Jacobian on the first iteration. See warm_start.
+
             As the Gauss-Newton  component of this algorithm is a deterministic  perturbation to the minima over a small
                number of line-search values then provisional running  is not reliable. To make it work provisional running
                needs modification to run several times (more than twice) and only go if have "hits" = number of times ran.
@@ -834,7 +1009,9 @@ class runSubmit(SubmitStudy):
         nObs = tMat.shape[
             0
         ]  # might be a smaller because some evals in the covariance matrix are close to zero (or -ve)
-        start = configData.beginParam(paramNames=paramNames)
+        start, jacobian = self.warm_start(scale=scale)
+        if jacobian is not None:
+            jacobian = jacobian.values
         optFn = self.genOptFunction(
             transform=tMat, scale=scale, residual=True, raiseError=True
         )
@@ -854,6 +1031,7 @@ class runSubmit(SubmitStudy):
                 optimise,
                 cov=np.identity(nObs),
                 cov_iv=intCov,
+                jacobian=jacobian,
                 trace=verbose,
             )
             return result
@@ -889,6 +1067,128 @@ class runSubmit(SubmitStudy):
 
         return finalConfig
 
+    def runCMAES(self, verbose=False, scale=True):
+        """
+        Run CMA-ES (Covariance Matrix Adaptation Evolution Strategy) algorithm. See Optimise.cmaes.
+        Each generation (population) is ran as one set of models. The cost is the sum of squares of the
+         transformed residuals -- the same as DFOLS minimises.
+        Configuration is from configData.CMAES_config(). See Optimise.cmaes for the values used.
+        If popsize is not set then the population fills maxRuns (allowing for ensemble members) if that is set.
+
+        param: verbose if True produce more verbose output.
+        param: scale if True apply scaling (default is True)
+        return: finalConfig -- a studyConfig. The following methods should give you useful data:
+                finalConfig.optimumParams() -- optimum parameters.
+                finalConfig.getv('CMAES_info') -- dict with status, and for each generation the best parameters and
+                   cost, the step size and the mean parameters.
+            also can get generic info and cost info:
+            as runs runCost & runConfig to provide  info. (See documentation of those methods for what they provide)
+        """
+        import Optimise
+
+        configData = self.config
+        cmaes_config = configData.CMAES_config().copy()
+        maxRuns = configData.maxRuns()
+        if ("popsize" not in cmaes_config) and (maxRuns is not None):
+            # fill maxRuns with each generation.
+            cmaes_config["popsize"] = max(2, maxRuns // configData.ensembleSize())
+        paramNames = configData.paramNames()
+        start = configData.beginParam(paramNames=paramNames)
+        prange = configData.paramRanges(paramNames=paramNames).loc[["minParam", "maxParam"], :].values.T
+        tMat = configData.transMatrix(scale=scale)
+        optFn = self.genOptFunction(
+            transform=tMat, scale=scale, residual=True, raiseError=True, sumSquare=True
+        )
+
+        def run_cmaes():
+            """
+            Function to deterministically run CMA-ES. Seed is set within Optimise.cmaes
+            """
+            result = Optimise.cmaes(optFn, start.values, prange, cmaes_config, trace=verbose)
+            return result
+
+        best, status, info = self.run_function(run_cmaes)
+        filename = self.rootDir / (
+            self.config.fileName().stem + "_final.json"
+        )  # final config
+        finalConfig = self.runConfig(
+            scale=scale, add_cost=True, filename=filename
+        )  # get final runInfo
+        finalConfig.setv(
+            "CMAES_info",
+            dict(
+                status=status,
+                bestParams=info["bestParams"].tolist(),
+                best_cost=info["best_cost"].tolist(),
+                sigma=info["sigma"].tolist(),
+                mean=info["mean"].tolist(),
+            ),
+        )
+        best = pd.Series(best, index=paramNames, name=finalConfig.name())
+        finalConfig.optimumParams(optimum=best)  # write the optimum params
+        my_logger.info(f"CMAES completed with status {status}")
+        return finalConfig
+
+    def runBayesOpt(self, verbose=False, scale=True):
+        """
+        Run batch Bayesian optimisation. See Optimise.bayesOpt.
+        A Gaussian Process is fitted to the costs of all parameters evaluated so far and q new parameter sets
+        chosen (by Kriging believer or q-expected improvement) and ran together. The cost is the sum of squares of the
+         transformed residuals -- the same as DFOLS minimises.
+        Configuration is from the bayesopt dict in optimise. See StudyConfig.BayesOpt_config.
+        The GP is fitted only to the simulations requested by the algorithm, rather than to everything in the study,
+        so that replaying the algorithm (see run_function) is deterministic.
+
+        param: verbose if True produce more verbose output.
+        param: scale if True apply scaling (default is True)
+        return: finalConfig -- a studyConfig. The following methods should give you useful data:
+                finalConfig.optimumParams() -- optimum parameters.
+                finalConfig.getv('BayesOpt_info') -- dict with status, the GP hyper-parameters
+                   and for each iteration the best parameters, best cost and maximum expected improvement.
+            also can get generic info and cost info:
+            as runs runCost & runConfig to provide  info. (See documentation of those methods for what they provide)
+        """
+        import Optimise
+
+        configData = self.config
+        bayes_config = configData.BayesOpt_config()
+        paramNames = configData.paramNames()
+        start = configData.beginParam(paramNames=paramNames)
+        prange = configData.paramRanges(paramNames=paramNames).loc[["minParam", "maxParam"], :].values.T
+        tMat = configData.transMatrix(scale=scale)
+        optFn = self.genOptFunction(
+            transform=tMat, scale=scale, residual=True, raiseError=True, sumSquare=True
+        )
+
+        def run_bayes_opt():
+            """
+            Function to deterministically run Bayesian optimisation. Seed is set within Optimise.bayesOpt
+            """
+            result = Optimise.bayesOpt(optFn, start.values, prange, bayes_config, trace=verbose)
+            return result
+
+        best, status, info = self.run_function(run_bayes_opt)
+        filename = self.rootDir / (
+            self.config.fileName().stem + "_final.json"
+        )  # final config
+        finalConfig = self.runConfig(
+            scale=scale, add_cost=True, filename=filename
+        )  # get final runInfo
+        finalConfig.setv(
+            "BayesOpt_info",
+            dict(
+                status=status,
+                bestParams=info["bestParams"].tolist(),
+                best_cost=info["best_cost"].tolist(),
+                max_ei=info["max_ei"].tolist(),
+                hyper=info["hyper"].tolist(),
+            ),
+        )
+        best = pd.Series(best, index=paramNames, name=finalConfig.name())
+        finalConfig.optimumParams(optimum=best)  # write the optimum params
+        my_logger.info(f"BayesOpt completed with status {status}")
+        return finalConfig
+
     def runPYSOT(self, scale=True):
 
         """
@@ -0,0 +1,47 @@
+#!/bin/env python
+#  script to post-process many SUCCEEDED models in one job using a pool of processes.
+#  Post-processing scripts with a post_process function (e.g. comp_sim_obs.py) are called directly
+#  so shared inputs (e.g. land mask) are only read once per process.
+import argparse
+import logging
+import sys
+from Model import Model
+
+parser = argparse.ArgumentParser(description="""
+    Post-process SUCCEEDED models setting them to PROCESSED. 
+    Exit status is 1 if any model did not get PROCESSED.
+    Example usage: batch_post_process.py -p 4 pth_to_study.scfg 
+      or: batch_post_process.py pth_to_config1 pth_to_config2
+    """)
+parser.add_argument("configs", type=str, nargs='+',
+                    help='paths for model configs or study configs (.scfg). For studies all SUCCEEDED models are processed')
+parser.add_argument("-p", "--parallel", type=int, default=1, help="Number of processes to use")
+parser.add_argument("-v", "--verbose", action="count", default=0,
+                    help="Be more verbose. Level one gives logging.INFO and level 2 gives logging.DEBUG")
+args = parser.parse_args()
+# deal with verbosity
+if args.verbose == 1:
+    logging.basicConfig(level=logging.INFO, force=True)
+elif args.verbose == 2:
+    logging.basicConfig(level=logging.DEBUG, force=True)
+else:
+    pass
+
+for k, v in vars(args).items():
+    logging.debug(f"arg.{k}={v}")
+
+config_paths = []
+for config in args.configs:
+    path = Model.expand(config)
+    if path.suffix == '.scfg':  # a study so get its succeeded models.
+        from SubmitStudy import SubmitStudy
+        study = SubmitStudy.load_SubmitStudy(path)
+        config_paths += [model.config_path for model in study.model_index.values() if model.status == 'SUCCEEDED']
+    else:
+        config_paths.append(path)
+
+result = Model.batch_process(config_paths, max_workers=args.parallel)
+not_processed = [str(path) for path in config_paths if result.get(path) != 'PROCESSED']
+if len(not_processed) > 0:
+    logging.warning("Models not processed: " + " ".join(not_processed))
+    sys.exit(1)
@@ -0,0 +1,43 @@
+#!/bin/env python
+#  script to post-process many models in one job. Models are processed as they become SUCCEEDED.
+#  FAILED models are waited on (until max_wait) as they might be continued.
+#  Submitted (held) by SubmitStudy when run_info['aggregate_post_process'] is True
+#  and released by the first model to succeed.
+import argparse
+import logging
+import sys
+from Model import Model
+
+parser = argparse.ArgumentParser(description="""
+    Post-process models as they become SUCCEEDED. Exits once all models are PROCESSED or after max_wait seconds.
+    FAILED models are waited on as they might be continued.
+    Exit status is 1 if any model did not get PROCESSED.
+    Example usage: process_models.py -p 4 pth_to_config1 pth_to_config2
+    """)
+parser.add_argument("configs", type=str, nargs='+', help='paths for model configs')
+parser.add_argument("-p", "--parallel", type=int, default=1, help="Maximum number of models to process at once")
+parser.add_argument("--poll", type=float, default=60.,
+                    help="Time in seconds between checks on model status")
+parser.add_argument("--max_wait", type=float, default=None,
+                    help="Maximum time in seconds to wait for models to succeed")
+parser.add_argument("-v", "--verbose", action="count", default=0,
+                    help="Be more verbose. Level one gives logging.INFO and level 2 gives logging.DEBUG")
+args = parser.parse_args()
+# deal with verbosity
+if args.verbose == 1:
+    logging.basicConfig(level=logging.INFO, force=True)
+elif args.verbose == 2:
+    logging.basicConfig(level=logging.DEBUG, force=True)
+else:
+    pass
+
+for k, v in vars(args).items():
+    logging.debug(f"arg.{k}={v}")
+
+config_paths = [Model.expand(config) for config in args.configs]
+result = Model.process_models(config_paths, max_workers=args.parallel, poll_interval=args.poll,
+                              max_wait=args.max_wait)
+not_processed = [str(path) for path in config_paths if result.get(path) != 'PROCESSED']
+if len(not_processed) > 0:
+    logging.warning("Models not processed: " + " ".join(not_processed))
+    sys.exit(1)
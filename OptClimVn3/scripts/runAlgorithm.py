@@ -237,6 +237,10 @@ while True:  # loop indefinetly so can have fake_fn. This really to test code/al
             finalConfig = rSUBMIT.runPYSOT(scale=True)
         elif algorithmName == 'GAUSSNEWTON':
             finalConfig = rSUBMIT.runGaussNewton(scale=True)
+        elif algorithmName == 'CMAES':
+            finalConfig = rSUBMIT.runCMAES(scale=True)
+        elif algorithmName == 'BAYESOPT':
+            finalConfig = rSUBMIT.runBayesOpt(scale=True)
         elif algorithmName == 'JACOBIAN':
             # compute the Jacobian.
             finalConfig = rSUBMIT.runJacobian()
@@ -15,9 +15,13 @@ allowed_keys = set(Model.status_info.keys()) - {'SUBMITTED'}
 parser = argparse.ArgumentParser(description="""
     Set model status to something. This can have side effects depending on the status. 
     Example usage: set_model_status pth_to_config COMPLETED
+    or to run incremental post-processing: set_model_status --incremental pth_to_config
     """)
 parser.add_argument("config",type=str,help='path for model config')
-parser.add_argument("status", type=str, help="What to set model status to", choices=allowed_keys)
+parser.add_argument("status", type=str, nargs='?', default=None, help="What to set model status to",
+                    choices=allowed_keys)
+parser.add_argument("--incremental", action="store_true",
+                    help="Run incremental post-processing (see Model.incremental_process) after setting any status")
 parser.add_argument("-v", "--verbose", action="count", default=0,
                     help="Be more verbose. Level one gives logging.INFO and level 2 gives logging.DEBUG")
 args = parser.parse_args()
@@ -55,6 +59,12 @@ elif status == 'SUCCEEDED':
     model.succeeded()
 elif status == 'PROCESSED':
     model.process()
+elif status is None:
+    if not args.incremental:
+        raise ValueError("Need status or --incremental")
 else:
     raise ValueError(f"Status {args.status} unknown")
 
+if args.incremental:  # update post-processing while model is running.
+    model.incremental_process()
+
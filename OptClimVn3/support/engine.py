@@ -9,6 +9,8 @@ from __future__ import annotations
 import logging
 import os
 import subprocess
+import threading
+import time as time_mod
 import typing
 import pathlib
 from abc import ABCMeta, abstractmethod
@@ -16,6 +18,41 @@ from model_base import model_base, journal  # so can save things. The default to
 
 my_logger = logging.getLogger(f"OPTCLIM.{__name__}")
 
+class rate_limiter:
+    """
+    Thread-safe limiter on the rate at which commands are sent to the job control system.
+    Used so that parallel submission does not hammer the scheduler.
+    """
+
+    def __init__(self, rate: typing.Optional[float] = None):
+        """
+        Initialise a rate_limiter
+        :param rate: Maximum number of calls per second. If None (or <= 0) no limit is applied.
+        """
+        if (rate is not None) and (rate > 0):
+            self.interval = 1.0 / rate
+        else:
+            self.interval = 0.0
+        self._lock = threading.Lock()
+        self._next_time = time_mod.monotonic()
+
+    def wait(self) -> float:
+        """
+        Block until the next call is allowed. Slots are handed out in the order wait is called.
+        :return: time (in seconds) slept.
+        """
+        if self.interval <= 0:
+            return 0.0
+        with self._lock:
+            now = time_mod.monotonic()
+            delay = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if delay > 0:
+            time_mod.sleep(delay)
+            return delay
+        return 0.0
+
+
 class abstractEngine(model_base, journal):
     """
     Abstract class for Engines. Inherit and implement for your own class.
@@ -277,6 +277,82 @@ def copyTestDir(inDir, outDir, setDir='', trace=False):
 
 # done with copyTestDir
 
+FICLONE = 0x40049409  # linux ioctl request to clone (reflink) a file.
+
+
+def reflink(src: pathlib.Path, dst: pathlib.Path) -> bool:
+    """
+    Make dst a copy-on-write clone (reflink) of src. Only works on linux filesystems that support it (btrfs, xfs ...)
+    :param src: source file
+    :param dst: destination file. Should not exist.
+    :return: True if reflink worked, False if not (in which case dst will not exist)
+    """
+    try:
+        import fcntl
+    except ImportError:  # not on a unix system.
+        return False
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'xb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        pathlib.Path(dst).unlink(missing_ok=True)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def link_tree(src: pathlib.Path, dst: pathlib.Path,
+              copy_files: typing.Iterable[pathlib.Path] = (),
+              min_size: int = 2 ** 20) -> dict:
+    """
+    Replicate directory src in dst without copying large files. Directories are created and
+    files are, in order of preference, reflinked, hard linked or symbolic linked.
+    Small files (which are the ones likely to be modified) and files in copy_files are copied.
+    Symbolic links in src are copied as symbolic links.
+    Anything that modifies a hard or symbolic linked file in place will modify src.
+      Replacing a file (as fileinput with inplace=True and namelist_var.nl_modify do) is fine.
+    :param src: source directory
+    :param dst: destination directory. Will be created if needed.
+    :param copy_files: paths, relative to src, that are always copied.
+    :param min_size: files smaller than this (in bytes) are copied.
+    :return: dict with count of files for each method (copy, reflink, hardlink, symlink)
+    """
+    copy_files = {pathlib.Path(f) for f in copy_files}
+    counts = dict(copy=0, reflink=0, hardlink=0, symlink=0)
+    src = pathlib.Path(src)
+    dst = pathlib.Path(dst)
+    dst.mkdir(parents=True, exist_ok=True)
+    for root, dirs, files in os.walk(src):
+        root = pathlib.Path(root)
+        rel_root = root.relative_to(src)
+        for name in dirs:
+            src_path = root / name
+            if src_path.is_symlink():  # os.walk does not go into symlinked directories.
+                (dst / rel_root / name).symlink_to(os.readlink(src_path))
+                counts['symlink'] += 1
+            else:
+                (dst / rel_root / name).mkdir(exist_ok=True)
+        for name in files:
+            src_path = root / name
+            dst_path = dst / rel_root / name
+            if src_path.is_symlink():
+                dst_path.symlink_to(os.readlink(src_path))
+                counts['symlink'] += 1
+            elif ((rel_root / name) in copy_files) or (src_path.stat().st_size < min_size):
+                shutil.copy2(src_path, dst_path)
+                counts['copy'] += 1
+            elif reflink(src_path, dst_path):
+                counts['reflink'] += 1
+            else:
+                try:
+                    os.link(src_path, dst_path)
+                    counts['hardlink'] += 1
+                except OSError:  # different filesystem or no hard links allowed.
+                    dst_path.symlink_to(src_path.absolute())
+                    counts['symlink'] += 1
+    my_logger.debug(f"Linked {src} to {dst} with {counts}")
+    return counts
+
 def genSeed(param: pd.Series) -> int:
     """
     Initialise RNG based on parameter as pandas series. So is deterministic.
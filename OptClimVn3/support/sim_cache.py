@@ -0,0 +1,132 @@
+"""
+Content addressed cache of simulated observations shared by all studies on a filesystem.
+Entries are keyed on model type, a fingerprint of the reference directory, the post-processing configuration
+ and all parameters (including fixed parameters and ensemble member). So different studies that ask for the
+ same simulation can re-use it rather than running it again.
+Each entry is a small json file in root/<first two chars of key>/<key>.json which is written atomically so
+ several processes can share the cache.
+"""
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import typing
+
+import pandas as pd
+
+my_logger = logging.getLogger(f"OPTCLIM.{__name__}")
+
+
+@functools.lru_cache(maxsize=32)
+def _fingerprint(directory: str) -> str:
+    """
+    Fingerprint of a directory from the relative path, size and modification time of all files in it.
+    Cached as the reference directory does not change while a study runs.
+    :param directory: path to directory (as a string so can be cached)
+    :return: sha256 hex digest.
+    """
+    sha = hashlib.sha256()
+    path = pathlib.Path(directory)
+    if not path.exists():  # no directory so just use the name.
+        sha.update(directory.encode())
+        return sha.hexdigest()
+    for file in sorted(p for p in path.rglob('*') if p.is_file()):
+        stat = file.stat()
+        sha.update(f"{file.relative_to(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return sha.hexdigest()
+
+
+class sim_cache:
+    """
+    Cache of simulated observations. Attributes are:
+        root -- root directory of the cache.
+        fpFmt -- format used to convert floating point parameters when generating keys.
+    """
+
+    def __init__(self, root: pathlib.Path, fpFmt: str = '%.4g'):
+        """
+        Create cache
+        :param root: root directory of the cache. Created if it does not exist.
+        :param fpFmt: format used to convert floating point parameters when generating keys.
+          Default is the same as Study.key so the cache matches the same simulations a study would.
+        """
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.fpFmt = fpFmt
+
+    @staticmethod
+    def fingerprint(directory: pathlib.Path) -> str:
+        """
+        Fingerprint of a (reference) directory. Changes if any file in it is added, removed or modified.
+        :param directory: directory to fingerprint
+        :return: sha256 hex digest.
+        """
+        return _fingerprint(str(pathlib.Path(directory).expanduser().absolute()))
+
+    def key(self,
+            model_name: str,
+            reference: pathlib.Path,
+            post_process: typing.Optional[dict],
+            parameters: typing.Mapping) -> str:
+        """
+        Generate key for a simulation
+        :param model_name: name of model type
+        :param reference: reference directory for the model
+        :param post_process: post processing configuration
+        :param parameters: all parameters (variable, fixed and ensembleMember)
+        :return: key (sha256 hex digest)
+        """
+        params = {k: (self.fpFmt % v) if isinstance(v, float) else repr(v) for k, v in parameters.items()}
+        content = dict(model_name=model_name, reference=self.fingerprint(reference),
+                       post_process=post_process, parameters=params)
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    def path(self, key: str) -> pathlib.Path:
+        """
+        :param key: key for entry
+        :return: path to file for entry.
+        """
+        return self.root / key[0:2] / (key + '.json')
+
+    def get(self, key: str) -> typing.Optional[pd.Series]:
+        """
+        Get simulated observations from the cache.
+        :param key: key for entry
+        :return: simulated observations or None if not in cache.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'r') as fp:
+                entry = json.load(fp)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:  # should not happen as written atomically.
+            my_logger.warning(f"Failed to decode {path}. Ignoring")
+            return None
+        return pd.Series(entry['simulated_obs'], dtype=float)
+
+    def put(self, key: str, simulated_obs: pd.Series, info: typing.Optional[dict] = None) -> bool:
+        """
+        Store simulated observations in the cache if not already there.
+        :param key: key for entry
+        :param simulated_obs: simulated observations
+        :param info: other information (e.g. where the model is) to store with the entry.
+        :return: True if stored; False if already in cache.
+        """
+        path = self.path(key)
+        if path.exists():
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = dict(simulated_obs=simulated_obs.astype(float).to_dict(), info=info)
+        # write to temp file and then rename so readers never see a partial file.
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(entry, fp, default=str)
+        os.replace(tmp_name, path)
+        my_logger.debug(f"Stored {key} in {self.root}")
+        return True
@@ -2,6 +2,7 @@
 import logging
 import platform
 import unittest
+import unittest.mock
 import engine
 import pathlib
 import subprocess
@@ -30,6 +31,18 @@ class TestEngine(unittest.TestCase):
             self.assertIsInstance(eng.job_id('Submitted job 123456'), str)
             self.assertIsInstance(eng.my_job_id(),str)
 
+    def test_rate_limiter(self):
+        # test rate_limiter spaces out calls and does nothing when no rate is given.
+        limiter = engine.rate_limiter(None)
+        self.assertEqual(sum(limiter.wait() for i in range(10)), 0.0)
+        limiter = engine.rate_limiter(20.)
+        with unittest.mock.patch("time.sleep", autospec=True) as mck_sleep:
+            for i in range(4):
+                limiter.wait()
+        self.assertEqual(mck_sleep.call_count, 3)  # first call goes straight away.
+        for call in mck_sleep.call_args_list:
+            self.assertLessEqual(call.args[0], 0.15 + 1e-6)
+
     def test_my_job_id(self):
         # test my_job_id
         vars = ['JOB_ID','SLURM_JOB_ID']
@@ -1,3 +1,7 @@
+import filecmp
+import os
+import pathlib
+import tempfile
 import unittest
 import genericLib
 
@@ -26,6 +30,26 @@ class genericLib_test(unittest.TestCase):
                 got = genericLib.parse_isoduration(fail_case)
             #
 
+    def test_link_tree(self):
+        # test link_tree copies small files and links large ones.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            src = pathlib.Path(tmpdir) / 'src'
+            (src / 'sub').mkdir(parents=True)
+            (src / 'small').write_text('small')
+            (src / 'big').write_bytes(b'x' * 100)
+            (src / 'sub' / 'big2').write_bytes(b'y' * 100)
+            (src / 'copy_me').write_bytes(b'z' * 100)
+            (src / 'link').symlink_to('small')
+            dst = pathlib.Path(tmpdir) / 'dst'
+            counts = genericLib.link_tree(src, dst, copy_files=[pathlib.Path('copy_me')], min_size=50)
+            self.assertEqual(counts['copy'], 2)
+            self.assertEqual(counts['reflink'] + counts['hardlink'] + counts['symlink'], 3)
+            for name in ['small', 'big', 'sub/big2', 'copy_me', 'link']:
+                self.assertTrue(filecmp.cmp(src / name, dst / name, shallow=False))
+            self.assertTrue((dst / 'link').is_symlink())
+            self.assertFalse(os.path.samefile(src / 'copy_me', dst / 'copy_me'))
+            self.assertFalse(os.path.samefile(src / 'small', dst / 'small'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,70 @@
+import pathlib
+import tempfile
+import unittest
+
+import pandas as pd
+import pandas.testing as pdtest
+
+import sim_cache as sim_cache_module
+from sim_cache import sim_cache
+
+
+class sim_cache_test(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpDir.name)
+        self.cache = sim_cache(self.root / 'cache')
+        self.refDir = self.root / 'reference'
+        self.refDir.mkdir()
+        (self.refDir / 'namelist').write_text('&nam x=1 /')
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_key(self):
+        """
+        Test key is the same for the same simulation and changes if anything that defines the simulation changes.
+        """
+        params = dict(VF1=1.0, ENTCOEF=3.0, ensembleMember=0)
+        key = self.cache.key('HadCM3', self.refDir, dict(script='pp.py'), params)
+        # same (to rounding) params in different order give the same key
+        self.assertEqual(key, self.cache.key('HadCM3', self.refDir, dict(script='pp.py'),
+                                             dict(ensembleMember=0, ENTCOEF=3.00001, VF1=1.0)))
+        different = [('HadAM3', self.refDir, dict(script='pp.py'), params),
+                     ('HadCM3', self.root, dict(script='pp.py'), params),
+                     ('HadCM3', self.refDir, dict(script='pp2.py'), params),
+                     ('HadCM3', self.refDir, dict(script='pp.py'), dict(params, ensembleMember=1)),
+                     ('HadCM3', self.refDir, dict(script='pp.py'), dict(params, VF1=1.1))]
+        for args in different:
+            with self.subTest(args=args):
+                self.assertNotEqual(key, self.cache.key(*args))
+
+    def test_fingerprint(self):
+        """
+        Test fingerprint changes when files in the reference directory change.
+        """
+        fp = self.cache.fingerprint(self.refDir)
+        self.assertEqual(fp, self.cache.fingerprint(self.refDir))
+        (self.refDir / 'extra').write_text('more')
+        sim_cache_module._fingerprint.cache_clear()  # fingerprints are cached.
+        self.assertNotEqual(fp, self.cache.fingerprint(self.refDir))
+
+    def test_get_put(self):
+        """
+        Test put and get.
+        """
+        key = self.cache.key('HadCM3', self.refDir, None, dict(VF1=1.0))
+        self.assertIsNone(self.cache.get(key))
+        obs = pd.Series([1.0, 2.5], index=['olr', 'rsr'])
+        self.assertTrue(self.cache.put(key, obs, info=dict(model='tst001')))
+        self.assertTrue(self.cache.path(key).exists())
+        pdtest.assert_series_equal(self.cache.get(key), obs)
+        # already there so not stored again.
+        self.assertFalse(self.cache.put(key, obs * 2))
+        pdtest.assert_series_equal(self.cache.get(key), obs)
+        # another cache object with the same root sees the entry.
+        pdtest.assert_series_equal(sim_cache(self.root / 'cache').get(key), obs)
+
+
+if __name__ == '__main__':
+    unittest.main()
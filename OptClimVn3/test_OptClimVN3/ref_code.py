@@ -120,6 +120,29 @@ def regularize_cov_ref(covariance, cond_number, initial_scale=1e-4, trace=False)
 
 ### end of regularize_cov
 
+
+def regularize_hessian_ref(hessian, reg_crit_cond, reg_pow_range, trace=False):
+    """ Regularize hessian matrix. Loop over powers of 10 version from Optimise. """
+    fn_label = 'regHes'
+    perJ = hessian.copy()  # make sure we copy values.
+    con = np.linalg.cond(hessian)
+    eye = np.identity(hessian.shape[0])
+    for k in range(*reg_pow_range):  # *(list) breaks up list when argument
+        if con < reg_crit_cond:
+            break  # exit the loop if our condition number small enough
+
+        perJ = hessian + eye * 10 ** k  # add scaled Identity matrix to diagonal.
+        con = np.linalg.cond(perJ)  # compute condition number
+        if trace:
+            print(fn_label + ": con %e k %d" % (con, k))
+    # end loop over powers of 10.
+    if (con >= reg_crit_cond):  # failed to regularize matrix
+        print("regularisation insufficient, stopping: con %e k %d" % (con, k))
+        return None, con
+    else:  # managed to regularize hessian
+        return perJ, con
+
+
 def calcErr_ref(s_UM_valueT, s_obs, covT, use_constraint, coef1, coef2, nsize, nloop, ioffset):
     """"
     calculate error for simulated observed values given targets
@@ -4,8 +4,10 @@ import numpy as np
 import numpy.testing as nptest
 
 from Optimise import doGaussNewton, calcErr, doLineSearch,  randSelect, gaussNewton, runJacobian, \
-    GNjacobian
-from ref_code import doGaussNewton_ref, doLineSearch_ref  ## import reference code.
+    GNjacobian, regularize_hessian, regularize_cov, cost_evaluator, adaptiveJacobian, \
+    cmaes, bounded_transform, bounded_inverse, bayesOpt, gp_fit, gp_predict
+from ref_code import doGaussNewton_ref, doLineSearch_ref, regularize_hessian_ref, \
+    regularize_cov_ref  ## import reference code.
 
 __author__ = 'stett2'
 
@@ -33,6 +35,7 @@ def optfunction(params, *extraArgs, randomScale=1e-9, **kwargs):
         # probably should be done by each param vector separately.
         # so then result would be deterministic.
         perturb = np.zeros(result.shape)
+        members = np.broadcast_to(kwargs.get('ensembleMember'), (params.shape[0],))  # one per row allowed.
         maxSeed = 2 ** (32 - 8) - 1  # allow up to 256 ensembleMembers -- might work beyond this...
         for x in range(0, params.shape[0]):  # iterate over params.
             seed = 0
@@ -40,7 +43,7 @@ def optfunction(params, *extraArgs, randomScale=1e-9, **kwargs):
             seed += int(np.sum(params[x, :]).view(np.uint64))
             while (seed > maxSeed):
                 seed = seed // 2
-            seed = seed * 256 + kwargs.get('ensembleMember')  # add in the ensemble member,..
+            seed = seed * 256 + int(members[x])  # add in the ensemble member,..
             rng = random.RandomState(seed)  # get a RNG class Seed is comb of parameters and ens member.
             perturb[x, :] = rng.normal(0.0, randomScale, result.shape[1])  # random small perturbations.
 
@@ -74,6 +77,120 @@ class TestcalcErr(unittest.TestCase):
         expect = np.sqrt(np.mean(delta ** 2, axis=1))
         nptest.assert_allclose(expect, err)
 
+    def test_cov(self):
+        """ Test get same result as explicitly inverting the covariance."""
+        rng = np.random.default_rng(12345)
+        npt = 20
+        a = rng.normal(size=(npt, npt))
+        cov = a.dot(a.T) + np.identity(npt)
+        obs = rng.uniform(size=npt)
+        sim = obs + rng.normal(size=(5, npt))
+        inv_cov = np.linalg.inv(cov)
+        expect = np.sqrt(np.array([d.dot(inv_cov).dot(d) for d in (sim - obs)]) / npt)
+        nptest.assert_allclose(calcErr(sim, obs, cov), expect, rtol=1e-10)
+        nptest.assert_allclose(calcErr(sim[0], obs, cov), expect[0:1], rtol=1e-10)  # one simulation
+
+    def test_cost_evaluator(self):
+        """ Test cost_evaluator caching, inverse covariance and regularisation."""
+        rng = np.random.default_rng(54321)
+        npt = 10
+        a = rng.normal(size=(npt, npt))
+        cov = a.dot(a.T) + np.identity(npt)
+        evaluator = cost_evaluator.from_cov(cov)
+        self.assertIs(cost_evaluator.from_cov(cov.copy()), evaluator)  # same values so same evaluator
+        cov2 = cov.copy()
+        cov2[0, 0] += 1
+        self.assertIsNot(cost_evaluator.from_cov(cov2), evaluator)
+        nptest.assert_allclose(evaluator.inv_cov, np.linalg.inv(cov), rtol=1e-8, atol=1e-12)
+        with self.assertRaises(ValueError):
+            evaluator.inv_cov[0, 0] = 2.0  # shared so read only.
+        # singular covariance gets regularised.
+        vect = rng.normal(size=npt)
+        with self.assertLogs('OPTCLIM.Optimise', level='WARNING'):
+            evaluator = cost_evaluator(np.outer(vect, vect) + np.diag(np.append(np.ones(npt - 2), [0., 0.])))
+        self.assertTrue(np.all(np.isfinite(evaluator.cost(rng.normal(size=(3, npt)), np.zeros(npt)))))
+
+
+
+def ill_conditioned(npt, log_cond, rng):
+    """
+    Generate a symmetric positive (semi-)definite matrix with specified condition number
+    :param npt: size of matrix
+    :param log_cond: log10 of the condition number. If None matrix will be singular.
+    :param rng: random number generator
+    :return: matrix
+    """
+    q, r = np.linalg.qr(rng.normal(size=(npt, npt)))  # random orthogonal matrix
+    if log_cond is None:
+        evals = np.append(rng.uniform(0.1, 1, npt - 1), 0.0)
+    else:
+        evals = np.logspace(0, -log_cond, npt)
+    return (q * evals).dot(q.T)
+
+
+class TestRegularize(unittest.TestCase):
+    """
+    Regression tests for regularize_hessian and regularize_cov against the (loop over candidate values)
+     reference implementations.
+    """
+
+    def test_regularize_hessian(self):
+        rng = np.random.default_rng(123456)
+        reg_pow_range = (-7, -2)
+        for npt in [2, 5, 14]:
+            for log_cond in [None, 1, 4.5, 9, 10.5, 11.5, 13, 15]:
+                hessian = ill_conditioned(npt, log_cond, rng) * 10 ** rng.uniform(-2, 0)
+                for crit in [10e4, 10e10]:
+                    with self.subTest(npt=npt, log_cond=log_cond, crit=crit):
+                        ref_hessian, ref_con = regularize_hessian_ref(hessian, crit, reg_pow_range)
+                        reg_hessian, con, ridge = regularize_hessian(hessian, crit, reg_pow_range)
+                        if ref_hessian is None:
+                            self.assertIsNone(reg_hessian)
+                            self.assertIsNone(ridge)
+                            continue
+                        nptest.assert_allclose(reg_hessian, ref_hessian, rtol=1e-12, atol=1e-15)
+                        nptest.assert_allclose(con, ref_con, rtol=1e-6)
+                        # ridge is what was added to the diagonal.
+                        nptest.assert_allclose(reg_hessian - hessian, ridge * np.identity(npt),
+                                               rtol=1e-9, atol=1e-15)
+                        self.assertLess(con, crit)
+
+    def test_regularize_hessian_ridge(self):
+        # test values of ridge.
+        rng = np.random.default_rng(654321)
+        hessian = ill_conditioned(5, 3, rng)
+        reg_hessian, con, ridge = regularize_hessian(hessian, 10e10, (-7, -2))
+        self.assertEqual(ridge, 0.0)  # well conditioned so nothing done.
+        nptest.assert_equal(reg_hessian, hessian)
+        self.assertIsNot(reg_hessian, hessian)  # should be a copy
+        hessian = ill_conditioned(5, 20, rng)
+        reg_hessian, con, ridge = regularize_hessian(hessian, 2e5, (-7, -2))
+        self.assertEqual(ridge, 1e-5)  # eigenvalues 1 to ~0 so 1e-5 is first ridge giving cond < 2e5
+        reg_hessian, con, ridge = regularize_hessian(hessian, 10, (-7, -2))  # can not regularize
+        self.assertIsNone(reg_hessian)
+        self.assertIsNone(ridge)
+        self.assertGreaterEqual(con, 10)
+
+    def test_regularize_cov(self):
+        rng = np.random.default_rng(98765)
+        for npt in [3, 10, 30]:
+            for log_cond in [1, 4, 8, 12]:
+                scale = 10 ** rng.uniform(-1, 1, npt)  # different diagonal values
+                cov = ill_conditioned(npt, log_cond, rng) + np.diag(rng.uniform(0, 1e-3, npt))
+                cov = cov * np.outer(scale, scale)
+                for cond_number in [10, 100, 1e4]:
+                    with self.subTest(npt=npt, log_cond=log_cond, cond_number=cond_number):
+                        ref_cov = regularize_cov_ref(cov, cond_number)
+                        reg_cov = regularize_cov(cov, cond_number)
+                        nptest.assert_allclose(reg_cov, ref_cov, rtol=1e-12)
+        # None for cond_number gives a copy
+        reg_cov = regularize_cov(cov, None)
+        nptest.assert_equal(reg_cov, cov)
+        self.assertIsNot(reg_cov, cov)
+        # cannot regularize to a condition number less than the diagonal matrix so raise ValueError
+        with self.assertRaises(ValueError):
+            regularize_cov(cov, 0.5)
+
     ## Tests for doGaussNewton & doLineSearch
 
 
@@ -578,6 +695,24 @@ class TestGNLS(unittest.TestCase):
             self.compare_LS_std_ref(std, ref)
 
 
+    def gn_problem(self, nparam: int = 10):
+        """
+        Simple problem used to test gaussNewton. fn records the number of runs for each call in nruns.
+        :param nparam: number of parameters
+        :return: fn, nruns, tgt, paramStep, paramRange, cov
+        """
+        nruns = []
+
+        def fn(x):
+            nruns.append(x.shape[0])
+            return (x ** 2) * 20 - 5 / np.reshape(np.arange(1, x.shape[-1] + 1), (1, -1))
+
+        tgt = np.repeat(0.5, nparam) * 21  # target we want
+        paramStep = np.repeat(0.01, nparam)  # parameter perturbation
+        paramRange = np.vstack((np.repeat(0, nparam), np.repeat(1, nparam))).T  # param range
+        cov = np.diag(np.repeat(1e-12, nparam))  # converge when roughly sqrt(cov) from tgt.
+        return fn, nruns, tgt, paramStep, paramRange, cov
+
     def test_gaussNewton(self):
         """
         Test gaussNewton
@@ -608,6 +743,183 @@ class TestGNLS(unittest.TestCase):
         self.assertEqual(status, 'Converged')
         nptest.assert_allclose(np.squeeze(fn(best)), tgt, atol=1e-3)  # reached the target
 
+    def test_gaussNewton_broyden(self):
+        """
+        Test gaussNewton with Broyden updates to the Jacobian.
+        Should converge and need fewer function evaluations than always computing the Jacobian
+        """
+        nparam = 10
+        startParam = np.hstack((np.repeat(1.0, nparam - nparam / 2), np.repeat(0.0, nparam / 2)))  # starting values
+        fn, nruns, tgt, paramStep, paramRange, cov = self.gn_problem(nparam)
+        best, status, info = gaussNewton(fn, startParam, paramRange, paramStep, tgt, {},
+                                         cov=cov, cov_iv=cov)
+        nruns_full = sum(nruns)
+        nruns.clear()
+        optimise = dict(broyden=True, broyden_refresh=4)
+        best, status, info = gaussNewton(fn, startParam, paramRange, paramStep, tgt, optimise,
+                                         cov=cov, cov_iv=cov)
+        self.assertEqual(status, 'Converged')
+        nptest.assert_allclose(np.squeeze(fn(best)), tgt, atol=1e-3)  # reached the target
+        self.assertTrue(np.any(info['broyden']))
+        self.assertFalse(info['broyden'][0])  # first iteration always computes full jacobian
+        self.assertLess(sum(nruns[:-1]), nruns_full)  # last call was the check above.
+        # never use broyden updates if broyden_refresh is 1.
+        optimise['broyden_refresh'] = 1
+        best, status, info = gaussNewton(fn, startParam, paramRange, paramStep, tgt, optimise,
+                                         cov=cov, cov_iv=cov)
+        self.assertFalse(np.any(info['broyden']))
+        with self.assertRaises(ValueError):
+            gaussNewton(fn, startParam, paramRange, paramStep, tgt, dict(broyden=True, nrandom=3),
+                        cov=cov, cov_iv=cov)
+
+    def test_gaussNewton_pipeline(self):
+        """
+        Test gaussNewton running predicted line-search cases in the same batch as the Jacobian.
+        Should converge with fewer calls to the function.
+        """
+        nparam = 10
+        startParam = np.hstack((np.repeat(1.0, nparam - nparam / 2), np.repeat(0.0, nparam / 2)))  # starting values
+        fn, nruns, tgt, paramStep, paramRange, cov = self.gn_problem(nparam)
+        best_full, status_full, info_full = gaussNewton(fn, startParam, paramRange, paramStep, tgt, {},
+                                                        cov=cov, cov_iv=cov)
+        ncalls_full = len(nruns)
+        nruns.clear()
+        best, status, info = gaussNewton(fn, startParam, paramRange, paramStep, tgt, dict(pipeline=True),
+                                         cov=cov, cov_iv=cov)
+        self.assertEqual(status, status_full)
+        nptest.assert_allclose(np.squeeze(fn(best)), tgt, atol=1e-3)  # reached the target
+        self.assertEqual(info['predicted'][0], 0)  # nothing to predict from on first iteration
+        self.assertTrue(np.any(info['predicted'] > 0))
+        self.assertLess(len(nruns) - 1, ncalls_full)  # last call was the check above.
+
+    def test_gaussNewton_jacobian(self):
+        """
+        Test gaussNewton with a jacobian supplied. First iteration should only perturb parameters without
+         a jacobian.
+        """
+        nparam = 10
+        startParam = np.repeat(0.5, nparam)
+        fn, nruns, tgt, paramStep, paramRange, cov = self.gn_problem(nparam)
+        jacobian = np.diag(40 * startParam)  # analytic jacobian at start
+        jacobian[2, :] = np.nan  # no jacobian for parameter 2
+        best, status, info = gaussNewton(fn, startParam, paramRange, paramStep, tgt, {},
+                                         cov=cov, cov_iv=cov, jacobian=jacobian)
+        self.assertEqual(status, 'Converged')
+        nptest.assert_allclose(np.squeeze(fn(best)), tgt, atol=1e-3)  # reached the target
+        self.assertEqual(nruns[0], 2)  # base and parameter 2.
+        nptest.assert_equal(info['refreshed'][0], np.arange(nparam) == 2)
+
+    def test_gaussNewton_nrandom(self):
+        """
+        Test gaussNewton perturbing a random subset of parameters.
+        """
+        nparam = 10
+        nrandom = 4
+        startParam = np.repeat(0.8, nparam)
+        fn, nruns, tgt, paramStep, paramRange, cov = self.gn_problem(nparam)
+        optimise = dict(nrandom=nrandom, maxIterations=20, maxFails=2)
+        best, status, info = gaussNewton(fn, startParam, paramRange, paramStep, tgt, optimise,
+                                         cov=cov, cov_iv=cov)
+        self.assertEqual(status, 'Converged')
+        nptest.assert_allclose(np.squeeze(fn(best)), tgt, atol=1e-3)  # reached the target
+        niter = len(info['iter'])
+        # same diagnostics as full mode.
+        self.assertEqual(info['jacobian'].shape, (niter, nparam, nparam))
+        self.assertEqual(info['hessian'].shape, (niter, nparam, nparam))
+        self.assertEqual(len(info['bestParams']), niter)
+        # first iteration refreshes all parameters. Others only nrandom.
+        self.assertTrue(np.all(info['refreshed'][0]))
+        nptest.assert_equal(info['refreshed'][1:].sum(axis=1), nrandom)
+        # perturbations after the first iteration only have nrandom+1 runs.
+        self.assertEqual(nruns[0], nparam + 1)
+        self.assertEqual(nruns[2], nrandom + 1)
+        # jacobian rows that were not refreshed are carried forward. All parameters stay between 0.1 and 1
+        # so parameter scaling does not change between iterations.
+        for indx in range(1, niter):
+            carried = ~info['refreshed'][indx]
+            nptest.assert_allclose(info['jacobian'][indx][carried], info['jacobian'][indx - 1][carried])
+
+    def test_cmaes(self):
+        """
+        Test cmaes. Should converge, keep parameters in range, be deterministic
+         and evaluate each generation in one call.
+        """
+        nruns = []
+        nparam = 5
+        paramRange = np.vstack((np.repeat(0.0, nparam), np.repeat(2.0, nparam))).T
+        tgt = np.linspace(0.2, 1.8, nparam)
+        tgt[0] = -1  # outside range so best value is at the minimum
+
+        def fn(x):
+            nruns.append(x.shape[0])
+            self.assertTrue(np.all((x >= paramRange[:, 0]) & (x <= paramRange[:, 1])))
+            return np.sum((x - tgt) ** 2, axis=1)
+
+        # transform and its inverse.
+        z = np.linspace(0, 1, nparam)
+        nptest.assert_allclose(bounded_inverse(bounded_transform(z, paramRange), paramRange), z, atol=1e-12)
+        optimise = dict(popsize=8, maxIterations=200)
+        best, status, info = cmaes(fn, np.repeat(1.0, nparam), paramRange, optimise)
+        self.assertEqual(status, 'Converged')
+        expect = np.clip(tgt, paramRange[:, 0], paramRange[:, 1])
+        nptest.assert_allclose(best, expect, atol=1e-3)
+        self.assertTrue(np.all(np.array(nruns) == 8))
+        self.assertEqual(info['nfun'], sum(nruns))
+        # deterministic
+        best2, status2, info2 = cmaes(fn, np.repeat(1.0, nparam), paramRange, optimise)
+        nptest.assert_equal(best, best2)
+        nptest.assert_equal(info['cost'], info2['cost'])
+        # hit iteration limit
+        best, status, info = cmaes(fn, np.repeat(1.0, nparam), paramRange, dict(popsize=8, maxIterations=3))
+        self.assertEqual(status, 'Failed')
+        self.assertEqual(len(info['iter']), 3)
+
+    def test_gp(self):
+        """
+        Test gp_fit & gp_predict. GP should (nearly) interpolate values and have small variance at the data.
+        """
+        rng = np.random.default_rng(1234)
+        X = rng.uniform(size=(20, 2))
+        y = np.sin(3 * X[:, 0]) + X[:, 1] ** 2
+        gp = gp_fit(X, y)
+        mean, var = gp_predict(gp, X)
+        nptest.assert_allclose(mean, y, atol=1e-2)
+        self.assertTrue(np.all(var < 1e-3))
+        Xnew = rng.uniform(size=(5, 2))
+        mean, var = gp_predict(gp, Xnew)
+        nptest.assert_allclose(mean, np.sin(3 * Xnew[:, 0]) + Xnew[:, 1] ** 2, atol=0.1)
+        mean2, cov = gp_predict(gp, Xnew, full_cov=True)
+        nptest.assert_allclose(mean2, mean)
+        nptest.assert_allclose(np.diag(cov), var, rtol=1e-6, atol=1e-10)
+
+    def test_bayesOpt(self):
+        """
+        Test bayesOpt. Should reduce cost, be deterministic and run q points per call.
+        """
+        nruns = []
+        nparam = 3
+        paramRange = np.vstack((np.repeat(0.0, nparam), np.repeat(2.0, nparam))).T
+        tgt = np.linspace(0.4, 1.6, nparam)
+
+        def fn(x):
+            nruns.append(x.shape[0])
+            self.assertTrue(np.all((x >= paramRange[:, 0]) & (x <= paramRange[:, 1])))
+            return np.sum((x - tgt) ** 2, axis=1)
+
+        for acquisition in ['kb', 'qei']:
+            with self.subTest(acquisition=acquisition):
+                nruns.clear()
+                optimise = dict(q=3, maxIterations=5, acquisition=acquisition, ncandidates=200)
+                best, status, info = bayesOpt(fn, np.repeat(1.0, nparam), paramRange, optimise)
+                self.assertEqual(status, 'Failed')  # ran out of iterations
+                self.assertEqual(nruns, [2 * nparam + 1] + [3] * 5)
+                self.assertLess(info['best_cost'][-1], info['cost'][0:2 * nparam + 1].min())
+                nptest.assert_allclose(fn(best[np.newaxis, :]), info['best_cost'][-1])
+                best2, status2, info2 = bayesOpt(fn, np.repeat(1.0, nparam), paramRange, optimise)
+                nptest.assert_equal(info['params'], info2['params'])  # deterministic
+        with self.assertRaises(ValueError):
+            bayesOpt(fn, np.repeat(1.0, nparam), paramRange, dict(acquisition='fred'))
+
     def test_jacobian(self):
         """
         Test Jacobian
@@ -691,6 +1003,45 @@ class TestGNLS(unittest.TestCase):
         expect = GNjacobian(self.optFunction, param.values, -self.step)
         nptest.assert_allclose(jac.values, expect, err_msg='runJac jac not as expected at +ve bdnry', rtol=1e-5)
 
+    def test_adaptiveJacobian(self):
+        """
+        Test adaptiveJacobian. Only noisy parameters should get extra ensemble members.
+        """
+        import pandas as pd
+        paramNames = ['p' + str(i) for i in range(0, len(self.orig_param))]
+        param = pd.Series(self.orig_param, index=paramNames)
+        step = np.array([1.0, 1.0, 1e-3, 1.0, 1e-3])  # small steps give noisy jacobians
+        deltaP = pd.Series(step, index=paramNames)
+        prange = pd.DataFrame(self.param_range.T, columns=paramNames, index=['minParam', 'maxParam'])
+        calls = []
+
+        def fn(params, *args, **kwargs):
+            calls.append(kwargs['ensembleMember'].copy())
+            return self.optFunction(params, *args, **kwargs)
+
+        randomScale = 1e-2
+        covIntVar = np.identity(self.nobs) * randomScale ** 2
+        jac = adaptiveJacobian(fn, param, deltaP, prange, covIntVar, randomScale=randomScale, maxEnsemble=8)
+        expect = runJacobian(self.optFunction, param, deltaP, prange).values  # noise free jacobian
+        nens = jac.nEnsemble.values
+        nptest.assert_equal(nens[[0, 1, 3]], 1)  # large steps need no extra members
+        self.assertTrue(np.all(nens[[2, 4]] > 1))
+        self.assertTrue(np.all(nens <= 8))
+        self.assertEqual(len(calls[0]), len(step) + 1)  # first call runs base and all perturbations
+        nptest.assert_equal(calls[0], 0)
+        self.assertEqual(sum(len(c) for c in calls), (nens.sum() + nens.max()))  # base runs max members
+        nptest.assert_allclose(jac.Jacobian.values[[0, 1, 3]], expect[[0, 1, 3]], atol=0.05)
+        # noisy jacobian within a few standard deviations of expected
+        err = np.abs(jac.Jacobian.values - expect) / np.sqrt(jac.Jacobian_var.values)
+        self.assertTrue(np.all(err < 5))
+
+        # with negligible noise only one call should be needed.
+        calls.clear()
+        jac = adaptiveJacobian(fn, param, deltaP, prange, covIntVar * 1e-14, randomScale=1e-9)
+        self.assertEqual(len(calls), 1)
+        nptest.assert_equal(jac.nEnsemble.values, 1)
+        nptest.assert_allclose(jac.Jacobian.values, expect, rtol=1e-4)
+
 
 
 if __name__ == "__main__":
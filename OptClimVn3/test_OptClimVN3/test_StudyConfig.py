@@ -663,6 +663,30 @@ class testStudyConfig(unittest.TestCase):
         self.config.DFOLS_config(config)  # set it and now should be the same
         self.assertEqual(config, self.config.DFOLS_config())
 
+    def test_BayesOpt_config(self):
+        """
+        Test BayesOpt_config
+        """
+        self.assertEqual(self.config.BayesOpt_config(), {})  # not in config so empty dict
+        config = dict(q=3, acquisition='qei')
+        self.config.BayesOpt_config(config)
+        self.assertEqual(self.config.BayesOpt_config(), config)
+        self.assertEqual(self.config.optimise()['bayesopt'], config)
+        config['q'] = 5  # config is copied so changing it has no effect.
+        self.assertEqual(self.config.BayesOpt_config()['q'], 3)
+
+    def test_CMAES_config(self):
+        """
+        Test CMAES_config
+        """
+        self.assertEqual(self.config.CMAES_config(), {})  # not in config so empty dict
+        config = dict(popsize=6, sigma0=0.3)
+        self.config.CMAES_config(config)
+        self.assertEqual(self.config.CMAES_config(), config)
+        self.assertEqual(self.config.optimise()['cmaes'], config)
+        config['popsize'] = 8  # config is copied so changing it has no effect.
+        self.assertEqual(self.config.CMAES_config()['popsize'], 6)
+
     def test_dataFrameInfo(self):
 
         """
@@ -206,6 +206,28 @@ class MyTestCase(unittest.TestCase):
         pths_got = set(submit.rootDir.glob("*"))
         self.assertEqual(set(pths_got), set(pths_expect))
 
+    def test_instantiate_parallel(self):
+        # test can instantiate models using a pool of processes and that errors are collected.
+        submit = self.submit
+        models = list(submit.model_index.values())
+        submit.run_info['instantiate_parallel'] = 2
+        iter_count = submit.instantiate()
+        self.assertEqual(iter_count, 1)
+        for model in models:  # models should have been updated in place
+            self.assertEqual(model.status, 'INSTANTIATED')
+            self.assertEqual(model, Model.load_model(model.config_path))
+            self.assertTrue(len(list(model.model_dir.glob("*"))) > 3)
+            self.assertEqual(submit.iter_keys[submit.key_for_model(model)], 1)
+        # now have failures. Make two new models one of which will fail.
+        new_models = [submit.create_model(dict(VF1=v, CT=1e-4)) for v in [2.0, 2.2]]
+        new_models[0].reference = self.testDir / 'no_such_reference'
+        with self.assertRaises(ValueError):
+            submit.instantiate()
+        self.assertEqual(new_models[0].status, 'CREATED')
+        self.assertEqual(new_models[1].status, 'INSTANTIATED')
+        self.assertNotIn(submit.key_for_model(new_models[0]), submit.iter_keys)
+        self.assertEqual(submit.iter_keys[submit.key_for_model(new_models[1])], 2)
+
     # need to mock both SubmitStudy and myModel now.
     @unittest.mock.patch.object(SubmitStudy.SubmitStudy, 'now', side_effect=times)
     @unittest.mock.patch.object(myModel, 'now', side_effect=times)
@@ -300,6 +322,103 @@ class MyTestCase(unittest.TestCase):
             submit.submit_all_models(fake_fn=fake_function)
             mck_output.assert_not_called()
 
+    def test_submit_models(self):
+        # test parallel submission returns job ids in model order whatever order submissions finish in.
+        submit = self.submit
+        submit.instantiate()
+        submit.run_info.update(submit_parallel=3, submit_rate=100.)
+        models = submit.models_to_submit()
+
+        def fake_qsub(cmd, **kwargs):
+            name = " ".join(cmd).split(' -N ')[1].split()[0]  # job name which depends on the model.
+            return f"Job submitted {sum(ord(c) * (i + 1) for i, c in enumerate(name))}"
+
+        with unittest.mock.patch("subprocess.check_output", autospec=True, side_effect=fake_qsub) as mck_output:
+            with unittest.mock.patch("engine.rate_limiter.wait", autospec=True, return_value=0.0) as mck_wait:
+                pp_jids = submit.submit_models(models)
+            self.assertEqual(mck_output.call_count, 2 * len(models))
+            self.assertEqual(mck_wait.call_count, mck_output.call_count)  # limit applies to every command.
+        expect = [fake_qsub(['qsub', '-N', f"PP_{m.name}"]).split()[2] for m in models]
+        self.assertEqual(pp_jids, expect)
+        for model, jid in zip(models, pp_jids):
+            self.assertEqual(model.pp_jid, jid)
+            self.assertEqual(model.status, 'SUBMITTED')
+        # bad value for submit_parallel should fail
+        submit.run_info.update(submit_parallel=0)
+        with self.assertRaises(ValueError):
+            submit.submit_models(models)
+
+    def test_aggregate_post_process(self):
+        # test that one post-processing job can be used for all models.
+        submit = self.submit
+        submit.instantiate()
+        submit.run_info.update(aggregate_post_process=True, post_process_parallel=2)
+        job_nos = range(34567, 34567 + 5)
+        output = [f"Job submitted {item}" for item in job_nos]
+        with unittest.mock.patch("subprocess.check_output",
+                                 autospec=True, side_effect=output) as mck_output:
+            nmodels = submit.submit_all_models()
+            # one pp job, three models and the next iteration.
+            self.assertEqual(mck_output.call_count, 5)
+            pp_cmd = " ".join(mck_output.call_args_list[0].args[0])
+            next_cmd = " ".join(mck_output.call_args_list[-1].args[0])
+        self.assertEqual(nmodels, 3)
+        self.assertIn('process_models.py -p 2', pp_cmd)
+        for model in submit.model_index.values():
+            self.assertEqual(model.pp_jid, str(job_nos[0]))
+            self.assertTrue(model.shared_pp)
+            self.assertIn(str(model.config_path), pp_cmd)
+        self.assertIn(f'-hold_jid {job_nos[0]} ', next_cmd)
+        self.assertEqual(submit.next_iter_jids, [str(job_nos[-1])])
+        max_wait = submit.run_info.get('runTime', 2000)
+        self.assertIn(f'--max_wait {max_wait} ', pp_cmd)
+        # a model that failed and is being continued.
+        model = list(submit.model_index.values())[0]
+        model.status = 'CONTINUE'
+        # shared job still there so model just gets continued.
+        with unittest.mock.patch("engine.sge_engine.job_status", autospec=True, return_value='Running'):
+            with unittest.mock.patch("subprocess.check_output", autospec=True,
+                                     return_value="Job submitted 45678") as mck_output:
+                self.assertEqual(submit.submit_all_models(), 1)
+                self.assertEqual(mck_output.call_count, 1)
+        self.assertEqual(model.pp_jid, str(job_nos[0]))
+        # shared job has finished (gave up waiting) so new pp job, model and next iteration held on the pp job.
+        model.status = 'CONTINUE'
+        output = [f"Job submitted {item}" for item in range(56789, 56789 + 3)]
+        with unittest.mock.patch("engine.sge_engine.job_status", autospec=True, return_value='notFound'):
+            with unittest.mock.patch("subprocess.check_output", autospec=True, side_effect=output) as mck_output:
+                self.assertEqual(submit.submit_all_models(), 1)
+                self.assertEqual(mck_output.call_count, 3)
+                pp_cmd = " ".join(mck_output.call_args_list[0].args[0])
+                next_cmd = " ".join(mck_output.call_args_list[-1].args[0])
+        self.assertIn(str(model.config_path), pp_cmd)
+        self.assertEqual(model.pp_jid, '56789')
+        self.assertTrue(model.shared_pp)
+        self.assertIn('-hold_jid 56789 ', next_cmd)
+        self.assertEqual(submit.next_iter_jids[-1], '56791')
+
+    def test_set_runtime(self):
+        # test that runtimes for jobs are set from the runtimes of previous jobs.
+        submit = self.submit
+        models = list(submit.model_index.values())
+        self.assertIsNone(submit.set_runtime(models[0]))  # no runtime_percentile so nothing done.
+        submit.run_info.update(runtime_percentile=50, runtime_min_samples=2, runtime_margin=1.0)
+        self.assertEqual(submit.set_runtime(models[0]), {})  # no runtimes so nothing set.
+        start = datetime.datetime(2000, 1, 1)
+        for model, runtime in zip(models, [1000, 2000, 4000]):
+            end = start + datetime.timedelta(seconds=runtime)
+            model.job_times = [dict(job='model', start=str(start), end=str(end), status='SUCCEEDED'),
+                               dict(job='post_process', start=str(start), end=None, status=None)]
+        runtimes = submit.job_runtimes()
+        self.assertEqual(list(runtimes.runtime), [1000., 2000., 4000.])
+        self.assertEqual(submit.runtime_estimate(models[0], percentile=50), 2000.)
+        result = submit.set_runtime(models[0])
+        self.assertEqual(result, dict(model=2000))  # post-processing not finished so not set.
+        self.assertEqual(models[0].run_info['runTime'], 2000)
+        # models with different durations are not used.
+        models[0].parameters['RUN_TARGET'] = 'P1Y'
+        self.assertIsNone(submit.runtime_estimate(models[0]))
+
     dt = datetime.datetime(2022, 1, 1, 0, 0, 0)
 
     @unittest.mock.patch.object(SubmitStudy.SubmitStudy, 'now', return_value=dt)
@@ -272,6 +272,13 @@ class testRunSubmit(unittest.TestCase):
         # and we are a series of size 1.
         self.assertEqual(result.size, 1, "Size not as expected")
 
+        # asking for a single ensemble member per simulation gives that member with no averaging.
+        pDict = dict(zip(rSubmit.config.paramNames(), params2[1]), **rSubmit.config.fixedParams(), ensembleMember=1)
+        member = rSubmit.get_model(parameters=pDict)
+        result = rSubmit.stdFunction(params2, df=True, ensembleMember=np.array([0, 1]))
+        self.assertEqual(result.shape, (2, nobs))
+        self.assertTrue(result.iloc[1].equals(member.simulated_obs), "Ensemble member 1 not as expected")
+
         # check that optclim_exceptions.submitModel is raised when we ask for new models above the limit.
         rSubmit.run_info["max_model_simulations"] = len(rSubmit.model_index)
         with self.assertRaises(optclim_exceptions.submitModel):
@@ -677,6 +684,54 @@ class testRunSubmit(unittest.TestCase):
         jac_run = finalConfig.transJacobian()
         nptest.assert_allclose(jac_run, expect_jac, atol=1e-9)
 
+    @unittest.mock.patch.object(
+        engine.sge_engine, "job_status", autospec=True, return_value="notFound"
+    )
+    def test_runJacobian_adaptive(self, mck):
+        """
+        Test runJacobian with adaptive_jacobian set. With small internal variability only one ensemble member
+         is needed for each parameter and the Jacobian should be the same as the standard one.
+         With large internal variability extra members (up to maxEnsemble) are ran.
+        """
+        scale = True
+
+        def run_jac(config, name):
+            rSubmit = runSubmit.runSubmit(config, name, rootDir=self.rootDir, refDir=self.refDir)
+            while True:
+                try:
+                    return rSubmit, rSubmit.runJacobian(scale=scale)
+                except optclim_exceptions.submitModel:  # Need to run some models.
+                    fake_run(rSubmit, scale=scale)
+
+        configData = copy.deepcopy(self.config)
+        configData.beginParam(begin=configData.paramRanges().loc["maxParam", :])
+        steps = configData.steps()
+        steps.iloc[:] = np.arange(len(steps)) * 0.001 + 0.1  # small but not equal steps.
+        steps.loc["scale_steps"] = True
+        configData.steps(steps=steps)
+        nparam = len(configData.paramNames())
+        rSubmit, expectConfig = run_jac(copy.deepcopy(configData), "test_jac")
+        rSubmit.delete()  # clean up so model directories can be reused.
+        expect_jac = expectConfig.transJacobian()
+
+        obs = configData.obsNames()
+        configData.optimise(adaptive_jacobian=dict(maxEnsemble=2))
+        configData.Covariances(CovIntVar=pd.DataFrame(np.diag(np.repeat(1e-20, len(obs))), index=obs, columns=obs))
+        rSubmit, finalConfig = run_jac(copy.deepcopy(configData), "test_adapt_jac")
+        self.assertEqual(len(rSubmit.model_index), nparam + 1)
+        nptest.assert_allclose(finalConfig.transJacobian(), expect_jac, rtol=1e-6, atol=1e-9)
+        nEnsemble = finalConfig.get_dataFrameInfo('nEnsemble')
+        nptest.assert_equal(nEnsemble.values, 1)
+        jac_var = finalConfig.get_dataFrameInfo('Jacobian_var', dtype=float)
+        self.assertEqual(jac_var.shape, expect_jac.shape)
+        rSubmit.delete()
+        # large internal variability -- all parameters get a second member. fake_fn is noise free so no more needed.
+        configData.Covariances(CovIntVar=pd.DataFrame(np.diag(np.repeat(1e6, len(obs))), index=obs, columns=obs))
+        rSubmit, finalConfig = run_jac(copy.deepcopy(configData), "test_adapt_jac2")
+        self.assertEqual(len(rSubmit.model_index), 2 * (nparam + 1))
+        nptest.assert_equal(finalConfig.get_dataFrameInfo('nEnsemble').values, 2)
+        nptest.assert_allclose(finalConfig.transJacobian(), expect_jac, rtol=1e-6, atol=1e-9)
+
     def test_runGaussNewton(self):
         """
 
@@ -847,6 +902,179 @@ class testRunSubmit(unittest.TestCase):
             msg=f"Expected 1 iteration got {iterCount}",
         )
 
+    def test_warm_start(self):
+        """
+        Test warm_start and that runGaussNewton uses it to skip the initial perturbations.
+        """
+        import Optimise
+
+        scale = True
+        # covariances set in setUp are not saved so use config as read in.
+        configData = StudyConfig.readConfig(self.config.fileName())
+        configData.constraint(False)  # no constraint
+        configData.provisional_info(dict(max_provisional_cases=None))  # turn off provisional running.
+        configData.steps(steps=configData.paramRanges().loc["rangeParam", :] * 0.05)
+        paramNames = configData.paramNames()
+        rSubmit = runSubmit.runSubmit(
+            configData, "test_warm", rootDir=self.rootDir, refDir=self.refDir
+        )
+        start, jac = rSubmit.warm_start(scale=scale)  # no warm_start so get begin and no jacobian
+        pdtest.assert_series_equal(start, configData.beginParam(paramNames=paramNames))
+        self.assertIsNone(jac)
+        # make a prior final config.
+        prior = copy.deepcopy(configData)
+        prange = prior.paramRanges(paramNames=paramNames)
+        optimum = prange.loc["minParam", :] + 0.25 * prange.loc["rangeParam", :]
+        prior.optimumParams(optimum=optimum)
+        tMat = prior.transMatrix(scale=scale)
+        rng = np.random.default_rng(123)
+        expect_jac = pd.DataFrame(rng.normal(size=(len(paramNames), tMat.shape[0])),
+                                  index=paramNames, columns=tMat.index)
+        prior.transJacobian(expect_jac)
+        prior_path = self.rootDir / "prior_final.json"
+        prior.save(prior_path)
+        configData.optimise(warm_start=str(prior_path))
+        rSubmit = runSubmit.runSubmit(
+            configData, "test_warm", rootDir=self.rootDir, refDir=self.refDir
+        )
+        start, jac = rSubmit.warm_start(scale=scale)
+        nptest.assert_allclose(start.values, optimum.values)
+        nptest.assert_allclose(jac.values, expect_jac.values, atol=1e-8)
+        # Gauss-Newton jacobians are wrt scaled parameters.
+        gn_params = np.vstack([configData.beginParam(paramNames=paramNames).values, optimum.values])
+        prior.GNparams(gn_params)
+        prior.save(prior_path)
+        start, jac = rSubmit.warm_start(scale=scale)
+        expect = expect_jac.mul(Optimise.param_scaling(optimum.values), axis=0)
+        nptest.assert_allclose(jac.values, expect.values, atol=1e-8)
+        # GN should only run the base case on the first iteration.
+        with self.assertRaises(optclim_exceptions.submitModel):
+            rSubmit.runGaussNewton(scale=scale)
+        models = list(rSubmit.model_index.values())
+        self.assertEqual(len(models), 1)
+        nptest.assert_allclose(pd.Series(models[0].parameters)[paramNames].astype(float).values,
+                               optimum.values)
+
+    def test_sim_obs_cache(self):
+        """
+        Test sim_obs uses the simulation cache. Once a model is processed in one study another study
+         with the same cache should get the same obs without creating a model.
+        """
+        configData = copy.deepcopy(self.config)
+        configData.provisional_info(dict(max_provisional_cases=None))  # turn off provisional running.
+        configData.set_run_info(simulation_cache=str(self.rootDir / "sim_cache"))
+        params = configData.beginParam().to_dict()
+        params.update(configData.fixedParams())
+        rSubmit = runSubmit.runSubmit(
+            configData, "test_cache", rootDir=self.rootDir / "study1", refDir=self.refDir
+        )
+        obs = rSubmit.sim_obs(params)
+        self.assertTrue(obs.isnull().all())  # no model run yet.
+        self.assertEqual(len(rSubmit.model_index), 1)
+        fake_run(rSubmit)
+        cache = rSubmit.simulation_cache()
+        cache_key = rSubmit.cache_key(cache, params)
+        expect = rSubmit.sim_obs(params)
+        self.assertFalse(expect.isnull().any())
+        self.assertIsNone(cache.get(cache_key))  # fake models are never cached.
+        self.assertEqual(len(rSubmit.cache_stored), 0)
+        for model in rSubmit.model_index.values():  # pretend the model really ran.
+            model.fake = False
+        put = type(cache).put
+        with unittest.mock.patch.object(type(cache), 'put', autospec=True, side_effect=put) as mck_put:
+            expect = rSubmit.sim_obs(params)  # processed so now in the cache.
+            rSubmit.sim_obs(params)  # replaying does not store it again.
+        self.assertEqual(mck_put.call_count, 1)
+        self.assertIsNotNone(cache.get(cache_key))
+        rSubmit2 = runSubmit.runSubmit(
+            configData, "test_cache2", rootDir=self.rootDir / "study2", refDir=self.refDir
+        )
+        got = rSubmit2.sim_obs(params)
+        pdtest.assert_series_equal(got, expect, check_names=False)
+        self.assertEqual(len(rSubmit2.model_index), 0)  # no model created
+        self.assertEqual(len(rSubmit2.cache_hits), 1)
+        rSubmit2.sim_obs(params)
+        hits = [msg for msgs in rSubmit2._history.values() for msg in msgs if "cached simulation" in msg]
+        self.assertEqual(len(hits), 1)  # only recorded once in the history.
+        # different parameters should not hit the cache.
+        params.update(ensembleMember=1)
+        obs = rSubmit2.sim_obs(params)
+        self.assertTrue(obs.isnull().all())
+        self.assertEqual(len(rSubmit2.model_index), 1)
+
+    def test_runCMAES(self):
+        """
+        Test runCMAES. Each generation should be one set of models filling maxRuns and
+         the result should be the same as running Optimise.cmaes directly.
+        """
+        import Optimise
+
+        scale = True
+        configData = copy.deepcopy(self.config)
+        configData.optimise(cmaes=dict(maxIterations=4))
+        configData.maxRuns(6)
+        rSubmit = runSubmit.runSubmit(
+            configData, "test_CMAES", rootDir=self.rootDir, refDir=self.refDir
+        )
+        nModels = []
+        while True:
+            try:
+                finalConfig = rSubmit.runCMAES(scale=scale)
+                break
+            except optclim_exceptions.submitModel:  # Need to run some models which are "faked"
+                create_models = [model for model in rSubmit.model_index.values() if model.status == "CREATED"]
+                nModels.append(len(create_models))
+                fake_run(rSubmit, scale=scale)
+        self.assertEqual(nModels, [6] * 4)  # one generation of maxRuns models on each submission.
+        info = finalConfig.getv("CMAES_info")
+        self.assertEqual(info["status"], "Failed")  # ran out of generations.
+        # compare with running cmaes directly.
+        tgt = configData.targets(scale=scale)
+        Tmat = configData.transMatrix(scale=scale)
+        paramNames = configData.paramNames()
+
+        def fn_opt(param_v):
+            cost = []
+            for p in param_v:
+                pDict = dict(zip(paramNames, p))
+                pDict.update(configData.fixedParams())
+                sim_obs = fake_fn(configData, pDict) * configData.scales() - tgt
+                cost.append(float(((sim_obs @ Tmat.T) ** 2).sum()))
+            return np.array(cost)
+
+        prange = configData.paramRanges(paramNames=paramNames).loc[["minParam", "maxParam"], :].values.T
+        best, status, cmaes_info = Optimise.cmaes(fn_opt, configData.beginParam(paramNames=paramNames).values,
+                                                  prange, dict(maxIterations=4, popsize=6))
+        nptest.assert_allclose(finalConfig.optimumParams().values, best, rtol=1e-5)
+        nptest.assert_allclose(info["best_cost"], cmaes_info["best_cost"], rtol=1e-4)
+
+    def test_runBayesOpt(self):
+        """
+        Test runBayesOpt. Initial design then q models on each submission.
+        """
+        scale = True
+        configData = copy.deepcopy(self.config)
+        configData.BayesOpt_config(dict(q=3, maxIterations=2, ncandidates=100))
+        configData.provisional_info(dict(max_provisional_cases=None))  # turn off provisional running.
+        rSubmit = runSubmit.runSubmit(
+            configData, "test_BayesOpt", rootDir=self.rootDir, refDir=self.refDir
+        )
+        nparam = len(configData.paramNames())
+        nModels = []
+        while True:
+            try:
+                finalConfig = rSubmit.runBayesOpt(scale=scale)
+                break
+            except optclim_exceptions.submitModel:  # Need to run some models which are "faked"
+                create_models = [model for model in rSubmit.model_index.values() if model.status == "CREATED"]
+                nModels.append(len(create_models))
+                fake_run(rSubmit, scale=scale)
+        self.assertEqual(nModels, [2 * nparam + 1, 3, 3])
+        info = finalConfig.getv("BayesOpt_info")
+        self.assertEqual(info["status"], "Failed")  # ran out of iterations.
+        self.assertEqual(len(info["best_cost"]), 2)
+        self.assertEqual(len(finalConfig.optimumParams()), nparam)
+
     def test_dump_load(self):
         # test that dumping and loading work by dumping then loading and comparing the two objects.
         fp = self.rSubmit.config_path
@@ -29,12 +29,89 @@ import HadCM3
 import StudyConfig
 import Submit
 import optClimLib
+import ppFile
 from OptClimVn2 import exceptions
 
 
 
+def _pinv_vander(x, order):
+    """
+    Pseudo-inverse of the Vandermonde matrix for x. Columns are scaled (as np.polyfit does) to improve conditioning.
+    :param x: x values. Can have leading dimensions in which case a stack of pseudo-inverses is returned.
+    :param order: order of polynomial
+    :return: pseudo-inverse -- shape (..., order+1, len(x)). Coefficients are highest power first as np.polyfit.
+    """
+    vander = x[..., np.newaxis] ** np.arange(order, -1, -1)
+    scale = np.sqrt((vander * vander).sum(axis=-2, keepdims=True))
+    scale[scale == 0] = 1
+    return np.linalg.pinv(vander / scale) / np.swapaxes(scale, -1, -2)
+
+
+def batch_polyfit(x, data, order, chunk=None):
+    """
+    Least squares polynomial fit to all columns of data. Columns are grouped by their mask pattern and the
+      pseudo-inverse of the Vandermonde matrix computed once for each pattern so each group is fitted by one
+      matrix product. Masked (or NaN) values are ignored.
+    :param x: x values (len n)
+    :param data: data (n x m) -- can be masked.
+    :param order: order of polynomial.
+    :param chunk (default None): If specified process this many columns at a time.
+    :return: coefficients (order+1 x m) highest power first as np.polyfit.
+       Columns with less than order+1 valid points are NaN.
+    """
+    x = np.asarray(x, dtype=float)
+    msk = np.ma.getmaskarray(data) | ~np.isfinite(np.ma.filled(data, np.nan))
+    values = np.where(msk, 0.0, np.ma.filled(data, 0.0))
+    npt = values.shape[1]
+    result = np.full((order + 1, npt), np.nan)
+    patterns, inverse = np.unique(msk, axis=1, return_inverse=True)
+    inverse = np.ravel(inverse)
+    for indx in range(patterns.shape[1]):
+        valid = ~patterns[:, indx]
+        if valid.sum() <= order:  # not enough points
+            continue
+        pinv = _pinv_vander(x[valid], order)
+        cols = np.flatnonzero(inverse == indx)
+        step = len(cols) if chunk is None else chunk
+        for start in range(0, len(cols), step):
+            c = cols[start:start + step]
+            result[:, c] = pinv @ values[valid][:, c]
+    return result
+
+
+def bootstrap_polyval(x, data, order, year, nboot, chunk=None, rng=None):
+    """
+    Bootstrap estimate of the uncertainty in polynomial fit values at year. All replicates are computed at once:
+      the pseudo-inverses for the resampled Vandermonde matrices are stacked and applied to the resampled data as
+      one matrix product. Masks are ignored.
+    :param x: x values (len n)
+    :param data: data (n x m)
+    :param order: order of polynomial
+    :param year: values at which to evaluate fits.
+    :param nboot: number of bootstrap replicates.
+    :param chunk (default None): If specified process this many columns at a time. Memory use is nboot*n*chunk.
+    :param rng (default None): numpy random generator. If None np.random is used.
+    :return: standard deviation of the fits at year (len(year) x m)
+    """
+    x = np.asarray(x, dtype=float)
+    values = np.asarray(np.ma.getdata(data), dtype=float)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    n, npt = values.shape
+    indx = (np.random if rng is None else rng).choice(n, (nboot, n))
+    pinv = _pinv_vander(x[indx], order)  # nboot x order+1 x n
+    year_vander = np.atleast_1d(np.asarray(year, dtype=float))[:, np.newaxis] ** np.arange(order, -1, -1)
+    proj = year_vander @ pinv  # maps resampled data straight to values at year: nboot x nyear x n
+    result = np.empty((year_vander.shape[0], npt))
+    step = npt if chunk is None else chunk
+    for start in range(0, npt, step):
+        fits = proj @ values[indx, start:start + step]  # nboot x nyear x chunk
+        result[:, start:start + step] = np.sqrt(np.var(fits, axis=0))
+    return result
+
+
 def comp_fit(cubeIn, order=2, year=np.array([109, 179]), x=None, bootstrap=None, timeAvg=None, mask=False,
-             fit=False, makeCube=False):
+             fit=False, makeCube=False, chunk=None):
     """
     Fit Nth (Default is 2) order fn to time co-ordinate of cube then compute value at specified year
     :param cube: cube to do fitting to.
@@ -46,6 +123,7 @@ def comp_fit(cubeIn, order=2, year=np.array([109, 179]), x=None, bootstrap=None,
     :param mask (default is False) -- if True mask data..
     :param fit (default is False) -- if True return fit params
     :param makeCube (default for now if False) -- if True wrap the result as a cube.
+    :param chunk (default is None) -- if specified fit (and bootstrap) this many columns at a time to limit memory.
     :return: the fitted values at the specified year
     """
 
@@ -78,18 +156,9 @@ def comp_fit(cubeIn, order=2, year=np.array([109, 179]), x=None, bootstrap=None,
         xx = xx[indx]
         data = data[indx, :]
     try:
-        # watch out when not enough values. Need at least order+1 points.
-        try:
-            cnt = data.count(0)  # sum all non missing data,
-        except AttributeError:
-            cnt = np.repeat(shape[0], npt)
-        L = cnt > order  # logical where we have enough pts.
-        pmsk = np.ma.polyfit(xx, data[:, L], order)  # result on masked subset
-        shp = (pmsk.shape[0], data.shape[1])  # shape of result array
-        p = np.repeat(np.nan, np.product(shp)).reshape(shp)  # array with ara
-        p[:, L] = pmsk
-        p = np.ma.masked_invalid(p)
-    except ValueError:  # polyfit failed likely because of NaN
+        # columns with less than order+1 points are returned as missing by batch_polyfit.
+        p = np.ma.masked_invalid(batch_polyfit(xx, data, order, chunk=chunk))
+    except (ValueError, np.linalg.LinAlgError):  # fit failed likely because of NaN
         return [None] * order
 
     if fit:
@@ -109,15 +178,8 @@ def comp_fit(cubeIn, order=2, year=np.array([109, 179]), x=None, bootstrap=None,
         result = np.ma.masked_array(result, mask=np.broadcast_to(msk0, result.shape))
     # now compute bootstrap...if wanted
     if bootstrap is not None:
-        bsValues = []
-        for i in range(0, bootstrap):
-            npt = len(xx)
-            indx = np.random.choice(npt, npt)
-            p = np.polyfit(xx[indx], data[indx, :], order)
-            bsValues.append(np.polyval(p, year))
-        arr = np.array(bsValues)
-        var = np.var(arr, 0)
-        result = (result, np.sqrt(var))  # append var to the result
+        sd = bootstrap_polyval(xx, data, order, year, bootstrap, chunk=chunk)
+        result = (result, sd.reshape(rShape))  # append sd to the result
 
     if makeCube:  # wrap data as a cube.
         # easiest approach is to select required years then overwrite the data..
@@ -313,10 +375,21 @@ def addAuxCoord(cube, realization=None):
     return cube
 
 
-def readFile(dir, name, realization=None):
+def readFile(dir, name, realization=None, array_only=False):
+    """
+    Read data from netcdf (name.nc) or, if that does not exist, pp (name.pp) file and add aux co-ords.
+    :param dir: directory where file is
+    :param name: name of file without extension
+    :param realization: if not None add a realization co-ord.
+    :param array_only: If True and reading a pp file return a xarray DataArray rather than a cube.
+      See ppFile.read_array. Data comes from the cache in $OPTCLIM_PP_CACHE if that is set.
+    :return: cube (or DataArray)
+    """
     fullname = os.path.join(dir, name + '.nc')
     if not os.path.exists(fullname):
         fullname = os.path.join(dir, name + '.pp')
+        if array_only:
+            return ppFile.read_array(fullname)
     #print(f"Reading in data from {dir} {name}")
     with np.errstate(divide='ignore', invalid='ignore'):  #
         # get Nans in some reads from iris pp conversion. The with means we ignore them!
@@ -857,6 +930,43 @@ class testHadCM3(unittest.TestCase):
         # self.tmpDir.cleanup() # sadly fails because not all files in are writable.
         optClimLib.delDirContents(self.testDir)  # remove all files and dir!
 
+    def test_batch_polyfit(self):
+        """
+        Test batched fits and bootstrap agree with np.ma.polyfit/np.polyfit loops and report times.
+        """
+        import time
+        rng = np.random.default_rng(123)
+        x = np.arange(100, 200.)
+        data = np.ma.masked_array(rng.normal(size=(100, 2000)) + 1e-4 * x[:, np.newaxis] ** 2)
+        data[:, 0:10] = np.ma.masked  # no data
+        data[5:20, 10:20] = np.ma.masked  # some missing data.
+        start = time.perf_counter()
+        p = batch_polyfit(x, data, 2)
+        time_batch = time.perf_counter() - start
+        start = time.perf_counter()
+        expect = np.full_like(p, np.nan)
+        for k in range(10, data.shape[1]):
+            expect[:, k] = np.ma.polyfit(x, data[:, k], 2)
+        time_loop = time.perf_counter() - start
+        npt.assert_allclose(p, expect, rtol=1e-8, atol=1e-10)
+        self.assertTrue(np.all(np.isnan(p[:, 0:10])))
+        print(f"batch_polyfit took {time_batch:.3f}s; loop took {time_loop:.3f}s")
+        # bootstrap -- sd should be close to the loop version.
+        values = data.filled(0.0)[:, 10:]
+        start = time.perf_counter()
+        sd = bootstrap_polyval(x, values, 2, [150.], 200, chunk=500, rng=rng)
+        time_batch = time.perf_counter() - start
+        start = time.perf_counter()
+        bs_values = []
+        for i in range(0, 200):
+            indx = rng.choice(len(x), len(x))
+            bs_values.append(np.polyval(np.polyfit(x[indx], values[indx, :], 2), 150.))
+        expect = np.std(bs_values, 0)
+        time_loop = time.perf_counter() - start
+        self.assertEqual(sd.shape, (1, values.shape[1]))
+        self.assertAlmostEqual(np.median(sd / expect), 1.0, delta=0.1)
+        print(f"bootstrap_polyval took {time_batch:.3f}s; loop took {time_loop:.3f}s")
+
     def test_rwRadn(self):
         """
         iris screws up in some way when it reads then writes toa fluxes...
@@ -0,0 +1,601 @@
+"""
+Lightweight reader for UM PP files which does not need iris.
+Headers (64 words) are read with numpy structured dtypes and the data is memory-mapped so only data that is
+ used gets read. Much faster than iris for small files like the ummonitor timeseries (ts_*.pp) files.
+ WGDOS packed data is unpacked using mo_pack if it is available.
+
+Example use:
+    fields = ppFile.load('ts_t15.pp')  # list of ppField
+    data = fields[0].data  # numpy (memory-mapped) array
+    da = ppFile.load_dataarray('ts_t15.pp')  # xarray DataArray with co-ords from the header/extra data.
+    cube = ppFile.load_cube('ts_t15.pp')  # iris cube for single field files. Needs iris.
+    cache = ppFile.pp_cache('~/pp_cache')  # persistent cache of parsed files.
+    da = cache.read('ts_t15.pp')  # parsed once; later reads (from any process) come from the cache.
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import typing
+import unittest
+
+import numpy as np
+import xarray
+
+my_logger = logging.getLogger(f"OPTCLIM.{__name__}")
+# names of the integer and real header words. See UMDP F3.
+int_headers = ['lbyr', 'lbmon', 'lbdat', 'lbhr', 'lbmin', 'lbday',
+               'lbyrd', 'lbmond', 'lbdatd', 'lbhrd', 'lbmind', 'lbdayd',
+               'lbtim', 'lbft', 'lblrec', 'lbcode', 'lbhem', 'lbrow', 'lbnpt', 'lbext',
+               'lbpack', 'lbrel', 'lbfc', 'lbcfc', 'lbproc', 'lbvc', 'lbrvc', 'lbexp',
+               'lbegin', 'lbnrec', 'lbproj', 'lbtyp', 'lblev',
+               'lbrsvd1', 'lbrsvd2', 'lbrsvd3', 'lbrsvd4', 'lbsrce',
+               'lbuser1', 'lbuser2', 'lbuser3', 'lbuser4', 'lbuser5', 'lbuser6', 'lbuser7']
+real_headers = ['brsvd1', 'brsvd2', 'brsvd3', 'brsvd4', 'bdatum', 'bacc', 'blev', 'brlev', 'bhlev', 'bhrlev',
+                'bplat', 'bplon', 'bgor', 'bzy', 'bdy', 'bzx', 'bdx', 'bmdi', 'bmks']
+# extra data vector types.
+extra_data = {1: 'x', 2: 'y', 3: 'lower_y_domain', 4: 'lower_x_domain', 5: 'upper_y_domain',
+              6: 'upper_x_domain', 7: 'lower_z_domain', 8: 'upper_z_domain',
+              10: 'field_title', 11: 'domain_title',
+              12: 'x_lower_bound', 13: 'x_upper_bound', 14: 'y_lower_bound', 15: 'y_upper_bound'}
+# names for the axis codes in lbcode
+axis_names = {1: 'latitude', 2: 'longitude', 5: 'model_level', 13: 'site_number',
+              20: 'time', 21: 'time', 22: 'time', 23: 'time'}
+# calendars for the lbtim ic code.
+calendars = {1: 'proleptic_gregorian', 2: '360_day', 4: '365_day'}
+# units for co-ordinates with standard names. Timeseries times are days since year 0.
+coord_units = dict(time='days since 0000-01-01 00:00:00', latitude='degrees', longitude='degrees')
+
+
+@functools.lru_cache(maxsize=4)
+def header_dtype(byteorder: str = '>', word_size: int = 4) -> np.dtype:
+    """
+    Structured dtype for a PP header.
+    :param byteorder: '>' for big-endian (the usual case) or '<' for little-endian
+    :param word_size: 4 for 32-bit files and 8 for 64-bit files.
+    :return: numpy dtype with 45 integer and 19 real fields.
+    """
+    int_type = f"{byteorder}i{word_size}"
+    real_type = f"{byteorder}f{word_size}"
+    return np.dtype([(name, int_type) for name in int_headers] + [(name, real_type) for name in real_headers])
+
+
+class ppField:
+    """
+    A field from a PP file. Attributes are:
+        filename -- the file it came from.
+        header -- numpy structured (record) array containing the header.
+        data_offset -- offset in bytes of the data record in the file.
+        byteorder -- byte order of the file.
+        word_size -- size of words in bytes.
+    Data is only read when data (or extra) is used.
+    """
+
+    def __init__(self, filename: str, header: np.ndarray, data_offset: int, byteorder: str = '>',
+                 word_size: int = 4):
+        self.filename = filename
+        self.header = header
+        self.data_offset = data_offset
+        self.byteorder = byteorder
+        self.word_size = word_size
+
+    def __getattr__(self, name):
+        # header values as attributes (e.g. field.lbcode)
+        if name in int_headers or name in real_headers:
+            return self.header[name].item()
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return f"ppField {self.filename}@{self.data_offset} stash: {self.lbuser4} shape: {self.shape}"
+
+    @property
+    def shape(self) -> tuple:
+        """
+        Shape of the data -- (lbrow, lbnpt). If those are not set then the data length is used.
+        """
+        if (self.lbrow > 0) and (self.lbnpt > 0):
+            return self.lbrow, self.lbnpt
+        return (self.lblrec - self.lbext,)
+
+    def _memmap(self, dtype: str, offset_words: int, count: int) -> np.ndarray:
+        return np.memmap(self.filename, dtype=dtype, mode='r', shape=(count,),
+                         offset=self.data_offset + offset_words * self.word_size)
+
+    @property
+    def data(self) -> np.ndarray:
+        """
+        The field data. Unpacked data is memory-mapped. WGDOS packed data is unpacked using mo_pack.
+        Missing data is not masked. See to_dataarray.
+        """
+        pack = self.lbpack % 10
+        kind = {2: 'i', 3: 'i'}.get(self.lbuser1, 'f')  # 1 is real, 2 integer and 3 logical
+        dtype = f"{self.byteorder}{kind}{self.word_size}"
+        if pack == 0:  # unpacked
+            return self._memmap(dtype, 0, int(np.prod(self.shape))).reshape(self.shape)
+        if pack == 1:  # WGDOS
+            try:
+                import mo_pack
+            except ModuleNotFoundError:
+                raise NotImplementedError(f"WGDOS packed data in {self.filename} needs mo_pack (or use iris)")
+            nbytes = (self.lblrec - self.lbext) * self.word_size
+            packed = self._memmap('u1', 0, nbytes)
+            return mo_pack.decompress_wgdos(np.asarray(packed), self.lbrow, self.lbnpt, self.bmdi)
+        raise NotImplementedError(f"Packing {self.lbpack} in {self.filename} not supported")
+
+    @functools.cached_property
+    def extra(self) -> dict:
+        """
+        Extra data vectors indexed by name (see extra_data). Titles are returned as strings.
+        """
+        result = dict()
+        if self.lbext <= 0:
+            return result
+        ndata = self.lblrec - self.lbext
+        words = self._memmap(f"{self.byteorder}i{self.word_size}", ndata, self.lbext)
+        reals = words.view(f"{self.byteorder}f{self.word_size}")
+        indx = 0
+        while indx < self.lbext:
+            code = int(words[indx])
+            length, kind = divmod(code, 1000)
+            if length <= 0:  # something wrong.
+                break
+            name = extra_data.get(kind, f"extra_{kind}")
+            if kind in (10, 11):  # character data
+                value = words[indx + 1:indx + 1 + length].tobytes().decode('ascii', 'replace').strip()
+            else:
+                value = np.array(reals[indx + 1:indx + 1 + length])
+            result[name] = value
+            indx += length + 1
+        return result
+
+    def coords(self) -> (str, np.ndarray, str, np.ndarray):
+        """
+        Work out names and values of the y and x co-ordinates from lbcode, extra data and the header.
+        :return: y name, y values, x name, x values
+        """
+        lbcode = self.lbcode
+        if lbcode >= 10000:  # cross-section/time-series
+            ix, iy = (lbcode // 100) % 100, lbcode % 100
+        else:
+            ix, iy = 2, 1  # longitude/latitude
+        nrow, npt = self.shape if len(self.shape) == 2 else (1, self.shape[0])
+        y = self.extra.get('y')
+        if (y is None) or (len(y) != nrow) or np.all(y == 0):
+            y = self.bzy + self.bdy * (1 + np.arange(nrow))
+        x = self.extra.get('x')
+        if (x is None) or (len(x) != npt) or np.all(x == 0):
+            x = self.bzx + self.bdx * (1 + np.arange(npt))
+        return axis_names.get(iy, 'y'), y, axis_names.get(ix, 'x'), x
+
+    def to_dataarray(self, mask: bool = True) -> xarray.DataArray:
+        """
+        Convert to a xarray DataArray.
+        :param mask: If True set missing data (bmdi) to NaN. This reads the data.
+            If False data is left memory-mapped.
+        :return: DataArray
+        """
+        yname, y, xname, x = self.coords()
+        data = self.data.reshape(len(y), len(x))
+        attrs = dict(stash=self.lbuser4, lbproc=self.lbproc, lbtim=self.lbtim, lbcode=self.lbcode,
+                     bmdi=self.bmdi, filename=self.filename)
+        if 'field_title' in self.extra:
+            attrs['field_title'] = self.extra['field_title']
+        da = xarray.DataArray(data, dims=[yname, xname], coords={yname: y, xname: x}, attrs=attrs)
+        if mask:
+            da = da.where(da != self.bmdi)
+        if ('time' in da.dims) and (self.lbtim % 10 == 2):
+            # 360 day calendar with time in days since year 0. Add year & month like iris coord_categorisation.
+            time = da.time.values
+            da = da.assign_coords(year=('time', (time // 360).astype(int)),
+                                  month=('time', ((time % 360) // 30 + 1).astype(int)))
+        return da
+
+
+def read_headers(filename: typing.Union[str, os.PathLike]) -> (np.ndarray, list, str, int):
+    """
+    Read all headers in a PP file. Only the headers and record lengths are read.
+    :param filename: name of file.
+    :return: structured array of headers, list of data offsets, byteorder and word size.
+    """
+    filename = os.fspath(filename)
+    raw = np.memmap(filename, dtype='u1', mode='r')
+    if len(raw) == 0:
+        return np.zeros(0, dtype=header_dtype()), [], '>', 4
+    # work out byte order and word size from length of the first record. Header is 64 words.
+    for byteorder in ('>', '<'):
+        reclen = int(raw[0:4].view(f"{byteorder}i4")[0])
+        if reclen in (256, 512):
+            break
+    else:
+        raise ValueError(f"{filename} does not look like a PP file. First record length is {reclen}")
+    word_size = reclen // 64
+    marker = f"{byteorder}i4"  # record markers are always 4 bytes.
+    dtype = header_dtype(byteorder, word_size)
+    headers = []
+    offsets = []
+    posn = 0
+    while posn + 4 <= len(raw):
+        hlen = int(raw[posn:posn + 4].view(marker)[0])
+        if hlen != reclen:
+            raise ValueError(f"Bad header record length {hlen} at {posn} in {filename}")
+        headers.append(raw[posn + 4:posn + 4 + hlen].view(dtype)[0])
+        posn += hlen + 8
+        dlen = int(raw[posn:posn + 4].view(marker)[0])
+        offsets.append(posn + 4)
+        posn += dlen + 8
+    return np.array(headers, dtype=dtype), offsets, byteorder, word_size
+
+
+def load(filename: typing.Union[str, os.PathLike]) -> typing.List[ppField]:
+    """
+    Load fields from a PP file. Data is not read.
+    :param filename: name of file.
+    :return: list of ppField
+    """
+    headers, offsets, byteorder, word_size = read_headers(filename)
+    return [ppField(os.fspath(filename), header, offset, byteorder=byteorder, word_size=word_size)
+            for header, offset in zip(headers, offsets)]
+
+
+def load_dataarray(filename: typing.Union[str, os.PathLike], mask: bool = True) -> xarray.DataArray:
+    """
+    Load a PP file as a DataArray. If there is more than one field then they are stacked
+       along a new "field" dimension (so must all have the same shape).
+    :param filename: name of file
+    :param mask: If True set missing data to NaN. See ppField.to_dataarray
+    :return: DataArray
+    """
+    fields = [field.to_dataarray(mask=mask) for field in load(filename)]
+    if len(fields) == 1:
+        return fields[0]
+    return xarray.concat(fields, dim='field', coords='minimal', compat='override', combine_attrs='drop_conflicts')
+
+
+def is_timeseries(filename: typing.Union[str, os.PathLike]) -> bool:
+    """
+    :param filename: name of file
+    :return: True if filename is an ummonitor timeseries (ts_*.pp) file.
+    """
+    name = os.path.basename(os.fspath(filename))
+    return name.startswith('ts_') and name.endswith('.pp')
+
+
+def cube_metadata(field: ppField) -> dict:
+    """
+    Metadata needed to make an iris cube from a field. Does not need iris.
+    :param field: field to generate metadata for.
+    :return: dict with keys:
+        stash -- stash code as a string (e.g. m01s16i203).
+        calendar -- calendar from lbtim.
+        dims -- list of (name, values, units) for the y and x co-ordinates.
+        title -- field title from the extra data (None if not present).
+    """
+    yname, y, xname, x = field.coords()
+    model = field.lbuser7 if field.lbuser7 > 0 else 1  # some ummonitor files do not set the model.
+    section, item = divmod(field.lbuser4, 1000)
+    calendar = calendars.get(field.lbtim % 10, 'proleptic_gregorian')
+    dims = [(name, values, coord_units.get(name, '1')) for name, values in ((yname, y), (xname, x))]
+    return dict(stash=f"m{model:02d}s{section:02d}i{item:03d}", calendar=calendar, dims=dims,
+                title=field.extra.get('field_title'))
+
+
+def load_cube(filename: typing.Union[str, os.PathLike]):
+    """
+    Load a single field PP file (e.g. a ummonitor timeseries) as an iris cube without using the iris PP loader.
+    Much faster than iris.load_cube. Needs iris (imported when called).
+    :param filename: name of file
+    :return: iris cube with masked data, dimension co-ordinates and names/units from the stash code.
+    """
+    import cf_units
+    import iris.coords
+    import iris.cube
+    import iris.fileformats.pp
+    import iris.fileformats.um_cf_map
+
+    fields = load(filename)
+    if len(fields) != 1:
+        raise ValueError(f"Expected one field in {filename} got {len(fields)}")
+    field = fields[0]
+    meta = cube_metadata(field)
+    data = field.data
+    data = np.ma.masked_equal(data.reshape([len(d[1]) for d in meta['dims']]), field.bmdi)
+    dim_coords = []
+    for indx, (name, values, units) in enumerate(meta['dims']):
+        if name == 'time':
+            units = cf_units.Unit(units, calendar=meta['calendar'])
+        kwargs = dict(standard_name=name) if name in coord_units else dict(long_name=name)
+        dim_coords.append((iris.coords.DimCoord(np.asarray(values), units=units, **kwargs), indx))
+    cf = iris.fileformats.um_cf_map.STASH_TO_CF.get(meta['stash'])
+    cube = iris.cube.Cube(data, dim_coords_and_dims=dim_coords,
+                          attributes=dict(STASH=iris.fileformats.pp.STASH.from_msi(meta['stash'])))
+    if cf is not None:
+        cube.standard_name = cf.standard_name
+        cube.long_name = cf.long_name
+        cube.units = cf.units
+    elif meta['title']:
+        cube.long_name = meta['title']
+    return cube
+
+
+class pp_cache:
+    """
+    Persistent (disk) cache of parsed PP files shared between processes. Attributes are:
+        root -- directory where cache files are.
+        max_bytes -- maximum total size of cache files. Least recently used files are removed when exceeded.
+    Entries are keyed on the absolute path, modification time and size of the PP file so change if the file changes.
+    Each entry is a compressed npz file containing the data and all co-ordinates (including year and month)
+       which is written atomically.
+    """
+
+    def __init__(self, root: typing.Union[str, os.PathLike], max_bytes: int = 1024 ** 3):
+        """
+        Create cache
+        :param root: directory for cache. Created if it does not exist.
+        :param max_bytes: maximum size of cache in bytes. Default is 1 Gbyte.
+        """
+        self.root = pathlib.Path(root).expanduser()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def path(self, filename: typing.Union[str, os.PathLike]) -> pathlib.Path:
+        """
+        :param filename: PP file
+        :return: path to cache file for filename.
+        """
+        filename = pathlib.Path(filename).expanduser().absolute()
+        stat = filename.stat()
+        key = hashlib.sha256(f"{filename}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+        return self.root / (key + '.npz')
+
+    @staticmethod
+    def _load(path: pathlib.Path) -> xarray.DataArray:
+        with np.load(path, allow_pickle=False) as npz:
+            meta = json.loads(str(npz['meta']))
+            coords = {name: (dims, npz['coord_' + name]) for name, dims in meta['coords'].items()}
+            return xarray.DataArray(npz['data'], dims=meta['dims'], coords=coords, attrs=meta['attrs'])
+
+    def _save(self, path: pathlib.Path, da: xarray.DataArray):
+        meta = dict(dims=list(da.dims), coords={name: list(c.dims) for name, c in da.coords.items()},
+                    attrs=da.attrs)
+        arrays = {'coord_' + name: c.values for name, c in da.coords.items()}
+        fd, tmp_name = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            np.savez_compressed(fp, data=da.values, meta=json.dumps(meta, default=str), **arrays)
+        os.replace(tmp_name, path)  # so readers never see a partial file.
+
+    def read(self, filename: typing.Union[str, os.PathLike], mask: bool = True) -> xarray.DataArray:
+        """
+        Read a PP file using the cache. If not in the cache the file is parsed (see load_dataarray) and stored.
+        :param filename: PP file
+        :param mask: If True set missing data to NaN. Cache entries are only made for masked data.
+        :return: DataArray
+        """
+        if not mask:  # data stays memory-mapped so nothing to gain from caching.
+            return load_dataarray(filename, mask=False)
+        path = self.path(filename)
+        try:
+            da = self._load(path)
+            os.utime(path)  # mark as recently used.
+            my_logger.debug(f"Read {filename} from {path}")
+            return da
+        except (FileNotFoundError, ValueError, KeyError) as err:  # not there (or damaged) so parse file.
+            if not isinstance(err, FileNotFoundError):
+                my_logger.warning(f"Failed to read {path} for {filename}. Regenerating")
+        da = load_dataarray(filename, mask=True)
+        self._save(path, da)
+        self.evict()
+        return da
+
+    def size(self) -> int:
+        """
+        :return: total size in bytes of the cache.
+        """
+        return sum(p.stat().st_size for p in self.root.glob('*.npz'))
+
+    def evict(self) -> typing.List[pathlib.Path]:
+        """
+        Remove least recently used entries until the cache is no larger than max_bytes.
+        :return: list of entries removed.
+        """
+        entries = []
+        for path in self.root.glob('*.npz'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # removed by another process
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(e[1] for e in entries)
+        removed = []
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed.append(path)
+        if removed:
+            my_logger.info(f"Removed {len(removed)} entries from {self.root}")
+        return removed
+
+
+@functools.lru_cache(maxsize=8)
+def _get_cache(root: str) -> pp_cache:
+    return pp_cache(root)
+
+
+def read_array(filename: typing.Union[str, os.PathLike],
+               cache_dir: typing.Optional[typing.Union[str, os.PathLike]] = None) -> xarray.DataArray:
+    """
+    Read a PP file as a DataArray for code that only needs the data and co-ordinates (not an iris cube).
+    :param filename: PP file
+    :param cache_dir: directory for a pp_cache. If None then $OPTCLIM_PP_CACHE is used.
+      If neither is set the file is read directly (see load_dataarray).
+    :return: DataArray with missing data set to NaN.
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get('OPTCLIM_PP_CACHE')
+    if not cache_dir:
+        return load_dataarray(filename)
+    return _get_cache(os.fspath(cache_dir)).read(filename)
+
+
+class test_ppFile(unittest.TestCase):
+    """
+    Test cases for ppFile. Uses the ummonitor data in Configurations/time_cache.
+    """
+
+    def setUp(self):
+        root = os.path.expandvars("$OPTCLIMTOP/Configurations/time_cache")
+        if not os.path.isdir(root):
+            self.skipTest(f"{root} not found")
+        self.files = sorted(os.path.join(root, d, f) for d in os.listdir(root)
+                            for f in os.listdir(os.path.join(root, d)) if f.endswith('.pp'))
+
+    def test_load(self):
+        """
+        Test that all test files can be read and that time-series have the expected structure.
+        """
+        for file in self.files:
+            with self.subTest(file=file):
+                fields = load(file)
+                self.assertGreater(len(fields), 0)
+                for field in fields:
+                    self.assertEqual(field.data.size, np.prod(field.shape))
+        file = [f for f in self.files if f.endswith('xnilb.000003/ts_t50.pp')][0]
+        da = load_dataarray(file)
+        self.assertEqual(da.dims, ('time', 'site_number'))
+        self.assertEqual(da.shape, (160, 3))
+        self.assertEqual(float(da.time[1] - da.time[0]), 90.)  # seasonal data on a 360 day calendar.
+        self.assertEqual(da.attrs['stash'], 16203)
+        self.assertTrue(np.all((da > 150) & (da < 300)))  # temperatures at 50 hPa.
+        self.assertEqual((int(da.year[0]), int(da.month[0])), (42, 1))  # starts at DJF 41/42
+
+    def test_pp_cache(self):
+        """
+        Test the persistent cache gives the same values, is reused and evicts least recently used entries.
+        """
+        import shutil
+        import time
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = pp_cache(tmpdir)
+            files = self.files[0:3]
+            for file in files:
+                expect = load_dataarray(file)
+                got = cache.read(file)
+                xarray.testing.assert_identical(got, expect)
+                path = cache.path(file)
+                self.assertTrue(path.exists())
+                mtime = path.stat().st_mtime_ns
+                got = cache.read(file)  # now from cache
+                xarray.testing.assert_identical(got, expect)
+                self.assertGreaterEqual(path.stat().st_mtime_ns, mtime)
+            # changing the file gives a new entry.
+            copy = pathlib.Path(tmpdir) / 'copy.pp'
+            shutil.copy(files[0], copy)
+            path = cache.path(copy)
+            cache.read(copy)
+            time.sleep(0.01)
+            os.utime(copy, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+            self.assertNotEqual(cache.path(copy), path)
+            # eviction. Make the 1st file the most recently used so others get removed.
+            cache.read(files[0])
+            cache.max_bytes = cache.path(files[0]).stat().st_size
+            removed = cache.evict()
+            self.assertGreater(len(removed), 0)
+            self.assertTrue(cache.path(files[0]).exists())
+            self.assertLessEqual(cache.size(), cache.max_bytes)
+
+    def test_read_array(self):
+        """
+        Test read_array uses the cache when asked (by argument or $OPTCLIM_PP_CACHE) and reads directly otherwise.
+        """
+        from unittest import mock
+        file = self.files[0]
+        expect = load_dataarray(file)
+        with tempfile.TemporaryDirectory() as tmpdir, mock.patch.dict(os.environ):
+            os.environ.pop('OPTCLIM_PP_CACHE', None)
+            xarray.testing.assert_identical(read_array(file), expect)
+            cache_dir = pathlib.Path(tmpdir) / 'arg'
+            self.assertFalse(cache_dir.exists())
+            xarray.testing.assert_identical(read_array(file, cache_dir=cache_dir), expect)
+            self.assertTrue(pp_cache(cache_dir).path(file).exists())
+            env_dir = pathlib.Path(tmpdir) / 'env'
+            os.environ['OPTCLIM_PP_CACHE'] = str(env_dir)
+            xarray.testing.assert_identical(read_array(file), expect)
+            self.assertTrue(pp_cache(env_dir).path(file).exists())
+            with mock.patch(f"{__name__}.load_dataarray") as load_fn:  # now comes from the cache
+                xarray.testing.assert_identical(read_array(file), expect)
+                load_fn.assert_not_called()
+
+    def test_cube_metadata(self):
+        """
+        Test metadata for the ummonitor timeseries files (used by load_cube)
+        """
+        ts_files = [f for f in self.files if is_timeseries(f)]
+        self.assertGreater(len(ts_files), 0)
+        self.assertFalse(is_timeseries('sst.pp'))
+        for file in ts_files:
+            with self.subTest(file=file):
+                field, = load(file)
+                meta = cube_metadata(field)
+                self.assertRegex(meta['stash'], r'^m0[12]s\d\di\d\d\d$')
+                self.assertIn(meta['calendar'], calendars.values())
+                self.assertEqual(tuple(len(d[1]) for d in meta['dims']), field.shape)
+                names = [d[0] for d in meta['dims']]
+                self.assertIn('time', names)
+                units = {d[0]: d[2] for d in meta['dims']}
+                self.assertEqual(units['time'], coord_units['time'])
+        field, = load([f for f in ts_files if f.endswith('xnilb.000003/ts_t50.pp')][0])
+        meta = cube_metadata(field)
+        self.assertEqual(meta['stash'], 'm01s16i203')
+        self.assertEqual(meta['calendar'], '360_day')
+        self.assertEqual([d[0] for d in meta['dims']], ['time', 'site_number'])
+
+    def test_load_cube(self):
+        """
+        Test load_cube against iris (if available) for the ummonitor timeseries files.
+        """
+        try:
+            import iris
+        except ModuleNotFoundError:
+            self.skipTest("iris not available")
+        for file in [f for f in self.files if is_timeseries(f)]:
+            with self.subTest(file=file):
+                cube = load_cube(file)
+                expect = load_dataarray(file)
+                self.assertEqual(cube.shape, expect.shape)
+                np.testing.assert_allclose(np.ma.filled(cube.data.astype(float), np.nan), expect.values)
+                np.testing.assert_allclose(cube.coord('time').points, expect.time.values)
+                self.assertEqual(cube.coord('time').units.calendar, cube_metadata(load(file)[0])['calendar'])
+
+    def test_compare_iris(self):
+        """
+        Compare with iris (if available) and report time taken by both.
+        """
+        import time
+        try:
+            import iris
+        except ModuleNotFoundError:
+            self.skipTest("iris not available")
+        start = time.perf_counter()
+        native = [load_dataarray(file).values for file in self.files]
+        time_native = time.perf_counter() - start
+        start = time.perf_counter()
+        cubes = []
+        for file in self.files:
+            try:
+                cubes.append(iris.load_cube(file).data)
+            except Exception:  # iris fails on some ummonitor files.
+                cubes.append(None)
+        time_iris = time.perf_counter() - start
+        for file, got, expect in zip(self.files, native, cubes):
+            if expect is not None and np.size(expect) == got.size:
+                np.testing.assert_allclose(np.ma.filled(expect.astype(float), np.nan).ravel(), got.ravel(),
+                                           err_msg=f"Mismatch for {file}")
+        print(f"ppFile took {time_native:.3f}s; iris took {time_iris:.3f}s for {len(self.files)} files")
+
+
+if __name__ == "__main__":
+    unittest.main()
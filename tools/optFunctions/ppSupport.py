@@ -16,20 +16,34 @@ import iris.fileformats.pp as pp
 import iris.util
 import numpy as np
 
+import ppFile
 
 
-def readPP(file, realization=None):
+
+def readPP(file, realization=None, array_only=False):
     """
-    Read in pp data and add some aux co-ords.
+    Read in pp data and add some aux co-ords. ummonitor timeseries (ts_*.pp) files are read with ppFile.load_cube
+      which is much faster than iris. iris is used if that fails.
     :param dir: name of directory relative to time-cache
     :param name:name of file
-    :return: cube
+    :param array_only: If True return a xarray DataArray rather than a cube. See ppFile.read_array.
+       Data comes from the cache in $OPTCLIM_PP_CACHE if that is set. For code that only needs the data.
+    :return: cube (or DataArray if array_only)
     """
-    # need str as iris does not handle filepath
-    try:
-        cube = iris.load_cube(str(file))  # use normal iris stuff
-    except AttributeError:
-        cube = read_pp(str(file))  # use hacked pp read.
+    if array_only:
+        return ppFile.read_array(file)
+    cube = None
+    if ppFile.is_timeseries(file):  # fast path for ummonitor timeseries. Fall back to iris if it fails.
+        try:
+            cube = ppFile.load_cube(file)
+        except (ValueError, NotImplementedError) as err:
+            print(f"Failed to read {file} with ppFile ({err}). Using iris")
+    if cube is None:
+        # need str as iris does not handle filepath
+        try:
+            cube = iris.load_cube(str(file))  # use normal iris stuff
+        except AttributeError:
+            cube = read_pp(str(file))  # use hacked pp read.
 
     # add a aux co - ord with the filename
     new_coord = iris.coords.AuxCoord(file, long_name='fileName', units='no_unit')
@@ -40,9 +54,9 @@ def readPP(file, realization=None):
     return cube
 
 
-def readFile(dir, name, realization=None):
+def readFile(dir, name, realization=None, array_only=False):
     fullname = os.path.join(dir, name)
-    pp = readPP(fullname, realization=realization)
+    pp = readPP(fullname, realization=realization, array_only=array_only)
     return pp
 
 
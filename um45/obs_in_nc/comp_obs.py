@@ -28,6 +28,8 @@ import argparse  # parse arguments
 import os  # OS support
 import pathlib
 
+from comp_obs_xarray import region_masks, region_sums  # iris free so can be tested.
+
 
 ##
 
@@ -108,32 +110,36 @@ def means(cube, name=None, start_time=None, end_time=None, mask=None, mask_name=
         cube_internal.data = numpy.ma.array(cube_internal.data, mask=(lmask == 0))
         cube_internal.attributes['mask_attrib'] = mask_attribute
 
-    ## constraints
-    constraints = {
-        'GLOBAL': None,
-        'NHX': iris.Constraint(coord_values={'latitude': lambda y: y > 30.0}),
-        'TROPICS': iris.Constraint(coord_values={'latitude': lambda y: -30 <= y <= 30.0}),
-        'SHX': iris.Constraint(coord_values={'latitude': lambda y: y < -30.0}),
-    }
-
-    means = []  # empty list  to put results in
     if timeMean:
-
         time_constraint = periodConstraint(cube_internal, start_time, end_time)  # time range we want
+        cube_internal = cube_internal.extract(time_constraint)
         vars = ['time', 'latitude', 'longitude']
     else:
-        time_constraint = iris.Constraint(None)  # no time constraint/
         vars = ['latitude', 'longitude']
+    if (verbose >= 3):
+        print("cube_internal is size", cube_internal.shape)
+
+    vars = [v for v in vars if cube_internal.coord_dims(v)]  # scalar co-ords (e.g. a single time) have no dims.
+    # area weights computed once for the full grid. All regions are then reduced together.
+    wt = iris.analysis.cartography.area_weights(cube_internal)
+    lat_coord = cube_internal.coord('latitude')
+    lat_dim, = cube_internal.coord_dims(lat_coord)
+    # meta-data for the means comes from collapsing a single latitude row. Much cheaper than the full grid.
+    row = [slice(None)] * cube_internal.ndim
+    row[lat_dim] = slice(0, 1)
+    template = cube_internal[tuple(row)].collapsed(vars, iris.analysis.MEAN)
+    regions = region_masks(lat_coord.points)
+    sums, totals = region_sums(cube_internal.data, wt, lat_dim,
+                               [cube_internal.coord_dims(v)[0] for v in vars if v != 'latitude'], regions)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        region_means = numpy.ma.masked_invalid(sums / totals)
 
-    for key in constraints:  # iterate over constraints
-        constraint = constraints[key]
-        cc = cube_internal.extract(time_constraint & constraint)  # extract to the sub-region and time  we want
-        if (verbose >= 3):
-            print("CC is size", cc.shape)
-
-        wt = iris.analysis.cartography.area_weights(cc)  # compute the area weights
-        mn = cc.collapsed(vars, iris.analysis.MEAN, weights=wt)  # average and store in the hash
-
+    means = []  # empty list  to put results in
+    for indx, key in enumerate(regions.keys()):  # iterate over regions
+        mn = template.copy(data=region_means[..., indx].astype(template.dtype))
+        # latitude co-ord as if collapsed over the region.
+        lat_indx = numpy.flatnonzero(regions[key])
+        mn.replace_coord(lat_coord[lat_indx[0]:lat_indx[-1] + 1].collapsed())
         mn.rename(int_name + "_" + key)  # give processed cube a useful name
         means.append(mn)  # append to the list
 
@@ -72,6 +72,45 @@ def genProcess(dataset, land_mask, latitude_coord='latitude',):
 
     return process
 
+def region_masks(latitude):
+    """
+    Regions as boolean latitude masks. Regions are:
+    GLOBAL, NHX (north of 30N), TROPICS (30S to 30N inclusive) and SHX (south of 30S)
+    :param latitude -- latitude values
+    :return dict of boolean arrays (one per region) with the same length as latitude.
+    """
+    latitude = np.asarray(latitude)
+    return {
+        'GLOBAL': np.ones(latitude.shape, dtype=bool),
+        'NHX': latitude > 30.0,
+        'TROPICS': (latitude >= -30.0) & (latitude <= 30.0),
+        'SHX': latitude < -30.0,
+    }
+
+
+def region_sums(data, weights, lat_dim, collapse_dims, regions):
+    """
+    Compute weighted sums (and sums of weights) for all regions with one contraction over latitude.
+    Missing data is ignored.
+    :param data -- data (can be masked)
+    :param weights -- weights with same shape as data
+    :param lat_dim -- dimension of latitude
+    :param collapse_dims -- other dimensions to sum over.
+    :param regions -- dict of latitude masks (see region_masks)
+    :return sums and sums of weights -- shape is the remaining dimensions then regions.
+    """
+    valid = ~np.ma.getmaskarray(data)
+    wt = np.where(valid, weights, 0.0)
+    collapse_dims = tuple(sorted(collapse_dims))
+    wsum = (wt * np.ma.filled(data, 0.0)).sum(axis=collapse_dims)
+    wtot = wt.sum(axis=collapse_dims)
+    lat_axis = lat_dim - sum(d < lat_dim for d in collapse_dims)  # position of latitude after summing.
+    matrix = np.array(list(regions.values()), dtype=float)  # region x latitude
+    sums = np.moveaxis(wsum, lat_axis, -1) @ matrix.T
+    totals = np.moveaxis(wtot, lat_axis, -1) @ matrix.T
+    return sums, totals
+
+
 def means(dataArray, name, latitude_coord='latitude'):
     """ 
     Compute means for NH extra tropics, Tropics and SH extra Tropics. 
@@ -221,6 +260,43 @@ class testComp_obs_xarray(unittest.TestCase):
         Standard setup for all test cases
         :return: nada
         """
+        rng = np.random.default_rng(123456)
+        self.latitude = np.linspace(-88.75, 88.75, 72)
+        self.data = np.ma.masked_array(rng.normal(size=(4, 72, 96)), mask=rng.uniform(size=(4, 72, 96)) > 0.8)
+        self.weights = np.broadcast_to(np.cos(np.deg2rad(self.latitude))[np.newaxis, :, np.newaxis],
+                                       self.data.shape)
+
+    def test_region_masks(self):
+        """
+        Test regions are as expected.
+        """
+        regions = region_masks(np.array([-90., -30.1, -30, 0, 30, 30.1, 90.]))
+        self.assertEqual(list(regions.keys()), ['GLOBAL', 'NHX', 'TROPICS', 'SHX'])
+        np.testing.assert_array_equal(regions['GLOBAL'], [True] * 7)
+        np.testing.assert_array_equal(regions['NHX'], [False, False, False, False, False, True, True])
+        np.testing.assert_array_equal(regions['TROPICS'], [False, False, True, True, True, False, False])
+        np.testing.assert_array_equal(regions['SHX'], [True, True, False, False, False, False, False])
+
+    def test_region_sums(self):
+        """
+        Test region_sums gives the same means as np.ma.average for each region. Both time mean and not.
+        """
+        regions = region_masks(self.latitude)
+        for lat_dim, collapse_dims, data, weights in [(1, [0, 2], self.data, self.weights),
+                                                      (0, [1], self.data[0], self.weights[0])]:
+            sums, totals = region_sums(data, weights, lat_dim, collapse_dims, regions)
+            self.assertEqual(sums.shape, (len(regions),))
+            for indx, (name, msk) in enumerate(regions.items()):
+                with self.subTest(region=name, lat_dim=lat_dim):
+                    expect = np.ma.average(np.compress(msk, data, axis=lat_dim),
+                                           weights=np.compress(msk, weights, axis=lat_dim))
+                    self.assertAlmostEqual(sums[indx] / totals[indx], float(expect))
+        # not collapsing time gives a time-series of means.
+        sums, totals = region_sums(self.data, self.weights, 1, [2], regions)
+        self.assertEqual(sums.shape, (4, len(regions)))
+        for t in range(4):
+            expect = np.ma.average(self.data[t], weights=self.weights[t])
+            self.assertAlmostEqual(sums[t, 0] / totals[t, 0], float(expect))
 
 
 if __name__ == "__main__":
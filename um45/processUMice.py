@@ -115,10 +115,10 @@ ice = minMaxIceE(ts,year=year)
 cacheInfo.update(ice)
 # and compute the global mean temperature
 temp_file = cacheroot / (rootDir.name+'.000100') / 'ts_t15.pp'
-t15 = ppSupport.readPP(temp_file)
-t15 = t15.extract(iris.Constraint(site_number=3,
-                        year = lambda yr:  yearRange[0] <= yr < yearRange[1]))
-cacheInfo.update(SAT=float(t15.data.mean()))
+t15 = ppSupport.readPP(temp_file, array_only=True)  # only need the data so no cube.
+t15 = t15.sel(site_number=3)
+t15 = t15.where((yearRange[0] <= t15.year) & (t15.year < yearRange[1]), drop=True)
+cacheInfo.update(SAT=float(t15.mean()))
 with open(outputFile, 'w') as outfile:
     json.dump(cacheInfo, outfile)
 